@@ -0,0 +1,21 @@
+from django.contrib import admin
+from . import keys
+from .models import APIKey
+
+
+@admin.register(APIKey)
+class APIKeyAdmin(admin.ModelAdmin):
+    list_display = ['prefix', 'name', 'site', 'device', 'created_at', 'revoked_at']
+    list_filter = ['site']
+    search_fields = ['=prefix', 'name', 'device']
+    readonly_fields = ['prefix', 'key_hash', 'created_at', 'revoked_at']
+    actions = ['revoke']
+
+    def has_add_permission(self, request):
+        # The key is only shown once, by `manage.py create_api_key`
+        return False
+
+    @admin.action(description='Revoke selected keys')
+    def revoke(self, request, queryset):
+        revoked = sum(keys.revoke(prefix) for prefix in queryset.values_list('prefix', flat=True))
+        self.message_user(request, f"Revoked {revoked} keys")
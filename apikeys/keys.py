@@ -0,0 +1,187 @@
+"""
+API key checks, with a per-process cache and revocation through Redis.
+
+A key looks like ``<prefix>.<secret>``. Only the SHA-256 of the whole key
+is stored, and the prefix finds its row. Keys are random and long, so a
+plain hash is enough and a stolen table can't be used to authenticate.
+
+Looked-up prefixes are cached in each process for API_KEY_CACHE_TTL_SECONDS,
+so steady-state authentication runs no query. The cache holds at most
+API_KEY_CACHE_SIZE prefixes, and keys whose prefix isn't one ``create`` could
+have made are rejected without a query, so made-up keys can't fill it. ``revoke`` publishes the
+prefix on Redis, and a listener thread in every process drops it from the
+cache straight away. If Redis is unreachable the TTL still bounds how long a
+revoked key keeps working. Hashes and the legacy key are compared with
+hmac.compare_digest.
+"""
+
+import hashlib
+import hmac
+import logging
+import re
+import secrets
+import threading
+import time
+from collections import namedtuple
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import APIKey
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'api_key_revocations'
+
+# Seconds the listener waits before resubscribing after a Redis error
+LISTENER_RETRY_SECONDS = 5
+
+PREFIX_BYTES = 6
+PREFIX = re.compile(rf'^[0-9a-f]{{{PREFIX_BYTES * 2}}}$')
+
+# What request.auth holds for an authenticated request
+Key = namedtuple('Key', ['id', 'prefix', 'name', 'site', 'device'])
+
+# The shared settings.API_KEY, accepted until every till has its own key
+LEGACY_KEY = Key(id=None, prefix=None, name='legacy', site=None, device=None)
+
+_cache = {}
+_lock = threading.Lock()
+_listener = None
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=int(settings.REDIS_DB),
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def hash_key(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def create(name, site, device=''):
+    """
+    Create a new key
+
+    Returns:
+        (APIKey, key), the key is not stored and can't be shown again
+    """
+    prefix = secrets.token_hex(PREFIX_BYTES)
+    api_key = f"{prefix}.{secrets.token_urlsafe(32)}"
+    row = APIKey.objects.create(prefix=prefix, key_hash=hash_key(api_key), name=name, site=site, device=device)
+    return row, api_key
+
+
+def lookup(prefix):
+    """
+    The cached (key_hash, Key) for a prefix, loading it when missing or stale
+
+    Unknown and revoked prefixes are cached as None. When the cache is full
+    the prefixes loaded longest ago, the next to go stale, are dropped.
+    """
+    ensure_listener()
+    entry = _cache.get(prefix)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    row = (
+        APIKey.objects.filter(prefix=prefix, revoked_at__isnull=True)
+        .values_list('key_hash', 'id', 'prefix', 'name', 'site', 'device')
+        .first()
+    )
+    found = (row[0], Key(*row[1:])) if row is not None else None
+    with _lock:
+        # Reinserted so the dict stays in load order
+        _cache.pop(prefix, None)
+        _cache[prefix] = (time.monotonic() + settings.API_KEY_CACHE_TTL_SECONDS, found)
+        while len(_cache) > settings.API_KEY_CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+    return found
+
+
+def check(api_key):
+    """
+    The Key for a valid API key
+
+    Returns:
+        Key, LEGACY_KEY for the shared settings.API_KEY, or None if invalid
+    """
+    prefix, dot, _ = api_key.partition('.')
+    if dot and PREFIX.match(prefix):
+        found = lookup(prefix)
+        if found is not None and hmac.compare_digest(hash_key(api_key), found[0]):
+            return found[1]
+
+    legacy = settings.API_KEY
+    if legacy and hmac.compare_digest(api_key.encode(), legacy.encode()):
+        return LEGACY_KEY
+    return None
+
+
+def revoke(prefix):
+    """
+    Revoke a key in every process
+
+    Returns:
+        True if a key was revoked, False if there was no live key with that prefix
+    """
+    revoked = APIKey.objects.filter(prefix=prefix, revoked_at__isnull=True).update(revoked_at=timezone.now())
+    evict(prefix)
+    transaction.on_commit(lambda: publish(prefix))
+    return bool(revoked)
+
+
+def publish(prefix):
+    try:
+        get_redis().publish(CHANNEL, prefix)
+    except redis.RedisError:
+        logger.warning("Could not publish revocation of API key %s, it expires from caches within %ss",
+                       prefix, settings.API_KEY_CACHE_TTL_SECONDS, exc_info=True)
+
+
+def evict(prefix):
+    with _lock:
+        _cache.pop(prefix, None)
+
+
+def clear():
+    """Forget every cached key"""
+    with _lock:
+        _cache.clear()
+
+
+def listen():
+    """Evict revoked prefixes as they are published, resubscribing after errors"""
+    while True:
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            # Revocations missed while not subscribed
+            clear()
+            for message in pubsub.listen():
+                evict(message['data'])
+        except redis.RedisError:
+            logger.warning("API key revocation listener lost Redis, retrying", exc_info=True)
+            time.sleep(LISTENER_RETRY_SECONDS)
+
+
+def ensure_listener():
+    """Start this process's revocation listener on first use"""
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return
+    with _lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=listen, name='api-key-revocations', daemon=True)
+            _listener.start()
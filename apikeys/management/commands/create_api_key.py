@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apikeys import keys
+
+
+class Command(BaseCommand):
+    help = 'Create an API key for a till and print it (it cannot be shown again)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Name for the key, e.g. "Bar till 1"')
+        parser.add_argument('--site', required=True, help='Site the till belongs to')
+        parser.add_argument('--device', default='', help='Device identifier, e.g. a serial number')
+
+    def handle(self, *args, **options):
+        row, api_key = keys.create(options['name'], options['site'], options['device'])
+        self.stdout.write(api_key)
+        self.stdout.write(self.style.SUCCESS(f"Created key {row.prefix} for {row.name} at {row.site}"))
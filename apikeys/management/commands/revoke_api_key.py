@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from apikeys import keys
+
+
+class Command(BaseCommand):
+    help = 'Revoke an API key in every process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('prefix', help='The part of the key before the dot')
+
+    def handle(self, *args, **options):
+        if not keys.revoke(options['prefix']):
+            raise CommandError(f"No live API key with prefix {options['prefix']}")
+        self.stdout.write(self.style.SUCCESS(f"Revoked key {options['prefix']}"))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=16, unique=True)),
+                ('key_hash', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=100)),
+                ('site', models.CharField(db_index=True, max_length=50)),
+                ('device', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('revoked_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'API key',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import models
+
+
+class APIKey(models.Model):
+	"""A till's API key, stored as the SHA-256 of the key and found by its prefix"""
+	prefix = models.CharField(max_length=16, unique=True)
+	key_hash = models.CharField(max_length=64)
+	name = models.CharField(max_length=100)
+	site = models.CharField(max_length=50, db_index=True)
+	device = models.CharField(max_length=100, blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	revoked_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		verbose_name = 'API key'
+
+	def __str__(self):
+		return f"{self.name} ({self.prefix})"
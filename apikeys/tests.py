@@ -0,0 +1,108 @@
+import time
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework import status
+from epos.authentication import check_api_key
+from . import keys
+from .models import APIKey
+
+
+class APIKeyTests(APITestCase):
+    """Test per-till API keys"""
+
+    def setUp(self):
+        keys.clear()
+        self.addCleanup(keys.clear)
+        self.row, self.api_key = keys.create('Bar till 1', site='soho', device='T-100')
+
+    def test_key_authenticates(self):
+        """Test a key authenticates and carries its site and device"""
+        response = self.client.get(reverse('floor'), HTTP_X_API_KEY=self.api_key)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        key = check_api_key(self.api_key)
+        self.assertEqual((key.id, key.site, key.device), (self.row.id, 'soho', 'T-100'))
+        self.assertNotIn(self.api_key.partition('.')[2], self.row.key_hash)
+
+    def test_cached_lookup(self):
+        """Test a key is only looked up once while it is cached"""
+        check_api_key(self.api_key)
+
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(check_api_key(self.api_key))
+
+        keys.clear()
+        with override_settings(API_KEY_CACHE_TTL_SECONDS=0), self.assertNumQueries(2):
+            self.assertIsNotNone(check_api_key(self.api_key))
+            self.assertIsNotNone(check_api_key(self.api_key))
+
+    def test_wrong_keys_rejected(self):
+        """Test a wrong secret, an unknown prefix and a revoked key are rejected"""
+        other, other_key = keys.create('Bar till 2', site='soho')
+        APIKey.objects.filter(id=other.id).update(revoked_at=timezone.now())
+
+        for api_key in (self.api_key[:-1] + '!', 'ffffffffffff.secret', other_key, self.api_key + '.'):
+            with self.subTest(api_key=api_key):
+                self.assertIsNone(check_api_key(api_key))
+                response = self.client.get(reverse('floor'), HTTP_X_API_KEY=api_key)
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cache_bounded(self):
+        """Test made-up keys run no query and the cache never outgrows API_KEY_CACHE_SIZE"""
+        with self.assertNumQueries(0):
+            for api_key in ('x' * 40 + '.secret', 'FFFFFFFFFFFF.secret', 'abc.secret'):
+                self.assertIsNone(check_api_key(api_key))
+
+        with override_settings(API_KEY_CACHE_SIZE=3):
+            for n in range(5):
+                self.assertIsNone(check_api_key(f'{n:012x}.secret'))
+                self.assertLessEqual(len(keys._cache), 3)
+            self.assertIsNotNone(check_api_key(self.api_key))
+
+            # The listener may clear the cache when it subscribes, never grow it
+            self.assertLessEqual(len(keys._cache), 3)
+            self.assertNotIn('000000000000', keys._cache)
+
+    def test_revoke(self):
+        """Test revoking drops the key here at once and tells other processes"""
+        check_api_key(self.api_key)
+
+        with patch.object(keys, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            call_command('revoke_api_key', self.row.prefix, stdout=StringIO())
+
+        publish.assert_called_once_with(self.row.prefix)
+        self.assertIsNone(check_api_key(self.api_key))
+
+    def test_revocation_from_another_process(self):
+        """Test a published revocation evicts a cached key without waiting for the TTL"""
+        check_api_key(self.api_key)
+        # Revoked by another process, still cached here
+        APIKey.objects.filter(id=self.row.id).update(revoked_at=timezone.now())
+        self.assertIsNotNone(check_api_key(self.api_key))
+
+        keys.publish(self.row.prefix)
+        deadline = time.monotonic() + 5
+        while check_api_key(self.api_key) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(check_api_key(self.api_key))
+
+    def test_legacy_key(self):
+        """Test the shared API_KEY still works until it is unset"""
+        self.assertEqual(check_api_key('demo'), keys.LEGACY_KEY)
+
+        with override_settings(API_KEY=''):
+            self.assertIsNone(check_api_key('demo'))
+            self.assertIsNone(check_api_key(''))
+
+    def test_create_command(self):
+        """Test the command prints a working key"""
+        out = StringIO()
+        call_command('create_api_key', 'Kitchen screen', site='shoreditch', stdout=out)
+
+        key = check_api_key(out.getvalue().splitlines()[0])
+        self.assertEqual((key.name, key.site, key.device), ('Kitchen screen', 'shoreditch', ''))
@@ -0,0 +1,45 @@
+"""
+Admin search that only uses indexes.
+
+Django's '=' search fields are case-insensitive, so '=id' compares
+UPPER(id::text) and no index on the column can serve it. ExactSearchMixin
+reads the same search_fields but looks each one up with a plain equality,
+so every search is an index lookup on the tables too big to scan.
+"""
+
+from django.contrib.admin.utils import get_fields_from_path
+from django.db import connections, models
+from django.db.models import Q
+
+
+class ExactSearchMixin:
+    """
+    ModelAdmin search by exact matches on search_fields
+
+    Integer fields are only searched for terms that are whole numbers the
+    column can hold, and text fields for the term as typed.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        # isdigit() alone accepts digits such as '²' that int() rejects
+        number = int(term) if term.isascii() and term.isdigit() else None
+        ops = connections[queryset.db].ops
+        matches = Q()
+        for name in self.get_search_fields(request):
+            path = name.lstrip('=')
+            field = get_fields_from_path(self.model, path)[-1]
+            if field.is_relation:
+                field = field.target_field
+            if isinstance(field, models.IntegerField):
+                low, high = ops.integer_field_range(field.get_internal_type())
+                if number is not None and low <= number <= high:
+                    matches |= Q(**{path: number})
+            else:
+                matches |= Q(**{path: term})
+        if not matches:
+            return queryset.none(), False
+        return queryset.filter(matches), False
@@ -2,6 +2,8 @@
 ASGI config for epos project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The live tab feed at /api/feed is served directly by ``epos.feed``, so
+long-lived subscribers never tie up a Django request thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'epos.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402 (needs Django set up)
+from epos.feed import FEED_PATH, feed_application  # noqa: E402
+
+if settings.OPENAPI_SCHEMA_WARM_UP:
+    from epos.schema import warm_up
+    warm_up()
+
+# Only server processes run the reaper, not every manage.py command
+if settings.REAPER_IN_PROCESS:
+    from payment import reaper
+    reaper.start()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == FEED_PATH:
+        await feed_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
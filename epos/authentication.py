@@ -1,6 +1,17 @@
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from django.conf import settings
+
+from apikeys import keys
+
+
+def check_api_key(api_key):
+    """
+    Check an API key against the apikeys table and the legacy settings.API_KEY
+
+    Returns:
+        apikeys.keys.Key with the key's site and device, or None if invalid
+    """
+    return keys.check(api_key)
 
 
 class APIKeyAuthentication(BaseAuthentication):
@@ -13,11 +24,10 @@ class APIKeyAuthentication(BaseAuthentication):
         
         if not api_key:
             return None
-            
-        expected_api_key = getattr(settings, 'API_KEY', 'demo')
         
-        if api_key != expected_api_key:
+        key = check_api_key(api_key)
+        if key is None:
             raise AuthenticationFailed('Invalid API key')
             
-        # Return a tuple of (user, auth) - we don't need a user for this simple auth
-        return (None, api_key)
+        # Return a tuple of (user, auth) - request.auth is the key, with its site and device
+        return (None, key)
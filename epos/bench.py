@@ -0,0 +1,97 @@
+"""
+Microbenchmark registry and runner.
+
+Apps register cases in a ``benchmarks`` module using the ``benchmark``
+decorator. The ``benchmark`` management command discovers them, times them
+and saves or compares the results against a baseline file.
+"""
+
+import json
+import platform
+import timeit
+from datetime import datetime, timezone
+
+from django.db import transaction
+from django.test import override_settings
+from django.utils.module_loading import autodiscover_modules
+
+
+_registry = {}
+_overrides = {}
+
+
+def benchmark(name, **overrides):
+    """
+    Register a benchmark case
+
+    The decorated function does any setup (database rows, connections) and
+    returns a zero-argument callable which is the operation being timed.
+    Keyword arguments are settings overridden while the case runs.
+    """
+    def decorator(setup):
+        _registry[name] = setup
+        _overrides[setup] = overrides
+        return setup
+    return decorator
+
+
+def discover():
+    """Import every installed app's benchmarks module and return the cases"""
+    autodiscover_modules('benchmarks')
+    return dict(sorted(_registry.items()))
+
+
+def run_case(setup, repeat=5):
+    """
+    Time a single case and return the best seconds per operation
+
+    Setup and timing run inside a transaction that is always rolled back,
+    so cases can create whatever rows they need.
+    """
+    with transaction.atomic(), override_settings(**_overrides.get(setup, {})):
+        operation = setup()
+        timer = timeit.Timer(operation)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number))
+        transaction.set_rollback(True)
+    return best / number
+
+
+def load_baseline(path):
+    """Load the results stored in a baseline file"""
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save_baseline(path, results):
+    """Write results to a baseline file with some context about the machine"""
+    data = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline
+
+    Returns a list of (name, baseline_s, current_s, ratio) for every case that
+    is slower than the baseline by more than ``threshold`` (0.10 = 10%).
+    Cases missing from the baseline are ignored.
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = current / base
+        if ratio > 1 + threshold:
+            regressions.append((name, base, current, ratio))
+    return regressions
@@ -0,0 +1,205 @@
+"""
+Live tab event feed served as server-sent events.
+
+Each worker process holds a single Redis pub/sub subscription and fans
+events out to its connected clients through small in-memory queues, so an
+idle subscriber costs one coroutine and one queue. Clients connect to
+``GET /api/feed`` with their X-API-Key header and get their own site's
+events (see epos.sharding), which they can filter with ``?table=5&table=6``
+and/or ``?status=open``.
+
+A client that falls too far behind is disconnected rather than buffered
+without bound. It should reconnect and refetch the tabs it shows.
+"""
+
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from epos.authentication import check_api_key
+from epos.sharding import site_for
+from tabs.events import CHANNEL
+
+
+logger = logging.getLogger(__name__)
+
+FEED_PATH = '/api/feed'
+
+
+class Subscriber:
+    """A connected feed client and the events it wants"""
+
+    def __init__(self, tables=None, statuses=None, site=None):
+        self.site = site
+        self.tables = set(tables or ())
+        self.statuses = set(statuses or ())
+        self.queue = asyncio.Queue(maxsize=settings.FEED_QUEUE_SIZE)
+        self.lagged = False
+
+    def matches(self, event):
+        if self.site is not None and event.get('site') != self.site:
+            return False
+        if self.tables and event.get('table_number') not in self.tables:
+            return False
+        if self.statuses and event.get('status') not in self.statuses:
+            return False
+        return True
+
+    def offer(self, event):
+        """Queue an event without ever blocking the shared listener"""
+        if self.lagged or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+            # Wake the stream so it notices and disconnects
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class FeedHub:
+    """One Redis subscription per process, fanned out to every subscriber"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self._task = None
+        self._loop = None
+
+    def subscribe(self, subscriber):
+        self.subscribers.add(subscriber)
+        self._ensure_listening()
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def dispatch(self, event):
+        for subscriber in list(self.subscribers):
+            subscriber.offer(event)
+
+    def _ensure_listening(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._task = loop.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            client = redis.asyncio.Redis(
+                host=settings.REDIS_HOST,
+                port=int(settings.REDIS_PORT),
+                db=int(settings.REDIS_DB),
+                decode_responses=True
+            )
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        try:
+                            event = json.loads(message['data'])
+                        except ValueError:
+                            logger.warning("Ignoring malformed tab event %r", message['data'])
+                            continue
+                        self.dispatch(event)
+            except redis.RedisError:
+                logger.warning("Feed lost its Redis subscription, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+hub = FeedHub()
+
+
+def format_event(event):
+    """Encode an event as a server-sent event frame"""
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+async def send_response(send, status, body=b'', content_type=b'application/json'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type)],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def feed_application(scope, receive, send):
+    """ASGI application for GET /api/feed"""
+    if scope['method'] != 'GET':
+        await send_response(send, 405, b'{"detail":"Method not allowed."}')
+        return
+
+    headers = dict(scope['headers'])
+    api_key = headers.get(b'x-api-key', b'').decode('latin-1')
+    key = await sync_to_async(check_api_key)(api_key) if api_key else None
+    if key is None:
+        await send_response(send, 401, b'{"detail":"Invalid API key"}')
+        return
+    site = site_for(key, headers.get(b'x-site', b'').decode('latin-1'))
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        tables = [int(table) for table in query.get('table', [])]
+    except ValueError:
+        await send_response(send, 400, b'{"detail":"table must be an integer"}')
+        return
+    subscriber = Subscriber(tables=tables, statuses=query.get('status', []), site=site)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    hub.subscribe(subscriber)
+    stream = asyncio.ensure_future(stream_events(subscriber, send))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait([stream, disconnect], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hub.unsubscribe(subscriber)
+        stream.cancel()
+        disconnect.cancel()
+
+
+async def stream_events(subscriber, send):
+    await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+    while True:
+        try:
+            event = await asyncio.wait_for(
+                subscriber.queue.get(), timeout=settings.FEED_HEARTBEAT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            # Keep proxies from closing an idle connection
+            await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+            continue
+
+        if event is None:
+            await send({
+                'type': 'http.response.body',
+                'body': b'event: lagged\ndata: {}\n\n',
+                'more_body': False,
+            })
+            return
+        await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
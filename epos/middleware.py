@@ -0,0 +1,108 @@
+"""
+Per-path middleware stacks.
+
+API calls authenticate with X-API-Key, so they don't need the sessions,
+CSRF, auth, messages and clickjacking middleware that the admin relies on.
+MiddlewareRouter sits in MIDDLEWARE and sends requests under
+LEAN_MIDDLEWARE_PREFIXES through API_MIDDLEWARE, and everything else
+through SITE_MIDDLEWARE.
+
+Each stack is built the way Django builds MIDDLEWARE. The router hands
+process_view, process_exception and process_template_response on to the
+stack that handled the request, so CSRF checks still run for the admin.
+
+ConcurrencyLimitMiddleware caps the requests each process works on at once.
+Past MAX_CONCURRENT_REQUESTS a request waits up to CONCURRENCY_WAIT_SECONDS
+for a slot and is then turned away with a 503, so a flood of requests is
+shed before every database connection is taken.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+
+
+class MiddlewareStack:
+    """A chain of middleware and the hooks Django would collect from them"""
+
+    def __init__(self, paths, get_response):
+        self.view_middleware = []
+        self.template_response_middleware = []
+        self.exception_middleware = []
+
+        handler = get_response
+        for path in reversed(paths):
+            try:
+                middleware = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if middleware is None:
+                raise ImproperlyConfigured(f'Middleware factory {path} returned None.')
+
+            if hasattr(middleware, 'process_view'):
+                self.view_middleware.insert(0, middleware.process_view)
+            if hasattr(middleware, 'process_template_response'):
+                self.template_response_middleware.append(middleware.process_template_response)
+            if hasattr(middleware, 'process_exception'):
+                self.exception_middleware.append(middleware.process_exception)
+            handler = convert_exception_to_response(middleware)
+        self.handler = handler
+
+
+class MiddlewareRouter:
+    """Runs API_MIDDLEWARE for API paths and SITE_MIDDLEWARE for the rest"""
+
+    def __init__(self, get_response):
+        self.prefixes = tuple(settings.LEAN_MIDDLEWARE_PREFIXES)
+        self.api = MiddlewareStack(settings.API_MIDDLEWARE, get_response)
+        self.site = MiddlewareStack(settings.SITE_MIDDLEWARE, get_response)
+
+    def stack_for(self, request):
+        return self.api if request.path_info.startswith(self.prefixes) else self.site
+
+    def __call__(self, request):
+        return self.stack_for(request).handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for process_view in self.stack_for(request).view_middleware:
+            response = process_view(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_template_response(self, request, response):
+        for process_template_response in self.stack_for(request).template_response_middleware:
+            response = process_template_response(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        for process_exception in self.stack_for(request).exception_middleware:
+            response = process_exception(request, exception)
+            if response is not None:
+                return response
+        return None
+
+
+class ConcurrencyLimitMiddleware:
+    """Sheds requests once MAX_CONCURRENT_REQUESTS are in progress in this process"""
+
+    def __init__(self, get_response):
+        if not settings.MAX_CONCURRENT_REQUESTS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slots = threading.BoundedSemaphore(settings.MAX_CONCURRENT_REQUESTS)
+        self.wait_seconds = settings.CONCURRENCY_WAIT_SECONDS
+
+    def __call__(self, request):
+        if not self.slots.acquire(timeout=self.wait_seconds):
+            response = JsonResponse({'error': 'Server busy, retry shortly'}, status=503)
+            response['Retry-After'] = '1'
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            self.slots.release()
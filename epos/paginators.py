@@ -0,0 +1,49 @@
+"""
+Admin paginator for very large tables.
+
+Django's paginator runs an exact COUNT(*) over the whole changelist, which
+takes seconds once a table holds millions of rows.
+"""
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset):
+    """Planner's row estimate for the queryset's table, None when there isn't one"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    # -1 until the table has been analyzed
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than ADMIN_COUNT_LIMIT rows
+
+    An unfiltered changelist on Postgres reports the planner's estimate once
+    the table is bigger than the limit. A filtered one counts at most
+    ADMIN_COUNT_LIMIT rows, so only the first pages of a broad filter are
+    linked.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_COUNT_LIMIT
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset[:limit].count()
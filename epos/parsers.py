@@ -0,0 +1,42 @@
+"""
+JSON parser backed by orjson when it is installed.
+
+FastJSONParser returns the same data as DRF's JSONParser. Bodies orjson
+rejects are parsed again by JSONParser. That gives the same ParseError
+message for invalid JSON, and the same result for input the standard
+library accepts but orjson doesn't, such as lone surrogates. Bodies with
+integers too wide for orjson also go to JSONParser, because orjson reads
+them as floats.
+"""
+
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .renderers import FastJSONRenderer, orjson
+
+
+# Maps every digit to 0 and every other byte to a space. A run of 19 digits,
+# enough to overflow a 64-bit integer, is then a plain substring search.
+DIGITS = bytes(0x30 if 0x30 <= byte <= 0x39 else 0x20 for byte in range(256))
+LONG_INTEGER = b'0' * 19
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser using orjson when it is installed"""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        if LONG_INTEGER not in body.translate(DIGITS):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(io.BytesIO(body), media_type, parser_context)
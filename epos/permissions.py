@@ -8,6 +8,6 @@ class APIKeyPermission(BasePermission):
     
     def has_permission(self, request, view):
         # Check if the request has been authenticated
-        # Our APIKeyAuthentication returns (None, api_key) on success
-        # request.auth will be the api_key string if authentication succeeded
+        # Our APIKeyAuthentication returns (None, key) on success
+        # request.auth will be the apikeys.keys.Key if authentication succeeded
         return hasattr(request, 'auth') and request.auth is not None
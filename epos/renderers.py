@@ -0,0 +1,71 @@
+"""
+JSON renderer backed by orjson when it is installed.
+
+FastJSONRenderer renders the same bytes as DRF's JSONRenderer with the
+project's settings (compact, UTF-8, U+2028 and U+2029 escaped). Values
+orjson doesn't handle itself go through DRF's encoder, so datetimes end in
+Z for UTC and a raw Decimal is written as DRF writes it. Requests for
+indented output, anything orjson refuses (e.g. integers wider than 64
+bits) and data holding a NaN or infinite float, which orjson would write as
+null, are rendered by JSONRenderer. Without orjson it is JSONRenderer.
+
+One known difference remains. A float in the response data written in
+exponent form gets orjson's exponent (1e-7) rather than Python's (1e-07).
+Responses carry pence as integers and decimals as strings, so this only
+affects data that doesn't go through a serializer.
+"""
+
+import json
+import math
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_encoder = JSONEncoder()
+
+
+def default(obj):
+    """DRF's encoder for types orjson doesn't serialise"""
+    value = _encoder.default(obj)
+    if isinstance(value, float):
+        # Decimals become floats, keep Python's formatting of them
+        return orjson.Fragment(json.dumps(value, allow_nan=False))
+    return value
+
+
+def has_non_finite(data):
+    """Whether data holds a NaN or infinite float anywhere"""
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(has_non_finite(value) for value in data)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer using orjson when it is installed"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Only worth looking for when orjson wrote a null. JSONRenderer
+        # refuses them, or writes NaN when STRICT_JSON is off.
+        if b'null' in ret and has_non_finite(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer so the output is also valid JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
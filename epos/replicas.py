@@ -0,0 +1,189 @@
+"""
+Read-replica routing with read-your-writes.
+
+Everything uses the primary unless a view or report opts in with
+``replica_reads`` or ``reads_from_replica()``. Inside those, ReplicaRouter
+sends reads to one of DATABASE_REPLICAS. Writes, and reads inside a
+transaction on the primary, always go to the primary.
+
+A till that has just written must not read a replica that hasn't caught up
+yet. ReadYourWritesMiddleware pins the client (its API key, or its address
+for the shared key) to the primary for REPLICA_PIN_SECONDS after any
+unsafe request. The pin is kept in Redis so every process honours it, and
+if Redis can't be reached reads stay on the primary.
+
+Each replica's lag is checked at most every REPLICA_LAG_CHECK_SECONDS. A
+replica further behind than REPLICA_MAX_LAG_SECONDS, or one that can't be
+reached, is left out until it catches up, and with no replica left reads go
+to the primary. Keep REPLICA_MAX_LAG_SECONDS below REPLICA_PIN_SECONDS, so a
+pin outlasts any lag a replica is allowed.
+"""
+
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'replica_pin'
+
+# Alias reads go to inside reads_from_replica(), None for the primary
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+_health = {}
+_lock = threading.Lock()
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=int(settings.REDIS_DB),
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def client_id(request):
+    """The API key prefix a request authenticated with, or its address for the shared key"""
+    key = getattr(request, 'auth', None)
+    if key is not None and key.prefix is not None:
+        return f'key:{key.prefix}'
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+def pin(client):
+    """Send a client's replica reads to the primary for REPLICA_PIN_SECONDS"""
+    try:
+        get_redis().set(f'{KEY_PREFIX}:{client}', 1, px=int(settings.REPLICA_PIN_SECONDS * 1000))
+    except redis.RedisError:
+        logger.warning("Could not pin %s to the primary", client, exc_info=True)
+
+
+def pinned(client):
+    """Whether a client wrote recently, True when Redis can't say"""
+    try:
+        return bool(get_redis().exists(f'{KEY_PREFIX}:{client}'))
+    except redis.RedisError:
+        logger.warning("Could not check %s's pin, reading from the primary", client, exc_info=True)
+        return True
+
+
+def replica_lag(alias):
+    """Seconds a replica's replay is behind, 0 when it has replayed all it has received"""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+def healthy(alias):
+    """Whether a replica is reachable and within REPLICA_MAX_LAG_SECONDS, checked at most every REPLICA_LAG_CHECK_SECONDS"""
+    now = time.monotonic()
+    entry = _health.get(alias)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    try:
+        lag = replica_lag(alias)
+        ok = lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not ok:
+            logger.warning("Replica %s is %.1fs behind, reading from the primary", alias, lag)
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable, reading from the primary", alias, exc_info=True)
+        ok = False
+    with _lock:
+        _health[alias] = (now + settings.REPLICA_LAG_CHECK_SECONDS, ok)
+    return ok
+
+
+def choose_replica():
+    """A healthy replica alias, or None when there isn't one"""
+    candidates = [alias for alias in settings.DATABASE_REPLICAS if healthy(alias)]
+    return random.choice(candidates) if candidates else None
+
+
+def clear():
+    """Forget every replica's health"""
+    with _lock:
+        _health.clear()
+
+
+@contextmanager
+def reads_from_replica(client=None):
+    """
+    Send reads inside the block to a healthy replica
+
+    Args:
+        client: Reads stay on the primary while this client is pinned
+    """
+    alias = None
+    if settings.DATABASE_REPLICAS and (client is None or not pinned(client)):
+        alias = choose_replica()
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(method):
+    """Run a view method with reads_from_replica() for the requesting client"""
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        with reads_from_replica(client_id(request)):
+            return method(view, request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Routes reads inside reads_from_replica() to its replica"""
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Pins a client to the primary after each unsafe request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS:
+            pin(client_id(request))
+        return response
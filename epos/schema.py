@@ -0,0 +1,103 @@
+"""
+OpenAPI schema served from memory.
+
+drf-spectacular introspects every view and serializer to build the schema,
+which is too slow to repeat for each device that fetches it. The schema is
+generated once per process (or read from OPENAPI_SCHEMA_FILE, written at
+build time by ``manage.py build_schema``), rendered once per format, and
+served with a content-hash ETag so clients revalidate with a 304.
+
+``warm_up`` builds it on a background thread as a worker starts, so the
+first client doesn't pay for it.
+"""
+
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+
+
+_schema = None
+_rendered = {}
+_lock = threading.Lock()
+
+
+def generate_schema():
+    """Build the schema the same way SpectacularAPIView does for an anonymous request"""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+
+
+def get_schema():
+    """The schema for this process, read from OPENAPI_SCHEMA_FILE or generated on first use"""
+    global _schema
+    if _schema is None:
+        with _lock:
+            if _schema is None:
+                if settings.OPENAPI_SCHEMA_FILE:
+                    with open(settings.OPENAPI_SCHEMA_FILE) as f:
+                        _schema = json.load(f)
+                else:
+                    _schema = generate_schema()
+    return _schema
+
+
+def clear():
+    """Forget the schema and its renderings, e.g. after settings change in tests"""
+    global _schema
+    with _lock:
+        _schema = None
+        _rendered.clear()
+
+
+def warm_up():
+    """Build the schema on a background thread so it is ready for the first request"""
+    thread = threading.Thread(target=get_schema, name='schema-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+class CachedSchemaView(SpectacularAPIView):
+    """SpectacularAPIView serving the schema built once per process"""
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        # Translated or versioned schemas are rare, build those per request
+        if request.GET.get('lang') or request.GET.get('version'):
+            return super().get(request, *args, **kwargs)
+
+        renderer = request.accepted_renderer
+        context = self.get_renderer_context()
+        # Only a JSON indent changes the output, keying on the raw Accept
+        # header would cache a copy for every parameter a client sends
+        get_indent = getattr(renderer, 'get_indent', None)
+        indent = get_indent(request.accepted_media_type, context) if get_indent else None
+        key = (type(renderer), indent)
+        rendered = _rendered.get(key)
+        if rendered is None:
+            media_type = renderer.media_type if indent is None else f'{renderer.media_type}; indent={indent}'
+            body = renderer.render(get_schema(), media_type, context)
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            rendered = _rendered[key] = (body, etag)
+        body, etag = rendered
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            content_type = renderer.media_type
+            if renderer.charset:
+                content_type = f'{content_type}; charset={renderer.charset}'
+            response = HttpResponse(body, content_type=content_type)
+            response['Content-Disposition'] = (
+                f'inline; filename="{spectacular_settings.TITLE or "schema"}.{renderer.format}"'
+            )
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+        patch_vary_headers(response, ['Accept'])
+        return response
@@ -41,10 +41,28 @@ INSTALLED_APPS = [
     'drf_spectacular',
     'tabs',
     'payment',
+    'apikeys',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'epos.middleware.ConcurrencyLimitMiddleware',
+    'epos.middleware.MiddlewareRouter',
+]
+
+# epos.middleware.MiddlewareRouter runs API_MIDDLEWARE for paths under
+# LEAN_MIDDLEWARE_PREFIXES and SITE_MIDDLEWARE (the admin's) for the rest.
+# API calls authenticate with X-API-Key, so sessions, CSRF, auth, messages
+# and clickjacking protection are left out.
+LEAN_MIDDLEWARE_PREFIXES = ['/api/']
+
+API_MIDDLEWARE = [
+    'django.middleware.common.CommonMiddleware',
+    'epos.replicas.ReadYourWritesMiddleware',
+    'epos.sharding.SiteMiddleware',
+]
+
+SITE_MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -53,6 +71,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# The admin checks only look in MIDDLEWARE, but its session, auth and
+# messages middleware are in SITE_MIDDLEWARE
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
+
 ROOT_URLCONF = 'epos.urls'
 
 TEMPLATES = [
@@ -88,6 +110,36 @@ DATABASES = {
     }
 }
 
+# Read replicas, one per host in POSTGRES_REPLICA_HOSTS with the primary's
+# credentials. epos.replicas sends read-only views and reports to them and
+# keeps a client on the primary for REPLICA_PIN_SECONDS after it writes.
+REPLICA_HOSTS = [host.strip() for host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+DATABASES.update({
+    f'replica_{number}': {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    for number, host in enumerate(REPLICA_HOSTS, start=1)
+})
+DATABASE_REPLICAS = [f'replica_{number}' for number in range(1, len(REPLICA_HOSTS) + 1)]
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', '5'))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', '5'))
+
+# Shards for the tabs and payment apps (see epos.sharding). Each alias in
+# POSTGRES_SHARDS is a database named <POSTGRES_DB>_<alias> on the primary's
+# server. SITE_SHARDS places sites on them, e.g. "soho=shard_1", and other
+# sites stay on the default database. Requests with the shared API key
+# choose their site with an X-Site header, else they use DEFAULT_SITE.
+SHARD_DATABASES = [alias.strip() for alias in os.environ.get('POSTGRES_SHARDS', '').split(',') if alias.strip()]
+DATABASES.update({
+    alias: {**DATABASES['default'], 'NAME': f"{DATABASES['default']['NAME']}_{alias}"}
+    for alias in SHARD_DATABASES
+})
+SITE_SHARDS = dict(
+    entry.strip().split('=', 1) for entry in os.environ.get('SITE_SHARDS', '').split(',') if entry.strip()
+)
+DEFAULT_SITE = os.environ.get('DEFAULT_SITE', 'main')
+
+DATABASE_ROUTERS = ['epos.sharding.ShardRouter', 'epos.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,9 +196,32 @@ CACHES = {
     }
 }
 
-# API Key for authentication
+# API Key for authentication. Tills should each have their own key from the
+# apikeys app (`manage.py create_api_key`). This shared key is still accepted
+# while it is set, set it to an empty string once every till has moved.
 API_KEY = os.environ.get('API_KEY', 'demo')
 
+# Seconds each process caches an API key lookup. Revocations reach every
+# process at once through Redis, this bounds them if Redis is down.
+API_KEY_CACHE_TTL_SECONDS = int(os.environ.get('API_KEY_CACHE_TTL_SECONDS', '60'))
+# Most lookups each process caches, the oldest are dropped beyond it
+API_KEY_CACHE_SIZE = int(os.environ.get('API_KEY_CACHE_SIZE', '10000'))
+
+# Requests each process works on at once before shedding with a 503 (0 for
+# no limit). Keep it below the database connections a process can open.
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '20'))
+CONCURRENCY_WAIT_SECONDS = float(os.environ.get('CONCURRENCY_WAIT_SECONDS', '0.25'))
+
+# Token-bucket limits per API key and route name (see epos.throttling). A
+# bucket holds `burst` requests and refills at `rate` per second. Routes
+# without an entry use 'default', and None turns limiting off.
+RATE_LIMITS = {
+    'default': {'rate': 10, 'burst': 50},
+    'create_payment_intent': {'rate': 2, 'burst': 20},
+    'take_payment': {'rate': 2, 'burst': 20},
+    'sync': {'rate': 2, 'burst': 20},
+}
+
 # DRF Spectacular settings
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -156,6 +231,23 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'epos.permissions.APIKeyPermission',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'epos.throttling.TokenBucketThrottle',
+    ],
+    # Proxies in front of the app. Shared-key clients are limited per address,
+    # and with 0 the X-Forwarded-For header, which any client can set, is ignored.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
+    # Same output as DRF's JSON renderer and parser, faster when orjson is
+    # installed (see epos.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'epos.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'epos.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -165,6 +257,9 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
     'COMPONENT_SPLIT_REQUEST': True,
     'SCHEMA_PATH_PREFIX': '/api/',
+    'ENUM_NAME_OVERRIDES': {
+        'TabStatusEnum': 'tabs.models.Tab.STATUS_CHOICES',
+    },
     'SECURITY_DEFINITIONS': {
         'ApiKeyAuth': {
             'type': 'apiKey',
@@ -185,3 +280,59 @@ SPECTACULAR_SETTINGS = {
         }
     },
 }
+
+# Microbenchmark baseline used by `manage.py benchmark --save/--compare`
+BENCHMARK_BASELINE = os.environ.get('BENCHMARK_BASELINE', BASE_DIR / 'bench_baseline.json')
+
+# Where `manage.py archive_tabs --detach-before` writes detached archive months
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', BASE_DIR / 'archive')
+
+# Live tab feed (GET /api/feed, served by epos.asgi)
+FEED_HEARTBEAT_SECONDS = int(os.environ.get('FEED_HEARTBEAT_SECONDS', '15'))
+FEED_QUEUE_SIZE = int(os.environ.get('FEED_QUEUE_SIZE', '100'))
+
+# Largest number of tabs accepted by one offline till sync (POST /api/sync)
+SYNC_MAX_TABS = int(os.environ.get('SYNC_MAX_TABS', '1000'))
+
+# Tab event log replay: rows fetched per round trip, and how old an event
+# must be before `manage.py snapshot_tab_events` folds it into a snapshot
+TAB_EVENT_REPLAY_CHUNK = int(os.environ.get('TAB_EVENT_REPLAY_CHUNK', '5000'))
+TAB_EVENT_SNAPSHOT_LAG_SECONDS = int(os.environ.get('TAB_EVENT_SNAPSHOT_LAG_SECONDS', '60'))
+
+# Payment change-data feed: NDJSON segments read by the finance warehouse
+# with `manage.py tail_payment_feed`
+PAYMENT_FEED_DIR = os.environ.get('PAYMENT_FEED_DIR', BASE_DIR / 'payment_feed')
+PAYMENT_FEED_SEGMENT_BYTES = int(os.environ.get('PAYMENT_FEED_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+PAYMENT_FEED_QUEUE_SIZE = int(os.environ.get('PAYMENT_FEED_QUEUE_SIZE', '10000'))
+# Tests write the feed to a temporary directory instead (see epos.test_runner)
+TEST_RUNNER = 'epos.test_runner.TestRunner'
+
+# Reaper for stale payment intents and abandoned tabs (`manage.py reap`).
+# Set REAPER_IN_PROCESS to also run it on a thread in each web process.
+REAPER_INTENT_GRACE_SECONDS = int(os.environ.get('REAPER_INTENT_GRACE_SECONDS', '60'))
+REAPER_TAB_MAX_AGE_HOURS = int(os.environ.get('REAPER_TAB_MAX_AGE_HOURS', '12'))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', '200'))
+REAPER_INTERVAL_SECONDS = int(os.environ.get('REAPER_INTERVAL_SECONDS', '60'))
+REAPER_IN_PROCESS = os.environ.get('REAPER_IN_PROCESS', 'False').lower() in ('true', '1', 'yes')
+
+# Days of raw tabs, lines and payments kept by `manage.py prune_tabs`.
+# DailyTotals rollups are never pruned.
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '730'))
+
+# Seconds a process keeps its set of menu item IDs before reloading it
+# (see tabs.menu). Saving a menu item clears the set in that process at once.
+MENU_IDS_TTL_SECONDS = int(os.environ.get('MENU_IDS_TTL_SECONDS', '60'))
+
+# Milliseconds the first add to a tab waits to batch further adds to it into
+# one transaction (see tabs.coalescer). 0 writes every add on its own.
+ADD_ITEM_COALESCE_MS = float(os.environ.get('ADD_ITEM_COALESCE_MS', '0'))
+ADD_ITEM_BATCH_MAX = int(os.environ.get('ADD_ITEM_BATCH_MAX', '50'))
+
+# Admin changelists stop counting rows here (see epos.paginators)
+ADMIN_COUNT_LIMIT = int(os.environ.get('ADMIN_COUNT_LIMIT', '10000'))
+
+# OpenAPI schema (GET /api/schema/). Point OPENAPI_SCHEMA_FILE at the output
+# of `manage.py build_schema` to skip generating it in each process.
+OPENAPI_SCHEMA_FILE = os.environ.get('OPENAPI_SCHEMA_FILE')
+OPENAPI_SCHEMA_MAX_AGE = int(os.environ.get('OPENAPI_SCHEMA_MAX_AGE', '86400'))
+OPENAPI_SCHEMA_WARM_UP = os.environ.get('OPENAPI_SCHEMA_WARM_UP', 'True').lower() in ('true', '1', 'yes')
@@ -0,0 +1,171 @@
+"""
+Per-site sharding of tabs and payments.
+
+Every tab, line, payment and the rest of the tabs and payment apps' rows
+belong to a site, and each site's rows live on the database SITE_SHARDS
+gives it. Sites that aren't listed stay on the default database, with
+everything else (API keys, admin users). Each shard has the two apps'
+tables, so a site's requests never touch another shard. The menu is the
+exception: it is only written to the default database, and tabs.menu copies
+every change to the shards, keeping its IDs, so lines can still join it.
+
+SiteMiddleware works out the site of each API request: the site of its API
+key, or the X-Site header for the shared key, else DEFAULT_SITE. ShardRouter
+then sends the two apps' queries to that site's shard. Code that runs
+outside a request, such as management commands, uses DEFAULT_SITE unless it
+is inside ``using_site`` or ``using_shard``. Transactions have to be opened
+on the shard too, so the two apps use this module's ``atomic`` and
+``on_commit`` rather than django.db.transaction's.
+
+``fan_out`` runs a function on every shard at once, for reports across
+sites.
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from apikeys import keys
+
+
+SHARDED_APPS = {'tabs', 'payment'}
+# Written to the default database only, each shard reads its own copy
+MENU_MODEL = 'tabs.MenuItem'
+
+_site = contextvars.ContextVar('site', default=None)
+# Set by using_shard() to work on a whole shard, whatever its sites
+_shard = contextvars.ContextVar('shard', default=None)
+
+
+def current_site():
+    """Site of the current request, DEFAULT_SITE outside one"""
+    return _site.get() or settings.DEFAULT_SITE
+
+
+def shard_for(site):
+    """Database alias a site's rows live on"""
+    return settings.SITE_SHARDS.get(site, DEFAULT_DB_ALIAS)
+
+
+def current_shard():
+    return _shard.get() or shard_for(current_site())
+
+
+def all_shards():
+    """Every database alias holding tabs and payments, default first"""
+    return [DEFAULT_DB_ALIAS, *settings.SHARD_DATABASES]
+
+
+@contextmanager
+def using_site(site):
+    """Work as a site inside the block"""
+    token = _site.set(site)
+    try:
+        yield
+    finally:
+        _site.reset(token)
+
+
+@contextmanager
+def using_shard(alias):
+    """Send the sharded apps' queries inside the block to a shard"""
+    token = _shard.set(alias)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def atomic():
+    """transaction.atomic() on the current shard"""
+    return transaction.atomic(using=current_shard())
+
+
+def on_commit(func):
+    """transaction.on_commit() for the current shard's transaction"""
+    transaction.on_commit(func, using=current_shard())
+
+
+def fan_out(func, *args, **kwargs):
+    """
+    Run a function on every shard in parallel, each in its own thread
+
+    Without shards it runs in the calling thread, on the default database.
+
+    Returns:
+        Dict of shard alias to what the function returned there
+    """
+    def run(alias):
+        try:
+            with using_shard(alias):
+                return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    aliases = all_shards()
+    if len(aliases) == 1:
+        with using_shard(aliases[0]):
+            return {aliases[0]: func(*args, **kwargs)}
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        return dict(zip(aliases, pool.map(run, aliases)))
+
+
+def site_for(key, requested=None):
+    """
+    The site a client works as
+
+    Args:
+        key: The apikeys.keys.Key it authenticated with, if any
+        requested: Its X-Site header, only honoured for keys without a site
+    """
+    if key is not None and key.site:
+        return key.site
+    return requested or settings.DEFAULT_SITE
+
+
+class ShardRouter:
+    """
+    Routes the sharded apps to the current shard
+
+    Leaves the default database to the routers after it, so replicas still
+    serve reads for sites on it.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in SHARDED_APPS:
+            alias = current_shard()
+            if alias != DEFAULT_DB_ALIAS:
+                return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label == MENU_MODEL:
+            return DEFAULT_DB_ALIAS
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A shard's menu items have the same IDs as the default database's
+        if MENU_MODEL in (obj1._meta.label, obj2._meta.label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.SHARD_DATABASES:
+            return app_label in SHARDED_APPS
+        return None
+
+
+class SiteMiddleware:
+    """Sets the site, and so the shard, for each API request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        api_key = request.META.get('HTTP_X_API_KEY')
+        key = keys.check(api_key) if api_key else None
+        with using_site(site_for(key, request.META.get('HTTP_X_SITE'))):
+            return self.get_response(request)
@@ -0,0 +1,32 @@
+"""
+Test runner that keeps a test run's payments out of the real feed.
+
+Taking a payment publishes it to PAYMENT_FEED_DIR, so a test run would
+append its records to the feed the warehouse reads. TestRunner points the
+setting at a temporary directory for the whole run and removes it after.
+"""
+
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner writing the payment feed to a temporary directory"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.feed_dir = tempfile.mkdtemp(prefix='payment_feed_')
+        self.feed_settings = override_settings(PAYMENT_FEED_DIR=self.feed_dir)
+        self.feed_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        from payment import changefeed
+
+        # Let the writer thread finish before its directory goes
+        changefeed.get_feed().flush()
+        self.feed_settings.disable()
+        shutil.rmtree(self.feed_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
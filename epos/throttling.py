@@ -0,0 +1,159 @@
+"""
+Per-key, per-route token-bucket rate limiting.
+
+Each API key gets a bucket per route name (from tabs/urls.py and
+payment/urls.py). A bucket holds up to ``burst`` requests and refills at
+``rate`` per second, so a till can burst through a busy moment but a till
+stuck in a retry loop is held to the steady rate. Limits come from
+RATE_LIMITS, routes without their own entry use RATE_LIMITS['default'], and
+a limit of None turns limiting off for that route.
+
+Buckets live in Redis and are updated by one Lua script, so every process
+shares them and concurrent requests can't both take the last token. The
+script uses Redis's clock, so web hosts don't need synchronised clocks. If
+Redis is unreachable each process keeps its own buckets for
+REDIS_RETRY_SECONDS, which is more lenient across several processes but
+still stops a single runaway till.
+
+Requests over the limit get DRF's 429 with a Retry-After header.
+"""
+
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit'
+
+# Seconds to use in-process buckets after a Redis error before trying Redis again
+REDIS_RETRY_SECONDS = 5
+
+# A limiter that waits on a slow Redis holds up every request
+REDIS_TIMEOUT_SECONDS = 0.1
+
+# KEYS[1] bucket, ARGV rate and burst. Returns {allowed, seconds to wait}.
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+_buckets = {}
+_lock = threading.Lock()
+_redis_client = None
+_script = None
+_redis_down_until = 0
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=int(settings.REDIS_DB),
+            decode_responses=True,
+            socket_timeout=REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=REDIS_TIMEOUT_SECONDS,
+        )
+    return _redis_client
+
+
+def get_script():
+    global _script
+    if _script is None:
+        _script = get_redis().register_script(TOKEN_BUCKET)
+    return _script
+
+
+def limit_for(route):
+    """The {'rate', 'burst'} limit for a route name, or None if it isn't limited"""
+    limits = settings.RATE_LIMITS
+    return limits.get(route, limits.get('default'))
+
+
+def take_local(bucket, rate, burst):
+    """take() against this process's buckets"""
+    now = time.monotonic()
+    with _lock:
+        tokens, updated = _buckets.get(bucket, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            _buckets[bucket] = (tokens - 1, now)
+            return True, 0
+        _buckets[bucket] = (tokens, now)
+    return False, (1 - tokens) / rate
+
+
+def take(bucket, rate, burst):
+    """
+    Take a token from a bucket
+
+    Returns:
+        (allowed, seconds until a token is available)
+    """
+    global _redis_down_until
+    if time.monotonic() >= _redis_down_until:
+        try:
+            allowed, wait = get_script()(keys=[f'{KEY_PREFIX}:{bucket}'], args=[rate, burst])
+            return bool(allowed), float(wait)
+        except redis.RedisError:
+            logger.warning("Rate limiting in-process for %ss, Redis is unavailable",
+                           REDIS_RETRY_SECONDS, exc_info=True)
+            _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    return take_local(bucket, rate, burst)
+
+
+def clear():
+    """Forget this process's buckets and retry Redis"""
+    global _redis_down_until
+    with _lock:
+        _buckets.clear()
+    _redis_down_until = 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits each API key on each route to RATE_LIMITS
+
+    Requests with the legacy shared key are limited per client address.
+    """
+
+    def allow_request(self, request, view):
+        route = request.resolver_match.url_name if request.resolver_match else None
+        limit = limit_for(route)
+        if limit is None:
+            return True
+
+        key = request.auth
+        if key is not None and key.prefix is not None:
+            ident = f'key:{key.prefix}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        allowed, self.wait_seconds = take(f'{ident}:{route}', limit['rate'], limit['burst'])
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
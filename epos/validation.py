@@ -0,0 +1,154 @@
+"""
+Compiled request validation for high-frequency write endpoints.
+
+Validating with a DRF serializer builds a new serializer, deep-copies its
+fields and walks several layers of machinery on every request.
+CompiledSerializer reads a Serializer's declared fields once and turns each
+into a small function. A request body is then validated without building
+anything, with the same rules and the same error payload as the serializer.
+The serializer is still what the view passes to ``extend_schema``, so the
+documentation describes exactly what is validated.
+
+Only IntegerField and CharField are compiled, and a serializer-level
+``validate`` is not supported. Anything else raises ImproperlyConfigured
+rather than validate differently. A body that isn't a JSON object, such as
+a form post or a list, is handed to the serializer itself.
+"""
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty, get_error_detail
+
+
+def compile_integer(field):
+    """IntegerField.to_internal_value and its validators"""
+    pattern = field.re_decimal
+    max_string_length = field.MAX_STRING_LENGTH
+
+    def convert(data):
+        if type(data) is not int:
+            if isinstance(data, str) and len(data) > max_string_length:
+                field.fail('max_string_length')
+            try:
+                data = int(pattern.sub('', str(data)))
+            except (ValueError, TypeError):
+                field.fail('invalid')
+        field.run_validators(data)
+        return data
+    return convert
+
+
+def compile_char(field):
+    """CharField.run_validation for a value that is present and not null"""
+    allow_blank = field.allow_blank
+    trim_whitespace = field.trim_whitespace
+
+    def convert(data):
+        if data == '' or (trim_whitespace and str(data).strip() == ''):
+            if not allow_blank:
+                field.fail('blank')
+            return ''
+        if isinstance(data, bool) or not isinstance(data, (str, int, float)):
+            field.fail('invalid')
+        data = str(data)
+        if trim_whitespace:
+            data = data.strip()
+        field.run_validators(data)
+        return data
+    return convert
+
+
+COMPILERS = {
+    serializers.IntegerField: compile_integer,
+    serializers.CharField: compile_char,
+}
+
+
+def compile_field(field, check):
+    """
+    One field's run_validation followed by its validate_<field> check
+
+    Raises the same ValidationError the serializer would, or SkipField when
+    an optional field without a default is missing.
+    """
+    compiler = COMPILERS.get(type(field))
+    if compiler is None:
+        raise ImproperlyConfigured(f"Cannot compile {type(field).__name__} {field.field_name!r}")
+    if field.source != field.field_name:
+        raise ImproperlyConfigured(f"Cannot compile {field.field_name!r} with source {field.source!r}")
+
+    name = field.field_name
+    required = field.required
+    allow_null = field.allow_null
+    convert = compiler(field)
+
+    def run(data):
+        value = data.get(name, empty)
+        if value is empty:
+            if required:
+                field.fail('required')
+            value = field.get_default()
+        elif value is None:
+            if not allow_null:
+                field.fail('null')
+        else:
+            value = convert(value)
+        if check is not None:
+            value = check(value)
+        return value
+    return run
+
+
+class CompiledSerializer:
+    """
+    Validates request bodies the way a Serializer class would, without building one
+
+    Args:
+        serializer_class: Serializer whose fields and validate_<field> methods to compile
+        **checks: Replacements for validate_<field> methods, e.g. one that
+            checks an in-memory set instead of querying
+    """
+
+    def __init__(self, serializer_class, **checks):
+        if serializer_class.validate is not serializers.Serializer.validate:
+            raise ImproperlyConfigured(f"Cannot compile {serializer_class.__name__}.validate")
+
+        self.serializer_class = serializer_class
+        # Bound fields, read but never changed while validating
+        serializer = serializer_class()
+        if serializer.validators:
+            raise ImproperlyConfigured(f"Cannot compile {serializer_class.__name__} validators")
+        self.fields = [
+            (field.field_name, compile_field(
+                field, checks.get(field.field_name, getattr(serializer, f'validate_{field.field_name}', None))
+            ))
+            for field in serializer._writable_fields
+        ]
+
+    def validate(self, data):
+        """
+        Validate a request body
+
+        Returns:
+            (validated_data, errors), one of which is None
+        """
+        if type(data) is not dict:
+            serializer = self.serializer_class(data=data)
+            if serializer.is_valid():
+                return serializer.validated_data, None
+            return None, serializer.errors
+
+        validated = {}
+        errors = {}
+        for name, run in self.fields:
+            try:
+                validated[name] = run(data)
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+            except DjangoValidationError as exc:
+                errors[name] = get_error_detail(exc)
+            except SkipField:
+                pass
+        if errors:
+            return None, errors
+        return validated, None
@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'epos.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402 (needs Django set up)
+
+if settings.OPENAPI_SCHEMA_WARM_UP:
+    from epos.schema import warm_up
+    warm_up()
+
+# Only server processes run the reaper, not every manage.py command
+if settings.REAPER_IN_PROCESS:
+    from payment import reaper
+    reaper.start()
@@ -1,10 +1,20 @@
 from django.contrib import admin
+from epos.admin_search import ExactSearchMixin
+from epos.paginators import EstimatedCountPaginator
 from .models import Payment
 
 # Register your models here.
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(ExactSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'tab', 'payment_intent_id', 'amount_p', 'status', 'created_at']
-    list_filter = ['status', 'created_at']
-    search_fields = ['payment_intent_id', 'tab__table_number']
+    list_select_related = ['tab']
+    list_filter = ['status']
+    # Drill-down filters become ranges on payment_created_at_idx
+    date_hierarchy = 'created_at'
+    # Exact matches on indexed columns only (see epos.admin_search)
+    search_fields = ['payment_intent_id', 'tab_id']
+    search_help_text = 'Payment intent ID or tab ID'
     readonly_fields = ['created_at']
+    raw_id_fields = ['tab']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,110 @@
+import gzip
+import json
+import os
+from datetime import datetime
+
+from django.utils import timezone
+from epos import sharding
+from tabs.models import Tab, TabArchive
+from .snapshots import build_snapshots
+
+
+# Archived rows removed per DELETE once their month is written out
+DELETE_CHUNK_SIZE = 1000
+
+
+def month_start(value):
+    """First day of the month containing a date or datetime"""
+    if isinstance(value, datetime):
+        value = timezone.localtime(value).date()
+    return value.replace(day=1)
+
+
+def add_months(month, months):
+    """Shift the first day of a month by a (possibly negative) number of months"""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def archive_batch(before, batch_size):
+    """
+    Move one batch of paid and closed tabs opened before a datetime to the archive
+
+    The tab's snapshot (built now if it was never frozen) becomes the archived
+    document, then the tab, its items, payments and snapshot are deleted from
+    the hot tables in the same transaction. As with pruning, every day the
+    batch covers must already be rolled up.
+
+    Returns:
+        Number of tabs archived, 0 when there is nothing left to move
+
+    Raises:
+        RetentionError: If a day in the batch has no finished rollup
+    """
+    # retention imports rollups, which imports this module
+    from .retention import check_rollups
+
+    with sharding.atomic():
+        tabs = list(
+            Tab.objects.filter(status__in=['paid', 'closed'], opened_at__lt=before)
+            .select_related('snapshot')
+            .order_by('id')[:batch_size]
+        )
+        if not tabs:
+            return 0
+        check_rollups((tab.opened_at, tab.closed_at) for tab in tabs)
+
+        unfrozen = build_snapshots([tab.id for tab in tabs if not hasattr(tab, 'snapshot')])
+        archived = []
+        for tab in tabs:
+            data = unfrozen[tab.id] if tab.id in unfrozen else tab.snapshot.data
+            archived.append(TabArchive(
+                tab_id=tab.id,
+                site=tab.site,
+                month=month_start(tab.opened_at),
+                table_number=tab.table_number,
+                status=tab.status,
+                opened_at=tab.opened_at,
+                closed_at=tab.closed_at,
+                total_p=tab.total_p,
+                data=data,
+            ))
+        TabArchive.objects.bulk_create(archived)
+
+        # Items, payments and snapshots are removed with one DELETE each
+        Tab.objects.filter(id__in=[tab.id for tab in tabs]).delete()
+    return len(tabs)
+
+
+def detach_month(month, output_dir):
+    """
+    Write an archived month to a gzipped NDJSON file and remove it from the database
+
+    Returns:
+        (path, number of tabs written)
+    """
+    path = os.path.join(output_dir, f"tabs-{month:%Y-%m}.ndjson.gz")
+    if os.path.exists(path):
+        raise FileExistsError(path)
+
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    written = []
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        documents = (
+            TabArchive.objects.filter(month=month)
+            .order_by('tab_id')
+            .values_list('tab_id', 'data')
+            .iterator(chunk_size=1000)
+        )
+        for tab_id, document in documents:
+            f.write(json.dumps(document, separators=(',', ':')))
+            f.write('\n')
+            written.append(tab_id)
+    os.replace(tmp_path, path)
+
+    # Only drop the rows once the file is safely in place, and only those in
+    # it, not tabs archived into the month since
+    for start in range(0, len(written), DELETE_CHUNK_SIZE):
+        TabArchive.objects.filter(tab_id__in=written[start:start + DELETE_CHUNK_SIZE]).delete()
+    return path, len(written)
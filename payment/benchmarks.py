@@ -0,0 +1,37 @@
+from epos.bench import benchmark
+from epos.validation import CompiledSerializer
+
+from .gateway import MockPaymentGateway
+from .serializers import TakePaymentSerializer
+
+
+@benchmark('payment.gateway.store_secret_mapping')
+def store_secret_mapping_case():
+    gateway = MockPaymentGateway()
+    return lambda: gateway.store_secret_mapping('secret_bench', 'pi_bench', expire_seconds=60)
+
+
+@benchmark('payment.gateway.get_intent_id_from_secret')
+def get_intent_id_from_secret_case():
+    gateway = MockPaymentGateway()
+    gateway.store_secret_mapping('secret_bench', 'pi_bench', expire_seconds=60)
+    return lambda: gateway.get_intent_id_from_secret('secret_bench')
+
+
+@benchmark('payment.gateway.confirm_payment_intent')
+def confirm_payment_intent_case():
+    gateway = MockPaymentGateway()
+    return lambda: gateway.confirm_payment_intent('pi_bench', 1000)
+
+
+@benchmark('payment.validate_take_payment[drf]')
+def validate_take_payment_drf_case():
+    body = {'client_secret': 'secret_bench'}
+    return lambda: TakePaymentSerializer(data=body).is_valid()
+
+
+@benchmark('payment.validate_take_payment[compiled]')
+def validate_take_payment_compiled_case():
+    validator = CompiledSerializer(TakePaymentSerializer)
+    body = {'client_secret': 'secret_bench'}
+    return lambda: validator.validate(body)
@@ -0,0 +1,305 @@
+"""
+Change-data feed of payment status transitions.
+
+Each time a payment is created or changes status, a record is appended to
+NDJSON segment files in PAYMENT_FEED_DIR, so the finance warehouse can
+follow payments without querying Postgres. Records are queued once the
+transaction commits and written in batches by a background thread. When
+the queue is full the caller waits briefly, then writes its records itself
+rather than drop them.
+
+A record's offset is its byte position in the whole log. Segment files are
+named after the offset of their first byte and rotate once they reach
+PAYMENT_FEED_SEGMENT_BYTES. ``read`` memory-maps the segments and resumes
+from any offset. Consumers commit the offset they have processed, and
+``compact`` removes the segments that every consumer has read past.
+
+Every shard numbers its payments and tabs separately, and all of them write
+to the same feed, so a payment is identified by its ``shard`` and
+``payment_id`` together. ``site`` is the site the payment was taken at.
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import mmap
+import os
+import queue
+import re
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from epos import sharding
+
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.ndjson'
+LOCK_FILE = '.lock'
+CONSUMERS_DIR = 'consumers'
+CONSUMER_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# Longest a request waits for room in a full queue before writing itself
+PUT_TIMEOUT_SECONDS = 1
+
+
+def build_record(payment):
+    """Feed record for the current state of a payment"""
+    return {
+        'shard': sharding.current_shard(),
+        'site': payment.site,
+        'payment_id': payment.id,
+        'tab_id': payment.tab_id,
+        'payment_intent_id': payment.payment_intent_id,
+        'status': payment.status,
+        'amount_p': payment.amount_p,
+        'currency': payment.currency,
+        'failure_reason': payment.failure_reason,
+        'confirmed_at': payment.confirmed_at,
+        'recorded_at': timezone.now(),
+    }
+
+
+def encode(record):
+    return (json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n').encode()
+
+
+def segments(directory):
+    """Base offsets of the segment files, oldest first"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        int(name[:-len(SEGMENT_SUFFIX)]) for name in names if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def segment_path(directory, base):
+    return os.path.join(directory, f"{base:020d}{SEGMENT_SUFFIX}")
+
+
+class SegmentWriter:
+    """Appends lines to the newest segment, rotating by size"""
+
+    def __init__(self, directory, segment_bytes):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+
+    def append(self, lines):
+        """
+        Append encoded lines and fsync them
+
+        Every worker process writes to the same files, so the newest segment
+        is found again under an exclusive lock for each batch.
+
+        Returns:
+            Offset just past the last line written
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                bases = segments(self.directory)
+                base = bases[-1] if bases else 0
+                path = segment_path(self.directory, base)
+                size = os.path.getsize(path) if bases else 0
+
+                f = open(path, 'ab')
+                try:
+                    for line in lines:
+                        if size and size + len(line) > self.segment_bytes:
+                            f.flush()
+                            os.fsync(f.fileno())
+                            f.close()
+                            base += size
+                            size = 0
+                            f = open(segment_path(self.directory, base), 'ab')
+                        f.write(line)
+                        size += len(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    f.close()
+                return base + size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class ChangeFeed:
+    """Bounded queue in front of a SegmentWriter, drained by a daemon thread"""
+
+    def __init__(self, directory, segment_bytes, queue_size, batch_size=500):
+        self.writer = SegmentWriter(directory, segment_bytes)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, lines):
+        """Queue encoded lines, writing them on this thread if the queue stays full"""
+        self._ensure_started()
+        for index, line in enumerate(lines):
+            try:
+                self.queue.put(line, timeout=PUT_TIMEOUT_SECONDS)
+            except queue.Full:
+                logger.warning("Payment feed queue is full, writing %d records synchronously", len(lines) - index)
+                self._write(lines[index:])
+                return
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        self.queue.join()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='payment-feed-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, lines):
+        try:
+            self.writer.append(lines)
+        except OSError:
+            # Keep the records in the log so they can be replayed by hand
+            logger.exception("Could not write payment feed records: %s", b''.join(lines).decode())
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed():
+    """The feed for PAYMENT_FEED_DIR, shared by every thread in the process"""
+    directory = str(settings.PAYMENT_FEED_DIR)
+    with _feeds_lock:
+        feed = _feeds.get(directory)
+        if feed is None:
+            feed = _feeds[directory] = ChangeFeed(
+                directory,
+                settings.PAYMENT_FEED_SEGMENT_BYTES,
+                settings.PAYMENT_FEED_QUEUE_SIZE
+            )
+    return feed
+
+
+def record(*payments):
+    """Add the current state of payments to the feed once the transaction commits"""
+    lines = [encode(build_record(payment)) for payment in payments]
+    if lines:
+        sharding.on_commit(lambda: get_feed().put(lines))
+
+
+def read(directory, offset=0, limit=None):
+    """
+    Yield (offset, next_offset, record) for every complete record from an offset
+
+    An offset in a segment that has been compacted away starts from the
+    oldest segment still kept. A line still being written is left for the
+    next read.
+    """
+    directory = str(directory)
+    bases = segments(directory)
+    if not bases:
+        return
+    first = max((index for index, base in enumerate(bases) if base <= offset), default=0)
+    offset = max(offset, bases[first])
+
+    count = 0
+    for base in bases[first:]:
+        with open(segment_path(directory, base), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or offset >= base + size:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = max(offset - base, 0)
+                while True:
+                    end = mm.find(b'\n', pos)
+                    if end == -1:
+                        break
+                    yield base + pos, base + end + 1, json.loads(mm[pos:end])
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+                    pos = end + 1
+
+
+def check_consumer(consumer):
+    if not CONSUMER_NAME.match(consumer):
+        raise ValueError(f"Invalid consumer name {consumer!r}, use letters, digits, _ and -")
+
+
+def committed_offsets(directory):
+    """Offset each consumer has processed up to"""
+    path = os.path.join(str(directory), CONSUMERS_DIR)
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return {}
+    offsets = {}
+    for name in names:
+        if name.endswith('.offset'):
+            with open(os.path.join(path, name)) as f:
+                offsets[name[:-len('.offset')]] = int(f.read())
+    return offsets
+
+
+def commit_offset(directory, consumer, offset):
+    """Record that a consumer has processed everything before an offset"""
+    check_consumer(consumer)
+    path = os.path.join(str(directory), CONSUMERS_DIR)
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, f"{consumer}.offset")
+    with open(f"{target}.tmp", 'w') as f:
+        f.write(str(offset))
+    os.replace(f"{target}.tmp", target)
+
+
+def compact(directory, min_offset=None, dry_run=False):
+    """
+    Delete segments every consumer has read past
+
+    Args:
+        min_offset: Delete up to this offset instead of the lowest committed one
+        dry_run: Only report what would be deleted
+
+    Returns:
+        Base offsets of the segments deleted
+    """
+    directory = str(directory)
+    if min_offset is None:
+        offsets = committed_offsets(directory)
+        if not offsets:
+            return []
+        min_offset = min(offsets.values())
+
+    removed = []
+    bases = segments(directory)
+    # A segment ends where the next begins, so the newest is never removed
+    for base, next_base in zip(bases, bases[1:]):
+        if next_base > min_offset:
+            break
+        if not dry_run:
+            os.remove(segment_path(directory, base))
+        removed.append(base)
+    return removed
@@ -0,0 +1,25 @@
+"""
+Fast serialisation of payments, the PaymentSerializer counterpart of
+tabs.fast_serializers.
+"""
+
+from tabs.fast_serializers import datetime_data
+
+
+PAYMENT_FIELDS = (
+    'id', 'tab_id', 'amount_p', 'currency', 'status', 'failure_reason', 'created_at', 'confirmed_at',
+)
+
+
+def payment_data(row):
+    """PaymentSerializer output for a Payment row with PAYMENT_FIELDS"""
+    return {
+        'id': row['id'],
+        'amount_p': row['amount_p'],
+        'currency': row['currency'],
+        'status': row['status'],
+        'failure_reason': row['failure_reason'],
+        'created_at': datetime_data(row['created_at']),
+        'confirmed_at': datetime_data(row['confirmed_at']),
+    }
+
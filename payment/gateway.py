@@ -4,6 +4,10 @@ from typing import Dict, Optional
 from django.conf import settings
 
 
+# How long a client secret can be exchanged for its payment intent
+SECRET_TTL_SECONDS = 900
+
+
 class MockPaymentGateway:
     """Mock payment gateway for internal testing"""
     
@@ -39,7 +43,7 @@ class MockPaymentGateway:
             "status": "requires_confirmation"
         }
     
-    def store_secret_mapping(self, client_secret: str, intent_id: str, expire_seconds: int = 900) -> bool:
+    def store_secret_mapping(self, client_secret: str, intent_id: str, expire_seconds: int = SECRET_TTL_SECONDS) -> bool:
         """
         Store the mapping between client_secret and intent_id in Redis
         
@@ -0,0 +1,76 @@
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from tabs.models import TabArchive
+from payment.archive import add_months, archive_batch, detach_month, month_start
+from payment.retention import RetentionError
+
+
+class Command(BaseCommand):
+    help = 'Move old paid and closed tabs to the archive and detach old archive months to compressed files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-months',
+            type=int,
+            default=3,
+            help='Whole months of paid and closed tabs to keep in the hot tables, '
+                 'besides the current month (default: 3)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of tabs to move per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--detach-before',
+            metavar='YYYY-MM',
+            help='Write archived months before this one to gzipped NDJSON files and drop them',
+        )
+        parser.add_argument(
+            '--output-dir',
+            default=str(settings.ARCHIVE_DIR),
+            help='Directory for detached months (default: %(default)s)',
+        )
+
+    def handle(self, *args, **options):
+        current_month = month_start(timezone.localdate())
+        cutoff_month = add_months(current_month, -options['keep_months'])
+        cutoff = timezone.make_aware(datetime.combine(cutoff_month, time.min))
+
+        self.stdout.write(f"Archiving paid and closed tabs opened before {cutoff_month:%Y-%m}...")
+        total = 0
+        while True:
+            try:
+                moved = archive_batch(cutoff, options['batch_size'])
+            except RetentionError as e:
+                raise CommandError(f'{e}. Run rollup_daily for those days first, then rerun to carry on')
+            if not moved:
+                break
+            total += moved
+            self.stdout.write(f"Archived {total} tabs")
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {total} tabs'))
+
+        if options['detach_before']:
+            try:
+                detach_before = datetime.strptime(options['detach_before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--detach-before must look like YYYY-MM')
+
+            months = (
+                TabArchive.objects.filter(month__lt=detach_before)
+                .order_by('month')
+                .values_list('month', flat=True)
+                .distinct()
+            )
+            for month in list(months):
+                try:
+                    path, count = detach_month(month, options['output_dir'])
+                except FileExistsError as e:
+                    raise CommandError(f'Refusing to overwrite existing file {e}')
+                self.stdout.write(
+                    self.style.SUCCESS(f"Detached {count} tabs for {month:%Y-%m} to {path}")
+                )
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payment import changefeed
+
+
+class Command(BaseCommand):
+    help = 'Delete payment feed segments that every consumer has read past'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-offset',
+            type=int,
+            help='Delete segments ending at or before this offset, ignoring consumer offsets',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list the segments that would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        directory = settings.PAYMENT_FEED_DIR
+        offsets = changefeed.committed_offsets(directory)
+        for consumer, offset in sorted(offsets.items()):
+            self.stdout.write(f"{consumer}: {offset}")
+        if options['min_offset'] is None and not offsets:
+            self.stdout.write(self.style.WARNING('No consumer has committed an offset, nothing to compact'))
+            return
+
+        removed = changefeed.compact(directory, min_offset=options['min_offset'], dry_run=options['dry_run'])
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(removed)} segments'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from epos import sharding
+from tabs.models import Tab
+from payment.snapshots import freeze_tabs
+
+
+class Command(BaseCommand):
+    help = 'Backfill frozen snapshots for paid and closed tabs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of tabs to freeze per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help='Rebuild snapshots that already exist as well as missing ones',
+        )
+
+    def handle(self, *args, **options):
+        tabs = Tab.objects.filter(status__in=['paid', 'closed'])
+        if not options['refresh']:
+            tabs = tabs.filter(snapshot__isnull=True)
+
+        # Walk the tabs in primary key order so each batch is a cheap range scan
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(
+                tabs.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            with sharding.atomic():
+                total += freeze_tabs(Tab.objects.filter(id__in=batch))
+            last_id = batch[-1]
+            self.stdout.write(f"Froze {total} tabs (up to Tab {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully froze {total} tabs'))
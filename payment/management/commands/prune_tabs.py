@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payment.retention import RetentionError, prune_archive_chunk, prune_tabs_chunk, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Delete raw tabs, lines and payments older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=settings.RETENTION_DAYS,
+            help='Days of raw data to keep (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of tabs deleted per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--throttle',
+            type=float,
+            default=1.0,
+            help='Sleep this multiple of each chunk\'s run time before the next one (default: 1.0)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = retention_cutoff(options['keep_days'])
+        self.stdout.write(f"Pruning tabs opened before {cutoff:%Y-%m-%d}...")
+
+        for name, prune_chunk, label in (
+            ('tabs', prune_tabs_chunk, 'tabs.Tab'),
+            ('archived tabs', prune_archive_chunk, 'tabs.TabArchive'),
+        ):
+            position = None
+            total = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    counts, position = prune_chunk(cutoff, position, options['chunk_size'])
+                except RetentionError as e:
+                    raise CommandError(f'{e}. Run rollup_daily for those days first, then rerun to carry on')
+                if position is None:
+                    break
+                total += counts[label]
+                self.stdout.write(f"Pruned {total} {name}: " + ', '.join(
+                    f"{label} {count}" for label, count in counts.items()
+                ))
+                # Leave the database room for live traffic between chunks
+                time.sleep((time.perf_counter() - started) * options['throttle'])
+            self.stdout.write(self.style.SUCCESS(f'Successfully pruned {total} {name}'))
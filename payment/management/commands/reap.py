@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from payment import reaper
+
+
+class Command(BaseCommand):
+    help = 'Expire stale payment intents and close abandoned tabs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows locked per transaction (default: REAPER_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        result = reaper.reap(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(reaper.describe(result)))
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from epos import sharding
+from epos.replicas import reads_from_replica
+from payment.rollups import build_daily_totals
+
+
+class Command(BaseCommand):
+    help = 'Build the DailyTotals rollups that must exist before raw tabs are pruned'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            metavar='YYYY-MM-DD',
+            help='Build every day from this one up to yesterday (default: yesterday only)',
+        )
+
+    def handle(self, *args, **options):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        day = yesterday
+        if options['since']:
+            try:
+                day = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--since must look like YYYY-MM-DD')
+
+        # Rebuilding a day whose raw rows are gone would overwrite it with zeros
+        oldest = timezone.localdate() - timedelta(days=settings.RETENTION_DAYS)
+        if day < oldest:
+            raise CommandError(f'Days before {oldest} may already be pruned, refusing to rebuild them')
+
+        # Every shard builds its own rollups, all at once
+        built = sharding.fan_out(self.build, day, yesterday)
+        count = 0
+        for shard, rollups in built.items():
+            prefix = f"{shard} " if len(built) > 1 else ''
+            for rollup in rollups:
+                self.stdout.write(f"{prefix}{rollup.day}: {rollup.tabs} tabs, {rollup.total_p}p")
+            count += len(rollups)
+        self.stdout.write(self.style.SUCCESS(f'Successfully built {count} daily rollups'))
+
+    def build(self, day, last):
+        rollups = []
+        while day <= last:
+            # Past days no longer change, read them from a replica when there's a healthy one
+            with reads_from_replica():
+                rollups.append(build_daily_totals(day))
+            day += timedelta(days=1)
+        return rollups
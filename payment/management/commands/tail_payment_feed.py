@@ -0,0 +1,60 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payment import changefeed
+
+
+class Command(BaseCommand):
+    help = 'Print payment change records from the feed as NDJSON, starting at an offset'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            help='Resume from, and commit, the offset stored for this consumer',
+        )
+        parser.add_argument(
+            '--offset',
+            type=int,
+            help='Start at this offset (default: the consumer\'s offset, or the start of the feed)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Stop after this many records',
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Keep waiting for new records',
+        )
+
+    def handle(self, *args, **options):
+        directory = settings.PAYMENT_FEED_DIR
+        consumer = options['consumer']
+        if consumer:
+            try:
+                changefeed.check_consumer(consumer)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        offset = options['offset']
+        if offset is None:
+            offset = changefeed.committed_offsets(directory).get(consumer, 0) if consumer else 0
+
+        remaining = options['limit']
+        while True:
+            count = 0
+            for record_offset, offset, record in changefeed.read(directory, offset, limit=remaining):
+                self.stdout.write(json.dumps({'offset': record_offset, **record}, separators=(',', ':')))
+                count += 1
+            if consumer and count:
+                changefeed.commit_offset(directory, consumer, offset)
+            if remaining is not None:
+                remaining -= count
+            if not options['follow'] or remaining == 0:
+                break
+            time.sleep(1)
+
+        self.stderr.write(f"Next offset: {offset}")
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from epos import sharding
+from payment.rollups import REPORT_FIELDS, takings
+
+
+class Command(BaseCommand):
+    help = 'Report takings from the daily rollups of every shard, read in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', metavar='YYYY-MM-DD', required=True, help='First day to report')
+        parser.add_argument(
+            '--until',
+            metavar='YYYY-MM-DD',
+            help='Last day to report (default: yesterday)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            until = (
+                datetime.strptime(options['until'], '%Y-%m-%d').date() if options['until']
+                else timezone.localdate() - timedelta(days=1)
+            )
+        except ValueError:
+            raise CommandError('--since and --until must look like YYYY-MM-DD')
+
+        by_shard = sharding.fan_out(takings, since, until)
+        overall = {field: sum(totals[field] for totals in by_shard.values()) for field in REPORT_FIELDS}
+        for shard, totals in [*by_shard.items(), ('all', overall)]:
+            self.stdout.write(
+                f"{shard}: {totals['tabs']} tabs, {totals['covers']} covers, "
+                f"{totals['total_p']}p taken, {totals['payments_p']}p in payments"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Successfully reported {since} to {until}'))
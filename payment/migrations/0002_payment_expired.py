@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('requires_confirmation', 'Requires Confirmation'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('expired', 'Expired')], max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'requires_confirmation')), fields=['created_at'], name='payment_pending_created_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0002_payment_expired'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTotals',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('tabs', models.PositiveIntegerField(default=0)),
+                ('covers', models.PositiveIntegerField(default=0)),
+                ('subtotal_p', models.BigIntegerField(default=0)),
+                ('service_charge_p', models.BigIntegerField(default=0)),
+                ('vat_total_p', models.BigIntegerField(default=0)),
+                ('total_p', models.BigIntegerField(default=0)),
+                ('payments_p', models.BigIntegerField(default=0)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
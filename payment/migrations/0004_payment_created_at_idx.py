@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0003_daily_totals'),
+        ('tabs', '0009_tabevent_intent_expired'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at'], name='payment_created_at_idx'),
+        ),
+    ]
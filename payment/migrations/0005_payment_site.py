@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:39
+
+import epos.sharding
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0004_payment_created_at_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='site',
+            field=models.CharField(default=epos.sharding.current_site, max_length=50),
+        ),
+    ]
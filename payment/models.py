@@ -1,4 +1,5 @@
 from django.db import models
+from epos.sharding import current_site
 from tabs.models import Tab
 
 
@@ -7,9 +8,11 @@ class Payment(models.Model):
 		('requires_confirmation', 'Requires Confirmation'),
 		('succeeded', 'Succeeded'),
 		('failed', 'Failed'),
+		('expired', 'Expired'),
 	]
 	
 	tab = models.ForeignKey(Tab, on_delete=models.CASCADE, related_name='payments')
+	site = models.CharField(max_length=50, default=current_site)  # The tab's site
 	payment_intent_id = models.CharField(max_length=100, unique=True)  # Internal ID only
 	amount_p = models.PositiveIntegerField()
 	currency = models.CharField(max_length=3, default='gbp')
@@ -18,5 +21,31 @@ class Payment(models.Model):
 	created_at = models.DateTimeField(auto_now_add=True)
 	confirmed_at = models.DateTimeField(null=True, blank=True)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['created_at'], name='payment_created_at_idx'),
+			# Pending intents only, for the reaper
+			models.Index(
+				fields=['created_at'],
+				condition=models.Q(status='requires_confirmation'),
+				name='payment_pending_created_idx'
+			),
+		]
+
+	def __str__(self):
+		return f"Payment {self.id} for Tab {self.tab_id} - {self.status}"
+
+class DailyTotals(models.Model):
+	"""Takings for the paid and closed tabs opened on a day, kept after raw rows are pruned"""
+	day = models.DateField(primary_key=True)
+	tabs = models.PositiveIntegerField(default=0)
+	covers = models.PositiveIntegerField(default=0)
+	subtotal_p = models.BigIntegerField(default=0)
+	service_charge_p = models.BigIntegerField(default=0)
+	vat_total_p = models.BigIntegerField(default=0)
+	total_p = models.BigIntegerField(default=0)
+	payments_p = models.BigIntegerField(default=0)  # Succeeded payments only
+	built_at = models.DateTimeField(auto_now=True)
+
 	def __str__(self):
-		return f"Payment {self.id} for Tab {self.tab.id} - {self.status}"
+		return f"Totals for {self.day}"
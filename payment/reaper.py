@@ -0,0 +1,225 @@
+"""
+Reaper for stale payment intents and abandoned tabs.
+
+A payment intent still awaiting confirmation once its client secret has
+expired in Redis can never be confirmed, so it is marked expired. A tab
+left open for longer than REAPER_TAB_MAX_AGE_HOURS is closed and taken off
+the floor, unless it has an intent still awaiting confirmation. Stale
+intents are expired first, so their tabs are closed on the next run.
+
+Work is done in small batches. Each batch runs in its own short
+transaction and locks its rows with SKIP LOCKED, so a till that is using a
+row is never blocked by the reaper, and several reapers can run at once.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Min
+from django.utils import timezone
+from epos import sharding
+from tabs import events
+from tabs.models import OpenTab, Tab, TabEvent
+from . import changefeed
+from .gateway import SECRET_TTL_SECONDS
+from .models import Payment
+from .snapshots import freeze_tabs
+
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_REASON = 'Payment intent expired'
+
+
+def intent_cutoff(now):
+    """Intents created before this can no longer be confirmed"""
+    return now - timedelta(seconds=SECRET_TTL_SECONDS + settings.REAPER_INTENT_GRACE_SECONDS)
+
+
+def tab_cutoff(now):
+    """Tabs opened before this and still open are abandoned"""
+    return now - timedelta(hours=settings.REAPER_TAB_MAX_AGE_HOURS)
+
+
+def awaiting_payment():
+    """IDs of tabs with a payment intent still awaiting confirmation"""
+    return Payment.objects.filter(status='requires_confirmation').values('tab_id')
+
+
+def expire_intents(cutoff, batch_size):
+    """
+    Expire one batch of stale payment intents
+
+    Returns:
+        Number of intents expired, 0 when none are left that aren't locked
+    """
+    with sharding.atomic():
+        payments = list(
+            Payment.objects.select_for_update(skip_locked=True)
+            .filter(status='requires_confirmation', created_at__lt=cutoff)
+            .order_by('created_at')[:batch_size]
+        )
+        if not payments:
+            return 0
+
+        Payment.objects.filter(id__in=[payment.id for payment in payments]).update(
+            status='expired', failure_reason=EXPIRED_REASON
+        )
+        for payment in payments:
+            payment.status = 'expired'
+            payment.failure_reason = EXPIRED_REASON
+
+        TabEvent.objects.bulk_create([
+            TabEvent(tab_id=payment.tab_id, kind=TabEvent.INTENT_EXPIRED, data={
+                'payment_intent_id': payment.payment_intent_id,
+                'amount_p': payment.amount_p,
+            })
+            for payment in payments
+        ])
+        changefeed.record(*payments)
+    return len(payments)
+
+
+def close_abandoned_tabs(cutoff, batch_size, now):
+    """
+    Close one batch of tabs left open since before the cutoff
+
+    Candidates come from the small floor summary rather than tabs_tab, then
+    the tabs themselves are locked.
+
+    Returns:
+        Number of tabs closed, 0 when none are left that aren't locked
+    """
+    with sharding.atomic():
+        candidates = list(
+            OpenTab.objects.filter(opened_at__lt=cutoff)
+            .exclude(tab_id__in=awaiting_payment())
+            .order_by('opened_at')
+            .values_list('tab_id', flat=True)[:batch_size]
+        )
+        if not candidates:
+            return 0
+        tabs = list(
+            Tab.objects.select_for_update(skip_locked=True)
+            .filter(id__in=candidates, status='open')
+            .exclude(id__in=awaiting_payment())
+        )
+        if not tabs:
+            return 0
+
+        tab_ids = [tab.id for tab in tabs]
+        Tab.objects.filter(id__in=tab_ids).update(status='closed', closed_at=now)
+        OpenTab.objects.filter(tab_id__in=tab_ids).delete()
+        TabEvent.objects.bulk_create([
+            TabEvent(tab_id=tab_id, kind=TabEvent.TAB_CLOSED, data={'closed_at': now, 'abandoned': True})
+            for tab_id in tab_ids
+        ])
+        freeze_tabs(Tab.objects.filter(id__in=tab_ids))
+
+        for tab in tabs:
+            tab.status = 'closed'
+            tab.closed_at = now
+            events.publish(tab, events.TAB_CLOSED, total_p=tab.total_p)
+    return len(tabs)
+
+
+def lag(now):
+    """
+    How far behind the reaper is
+
+    Returns:
+        (intent_lag, tab_lag) in seconds: how long the oldest stale intent and
+        the oldest abandoned tab have been waiting, 0 when there are none
+    """
+    cutoff = intent_cutoff(now)
+    oldest_intent = (
+        Payment.objects.filter(status='requires_confirmation', created_at__lt=cutoff)
+        .aggregate(oldest=Min('created_at'))['oldest']
+    )
+    cutoff_tab = tab_cutoff(now)
+    oldest_tab = (
+        OpenTab.objects.filter(opened_at__lt=cutoff_tab).exclude(tab_id__in=awaiting_payment())
+        .aggregate(oldest=Min('opened_at'))['oldest']
+    )
+    return (
+        (cutoff - oldest_intent).total_seconds() if oldest_intent else 0,
+        (cutoff_tab - oldest_tab).total_seconds() if oldest_tab else 0,
+    )
+
+
+def reap(batch_size=None, pause=0):
+    """
+    Expire stale intents, then close abandoned tabs, a batch at a time
+
+    Args:
+        batch_size: Rows per transaction (default: REAPER_BATCH_SIZE)
+        pause: Seconds to sleep between batches
+
+    Returns:
+        Dict with the number of intents expired and tabs closed, the time
+        taken, rows per second, and the lag before and after the run
+    """
+    batch_size = batch_size or settings.REAPER_BATCH_SIZE
+    now = timezone.now()
+    started = time.perf_counter()
+    lag_before = lag(now)
+
+    expired = 0
+    while count := expire_intents(intent_cutoff(now), batch_size):
+        expired += count
+        time.sleep(pause)
+
+    closed = 0
+    while count := close_abandoned_tabs(tab_cutoff(now), batch_size, now):
+        closed += count
+        time.sleep(pause)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'expired': expired,
+        'closed': closed,
+        'elapsed': elapsed,
+        'rate': (expired + closed) / elapsed if elapsed else 0,
+        'lag_before': lag_before,
+        'lag_after': lag(now),
+    }
+
+
+def describe(result):
+    """One-line summary of a reap() result"""
+    return (
+        f"Expired {result['expired']} intents and closed {result['closed']} tabs "
+        f"in {result['elapsed']:.2f}s ({result['rate']:,.0f} rows/s). "
+        f"Lag before: intents {result['lag_before'][0]:.0f}s, tabs {result['lag_before'][1]:.0f}s; "
+        f"after: intents {result['lag_after'][0]:.0f}s, tabs {result['lag_after'][1]:.0f}s"
+    )
+
+
+def run_forever(interval):
+    while True:
+        time.sleep(interval)
+        close_old_connections()
+        try:
+            result = reap()
+            if result['expired'] or result['closed']:
+                logger.info(describe(result))
+        except Exception:
+            logger.exception("Reaper run failed")
+        finally:
+            close_old_connections()
+
+
+def start(interval=None):
+    """Run the reaper every REAPER_INTERVAL_SECONDS on a daemon thread in this process"""
+    thread = threading.Thread(
+        target=run_forever,
+        args=(interval or settings.REAPER_INTERVAL_SECONDS,),
+        name='payment-reaper',
+        daemon=True
+    )
+    thread.start()
+    return thread
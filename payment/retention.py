@@ -0,0 +1,135 @@
+"""
+Retention pruning of raw tab data.
+
+Tabs, their lines, payments, snapshots and event log rows older than the
+retention period are deleted in small chunks with plain set-based DELETEs,
+so nothing is loaded into Python and no transaction grows with the amount
+of data. Archived tab documents past the same cutoff are pruned the same
+way. Before a chunk is deleted, every day it covers must have a
+DailyTotals rollup built after the day ended and after the last of the
+chunk's tabs from that day was closed, since a rollup only counts tabs that
+were already paid or closed.
+
+Each chunk commits on its own, so an interrupted run loses nothing and a
+rerun carries on from the oldest rows left. TabStateSnapshot rows are kept
+because the event replay watermark is read from them.
+"""
+
+from datetime import timedelta
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from epos import sharding
+from tabs.models import OpenTab, Tab, TabArchive, TabEvent, TabItem, TabSnapshot
+from .models import DailyTotals, Payment
+from .rollups import day_bounds
+
+
+class RetentionError(Exception):
+    """Rows can't be pruned because the rollups covering them are missing"""
+
+    def __init__(self, days):
+        super().__init__(f"No finished rollup for {', '.join(str(day) for day in days)}")
+        self.days = days
+
+
+def retention_cutoff(keep_days):
+    """Raw rows for tabs opened before this are pruned"""
+    start, _ = day_bounds(timezone.localdate() - timedelta(days=keep_days))
+    return start
+
+
+def check_rollups(tabs):
+    """
+    Raise RetentionError unless every day tabs were opened on has a rollup counting them
+
+    Args:
+        tabs: (opened_at, closed_at) of each tab
+    """
+    # A day's rollup must be built after the day ended and after its last tab closed
+    finished = {}
+    for opened_at, closed_at in tabs:
+        day = timezone.localtime(opened_at).date()
+        finished[day] = max(finished.get(day, day_bounds(day)[1]), closed_at or opened_at)
+    built = dict(DailyTotals.objects.filter(day__in=finished).values_list('day', 'built_at'))
+    missing = sorted(day for day, at in finished.items() if day not in built or built[day] < at)
+    if missing:
+        raise RetentionError(missing)
+
+
+def delete_where(cursor, model, column, ids):
+    quote_name = cursor.db.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"DELETE FROM {table} WHERE {quote_name(column)} IN ({placeholders})", ids)
+    return cursor.rowcount
+
+
+def prune_tabs_chunk(cutoff, after, chunk_size):
+    """
+    Delete the next chunk of paid and closed tabs opened before the cutoff
+
+    Tabs are taken in (opened_at, id) order from the position the last chunk
+    ended at, so each chunk is a short range scan of the opened_at index.
+
+    Args:
+        after: (opened_at, id) of the last tab pruned, or None to start at the oldest
+
+    Returns:
+        (counts, position) where counts maps each table to the rows deleted
+        and position is where the next chunk starts, None when done
+
+    Raises:
+        RetentionError: If a day in the chunk has no finished rollup
+    """
+    tabs = Tab.objects.filter(status__in=['paid', 'closed'], opened_at__lt=cutoff)
+    if after is not None:
+        tabs = tabs.filter(Q(opened_at__gt=after[0]) | Q(opened_at=after[0], id__gt=after[1]))
+    rows = list(tabs.order_by('opened_at', 'id').values_list('opened_at', 'id', 'closed_at')[:chunk_size])
+    if not rows:
+        return {}, None
+
+    check_rollups((opened_at, closed_at) for opened_at, _, closed_at in rows)
+
+    ids = [tab_id for _, tab_id, _ in rows]
+    counts = {}
+    with sharding.atomic(), connections[sharding.current_shard()].cursor() as cursor:
+        # Children first, so the tab rows go last
+        for model, column in (
+            (TabItem, 'tab_id'),
+            (Payment, 'tab_id'),
+            (TabSnapshot, 'tab_id'),
+            (OpenTab, 'tab_id'),
+            (TabEvent, 'tab_id'),
+            (Tab, 'id'),
+        ):
+            counts[model._meta.label] = delete_where(cursor, model, column, ids)
+    return counts, rows[-1][:2]
+
+
+def prune_archive_chunk(cutoff, after, chunk_size):
+    """
+    Delete the next chunk of archived tabs opened before the cutoff
+
+    Args:
+        after: tab_id of the last archived tab pruned, or None to start at the first
+
+    Returns:
+        (counts, position) as for prune_tabs_chunk
+    """
+    archived = TabArchive.objects.filter(opened_at__lt=cutoff)
+    if after is not None:
+        archived = archived.filter(tab_id__gt=after)
+    rows = list(archived.order_by('tab_id').values_list('tab_id', 'opened_at', 'closed_at')[:chunk_size])
+    if not rows:
+        return {}, None
+
+    check_rollups((opened_at, closed_at) for _, opened_at, closed_at in rows)
+
+    ids = [tab_id for tab_id, _, _ in rows]
+    counts = {}
+    with sharding.atomic(), connections[sharding.current_shard()].cursor() as cursor:
+        for model in (TabEvent, TabArchive):
+            counts[model._meta.label] = delete_where(cursor, model, 'tab_id', ids)
+    return counts, rows[-1][0]
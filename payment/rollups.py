@@ -0,0 +1,74 @@
+"""
+Daily takings rollups.
+
+DailyTotals keeps the totals of each day's paid and closed tabs once the
+raw tabs, lines and payments have been pruned. Tabs already moved to
+TabArchive are counted from their archived documents.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Sum
+from django.utils import timezone
+from tabs.models import Tab, TabArchive
+from .archive import month_start
+from .models import DailyTotals, Payment
+
+
+TOTAL_FIELDS = ['covers', 'subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p']
+
+# Every summable DailyTotals field
+REPORT_FIELDS = ['tabs', *TOTAL_FIELDS, 'payments_p']
+
+
+def day_bounds(day):
+    """Start of a local day and of the day after"""
+    return (
+        timezone.make_aware(datetime.combine(day, time.min)),
+        timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min)),
+    )
+
+
+def build_daily_totals(day):
+    """
+    Rebuild the rollup for the tabs opened on a day
+
+    Returns:
+        The saved DailyTotals
+    """
+    start, end = day_bounds(day)
+    tabs = Tab.objects.filter(status__in=['paid', 'closed'], opened_at__gte=start, opened_at__lt=end)
+    totals = tabs.aggregate(tabs=Count('id'), **{field: Sum(field) for field in TOTAL_FIELDS})
+    totals = {field: value or 0 for field, value in totals.items()}
+    totals['payments_p'] = (
+        Payment.objects.filter(tab__in=tabs, status='succeeded')
+        .aggregate(total=Sum('amount_p'))['total'] or 0
+    )
+
+    archived = (
+        TabArchive.objects.filter(month=month_start(day), opened_at__gte=start, opened_at__lt=end)
+        .values_list('data', flat=True)
+    )
+    for data in archived.iterator(chunk_size=1000):
+        totals['tabs'] += 1
+        for field in TOTAL_FIELDS:
+            totals[field] += data[field]
+        totals['payments_p'] += sum(
+            payment['amount_p'] for payment in data.get('payments', []) if payment['status'] == 'succeeded'
+        )
+
+    rollup, _ = DailyTotals.objects.update_or_create(day=day, defaults=totals)
+    return rollup
+
+
+def takings(since, until):
+    """
+    Summed rollups for the days from since to until, inclusive
+
+    Returns:
+        Dict of REPORT_FIELDS and the number of days rolled up
+    """
+    totals = DailyTotals.objects.filter(day__gte=since, day__lte=until).aggregate(
+        days=Count('day'), **{field: Sum(field) for field in REPORT_FIELDS}
+    )
+    return {field: value or 0 for field, value in totals.items()}
@@ -1,4 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
+from tabs.models import Tab
 from .models import Payment
 
 
@@ -21,3 +23,69 @@ class TakePaymentSerializer(serializers.Serializer):
         max_length=100,
         help_text="Client secret from payment intent creation"
     )
+
+
+class SyncLineSerializer(serializers.Serializer):
+    menu_item_id = serializers.IntegerField(help_text="ID of the menu item")
+    qty = serializers.IntegerField(min_value=1, help_text="Quantity (minimum 1)")
+
+
+class SyncPaymentSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=['succeeded', 'failed'])
+    amount_p = serializers.IntegerField(min_value=0, help_text="Amount in pence")
+    currency = serializers.CharField(max_length=3, default='gbp')
+    failure_reason = serializers.CharField(max_length=200, required=False, allow_blank=True, allow_null=True)
+    confirmed_at = serializers.DateTimeField(required=False, allow_null=True)
+
+
+class SyncTabSerializer(serializers.Serializer):
+    client_id = serializers.CharField(
+        max_length=64,
+        help_text="ID generated by the till, tabs already synced with this ID are skipped"
+    )
+    table_number = serializers.IntegerField(min_value=1)
+    covers = serializers.IntegerField(min_value=1)
+    status = serializers.ChoiceField(choices=Tab.STATUS_CHOICES)
+    opened_at = serializers.DateTimeField()
+    closed_at = serializers.DateTimeField(required=False, allow_null=True)
+    items = SyncLineSerializer(many=True)
+    payments = SyncPaymentSerializer(many=True, required=False, default=list)
+
+    def validate(self, data):
+        # Paid and closed tabs feed the rollups and retention checks, so they must be complete
+        closed_at = data.get('closed_at')
+        if data['status'] == 'open':
+            if closed_at is not None:
+                raise serializers.ValidationError({'closed_at': "An open tab can't have closed_at"})
+        elif closed_at is None:
+            raise serializers.ValidationError({'closed_at': "A paid or closed tab needs closed_at"})
+        elif closed_at < data['opened_at']:
+            raise serializers.ValidationError({'closed_at': "closed_at can't be before opened_at"})
+
+        if data['status'] == 'paid' and not any(payment['status'] == 'succeeded' for payment in data['payments']):
+            raise serializers.ValidationError({'payments': "A paid tab needs a succeeded payment"})
+        return data
+
+
+class SyncRequestSerializer(serializers.Serializer):
+    tabs = SyncTabSerializer(many=True, allow_empty=False)
+
+    def validate_tabs(self, value):
+        if len(value) > settings.SYNC_MAX_TABS:
+            raise serializers.ValidationError(
+                f"A sync may contain at most {settings.SYNC_MAX_TABS} tabs"
+            )
+        return value
+
+
+class SyncedTabSerializer(serializers.Serializer):
+    client_id = serializers.CharField()
+    tab_id = serializers.IntegerField()
+
+
+class SyncResultSerializer(serializers.Serializer):
+    created = SyncedTabSerializer(many=True)
+    duplicates = serializers.ListField(
+        child=serializers.CharField(),
+        help_text="client_ids that were already synced and were skipped"
+    )
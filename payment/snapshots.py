@@ -0,0 +1,47 @@
+from tabs import fast_serializers
+from tabs.models import Tab, TabSnapshot
+from .fast_serializers import PAYMENT_FIELDS, payment_data
+from .models import Payment
+
+
+def build_snapshots(tab_ids):
+    """
+    Serialise tabs with their items and payments into plain JSON documents
+
+    Returns:
+        Dict of tab ID to TabSerializer output with a payments list added
+    """
+    payments = {}
+    for row in Payment.objects.filter(tab_id__in=tab_ids).order_by('id').values(*PAYMENT_FIELDS):
+        payments.setdefault(row['tab_id'], []).append(payment_data(row))
+
+    documents = fast_serializers.tabs_data(tab_ids)
+    for tab_id, data in documents.items():
+        data['payments'] = payments.get(tab_id, [])
+    return documents
+
+
+def freeze_tabs(tabs):
+    """
+    Store frozen snapshots for a batch of tabs
+
+    Args:
+        tabs: Queryset of tabs to freeze (existing snapshots are replaced)
+
+    Returns:
+        Number of snapshots written
+    """
+    documents = build_snapshots(list(tabs.values_list('id', flat=True)))
+    snapshots = [TabSnapshot(tab_id=tab_id, data=data) for tab_id, data in documents.items()]
+    TabSnapshot.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['tab'],
+        update_fields=['data'],
+    )
+    return len(snapshots)
+
+
+def freeze_tab(tab):
+    """Store the frozen snapshot for a single paid or closed tab"""
+    freeze_tabs(Tab.objects.filter(pk=tab.pk))
@@ -0,0 +1,182 @@
+"""
+Bulk ingestion of tabs recorded by offline tills.
+
+A whole batch is validated against the menu in memory, priced once per tab
+and written in a single transaction with one bulk insert per table.
+"""
+
+import uuid
+
+from epos import sharding
+from tabs import pricing
+from tabs.models import MenuItem, OpenTab, Tab, TabEvent, TabItem
+from . import changefeed
+from .models import Payment
+from .snapshots import freeze_tabs
+
+
+class SyncError(Exception):
+    """The batch cannot be ingested, nothing has been written"""
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def ingest(tabs_data):
+    """
+    Ingest a batch of validated tabs from SyncTabSerializer
+
+    Tabs whose client_id was already synced at this site (or repeats
+    within the batch) are skipped and reported as duplicates.
+
+    Returns:
+        (created, duplicates) where created is a list of (client_id, tab_id)
+
+    Raises:
+        SyncError: If a line refers to an unknown menu item or an open tab
+            clashes with another open tab on the same table
+    """
+    # De-duplicate within the batch, then against what has already been synced
+    already_synced = set(
+        Tab.objects.filter(site=sharding.current_site(), client_id__in=[tab['client_id'] for tab in tabs_data])
+        .values_list('client_id', flat=True)
+    )
+    duplicates = []
+    new_tabs = []
+    for tab_data in tabs_data:
+        if tab_data['client_id'] in already_synced:
+            duplicates.append(tab_data['client_id'])
+        else:
+            already_synced.add(tab_data['client_id'])
+            new_tabs.append(tab_data)
+
+    # The menu is small, validate every line against it in memory
+    menu = MenuItem.objects.in_bulk()
+    missing = sorted({
+        line['menu_item_id']
+        for tab_data in new_tabs
+        for line in tab_data['items']
+        if line['menu_item_id'] not in menu
+    })
+    if missing:
+        raise SyncError({'error': 'Menu item not found', 'menu_item_ids': missing})
+
+    open_tables = [tab_data['table_number'] for tab_data in new_tabs if tab_data['status'] == 'open']
+    clashes = {table for table in open_tables if open_tables.count(table) > 1}
+    clashes.update(
+        Tab.objects.filter(site=sharding.current_site(), status='open', table_number__in=open_tables)
+        .values_list('table_number', flat=True)
+    )
+    if clashes:
+        raise SyncError({'error': 'Table already has an open tab', 'table_numbers': sorted(clashes)})
+
+    tabs = []
+    lines = []
+    for tab_data in new_tabs:
+        priced = pricing.price_lines(
+            (menu[line['menu_item_id']].unit_price_p, line['qty'], menu[line['menu_item_id']].vat_rate_bp)
+            for line in tab_data['items']
+        )
+        totals = pricing.total_lines(priced)
+        tab = Tab(
+            client_id=tab_data['client_id'],
+            table_number=tab_data['table_number'],
+            covers=tab_data['covers'],
+            status=tab_data['status'],
+            opened_at=tab_data['opened_at'],
+            closed_at=tab_data.get('closed_at'),
+            **totals._asdict()
+        )
+        tabs.append(tab)
+        lines.append(priced)
+
+    with sharding.atomic():
+        Tab.objects.bulk_create(tabs)
+
+        tab_items = TabItem.objects.bulk_create([
+            TabItem(
+                tab=tab,
+                menu_item=menu[line['menu_item_id']],
+                qty=line['qty'],
+                unit_price_p=menu[line['menu_item_id']].unit_price_p,
+                vat_rate_percent=menu[line['menu_item_id']].vat_rate_percent,
+                vat_p=priced_line.vat_p,
+                line_total_p=priced_line.line_total_p
+            )
+            for tab, tab_data, priced in zip(tabs, new_tabs, lines)
+            for line, priced_line in zip(tab_data['items'], priced)
+        ])
+
+        payments = Payment.objects.bulk_create([
+            Payment(
+                tab=tab,
+                site=tab.site,
+                payment_intent_id=f"pi_sync_{uuid.uuid4().hex}",
+                amount_p=payment['amount_p'],
+                currency=payment['currency'],
+                status=payment['status'],
+                failure_reason=payment.get('failure_reason'),
+                confirmed_at=payment.get('confirmed_at')
+            )
+            for tab, tab_data in zip(tabs, new_tabs)
+            for payment in tab_data['payments']
+        ])
+
+        OpenTab.objects.bulk_create([
+            OpenTab(
+                tab=tab,
+                site=tab.site,
+                table_number=tab.table_number,
+                covers=tab.covers,
+                opened_at=tab.opened_at,
+                total_p=tab.total_p
+            )
+            for tab in tabs if tab.status == 'open'
+        ])
+
+        TabEvent.objects.bulk_create(sync_events(tabs, tab_items, payments))
+        changefeed.record(*payments)
+
+        freeze_tabs(Tab.objects.filter(
+            id__in=[tab.id for tab in tabs if tab.status in ('paid', 'closed')]
+        ))
+
+    return [(tab.client_id, tab.id) for tab in tabs], duplicates
+
+
+def sync_events(tabs, tab_items, payments):
+    """Event log entries for synced tabs, in the order the till made the changes"""
+    items_by_tab = {}
+    for tab_item in tab_items:
+        items_by_tab.setdefault(tab_item.tab_id, []).append(tab_item)
+    payments_by_tab = {}
+    for payment in payments:
+        payments_by_tab.setdefault(payment.tab_id, []).append(payment)
+
+    for tab in tabs:
+        yield TabEvent(tab_id=tab.id, kind=TabEvent.TAB_OPENED, data={
+            'table_number': tab.table_number,
+            'covers': tab.covers,
+            'opened_at': tab.opened_at,
+        })
+        for tab_item in items_by_tab.get(tab.id, []):
+            yield TabEvent(tab_id=tab.id, kind=TabEvent.LINE_ADDED, data={
+                'tab_item_id': tab_item.id,
+                'menu_item_id': tab_item.menu_item_id,
+                'qty': tab_item.qty,
+                'unit_price_p': tab_item.unit_price_p,
+                'vat_p': tab_item.vat_p,
+                'line_total_p': tab_item.line_total_p,
+            })
+        for payment in payments_by_tab.get(tab.id, []):
+            data = {'payment_intent_id': payment.payment_intent_id, 'amount_p': payment.amount_p}
+            if payment.status == 'succeeded':
+                kind = TabEvent.PAYMENT_SUCCEEDED
+                data['closed_at'] = tab.closed_at
+            else:
+                kind = TabEvent.PAYMENT_FAILED
+                data['reason'] = payment.failure_reason
+            yield TabEvent(tab_id=tab.id, kind=kind, data=data)
+        if tab.status == 'closed':
+            yield TabEvent(tab_id=tab.id, kind=TabEvent.TAB_CLOSED, data={'closed_at': tab.closed_at})
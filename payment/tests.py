@@ -1,11 +1,35 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import Mock, patch
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from unittest import skipUnless
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
 from django.utils import timezone
-from tabs.models import Tab, MenuItem, TabItem
-from .models import Payment
+from tabs import replay, views
+from tabs.models import Tab, MenuItem, TabItem, TabSnapshot, TabArchive, TabEvent, OpenTab
+from tabs.serializers import TabSerializer
+from . import changefeed, reaper
+from .archive import detach_month
+from .rollups import build_daily_totals
+from .models import DailyTotals, Payment
+from .serializers import PaymentSerializer, TakePaymentSerializer
+from .snapshots import build_snapshots
 from .gateway import MockPaymentGateway
+from apikeys import keys
+from epos import sharding
+from epos.validation import CompiledSerializer
 from decimal import Decimal
 
 
@@ -305,3 +329,817 @@ class EndToEndPaymentTests(APITestCase):
             url = reverse('get_tab', kwargs={'tab_id': tab_id})
             response = self.client.get(url)
             self.assertEqual(response.data['status'], 'open')
+
+
+class TabSnapshotTests(APITestCase):
+    """Test tabs are frozen into a snapshot once paid"""
+    
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.tab = Tab.objects.create(table_number=1, covers=2)
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+        
+        url = reverse('add_menu_item', kwargs={'tab_id': self.tab.id})
+        self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 2}, format='json')
+    
+    def pay_tab(self):
+        url = reverse('create_payment_intent', kwargs={'tab_id': self.tab.id})
+        client_secret = self.client.post(url, {}, format='json').data['client_secret']
+        url = reverse('take_payment', kwargs={'tab_id': self.tab.id})
+        return self.client.post(url, {'client_secret': client_secret}, format='json')
+    
+    def test_snapshot_written_on_payment(self):
+        """Test taking payment freezes the tab with its payments"""
+        response = self.pay_tab()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        snapshot = TabSnapshot.objects.get(tab=self.tab)
+        self.assertEqual(snapshot.data['status'], 'paid')
+        self.assertEqual(len(snapshot.data['items']), 1)
+        self.assertEqual(snapshot.data['items'][0]['menu_item_name'], 'Test Item')
+        self.assertEqual([p['status'] for p in snapshot.data['payments']], ['succeeded'])
+    
+    def test_snapshot_matches_serializers(self):
+        """Test the snapshot renders the same as TabSerializer with PaymentSerializer"""
+        Payment.objects.create(
+            tab=self.tab, payment_intent_id='pi_failed', amount_p=1300,
+            status='failed', failure_reason='Card declined'
+        )
+        self.pay_tab()
+
+        tab = Tab.objects.get(id=self.tab.id)
+        expected = TabSerializer(tab).data
+        expected['payments'] = PaymentSerializer(tab.payments.order_by('id'), many=True).data
+
+        rendered = JSONRenderer().render(build_snapshots([tab.id])[tab.id])
+        self.assertEqual(rendered, JSONRenderer().render(expected))
+        self.assertEqual(TabSnapshot.objects.get(tab=tab).data, json.loads(rendered))
+    
+    def test_payment_logged(self):
+        """Test the payment events are logged and replay to a paid tab"""
+        self.pay_tab()
+        
+        kinds = list(TabEvent.objects.filter(tab_id=self.tab.id).order_by('id').values_list('kind', flat=True))
+        self.assertEqual(kinds, [TabEvent.LINE_ADDED, TabEvent.INTENT_CREATED, TabEvent.PAYMENT_SUCCEEDED])
+        states, _ = replay.replay(tab_ids=[self.tab.id], use_snapshots=False)
+        self.assertEqual(states[self.tab.id]['status'], 'paid')
+        self.assertEqual(states[self.tab.id]['paid_p'], Tab.objects.get(id=self.tab.id).total_p)
+    
+    def test_paid_tab_without_snapshot(self):
+        """Test a paid tab that was never frozen still comes with its payments"""
+        self.pay_tab()
+        frozen = self.client.get(reverse('get_tab', kwargs={'tab_id': self.tab.id})).data
+        TabSnapshot.objects.filter(tab=self.tab).delete()
+        
+        response = self.client.get(reverse('get_tab', kwargs={'tab_id': self.tab.id}))
+        
+        self.assertEqual(response.data, frozen)
+        self.assertEqual([payment['status'] for payment in response.data['payments']], ['succeeded'])
+    
+    def test_paid_tab_served_from_snapshot(self):
+        """Test getting a paid tab is a single row fetch of the snapshot"""
+        self.pay_tab()
+        url = reverse('get_tab', kwargs={'tab_id': self.tab.id})
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'paid')
+        self.assertEqual(response.data['total_p'], 1300)
+        self.assertEqual(len(response.data['payments']), 1)
+    
+    def test_open_tab_not_frozen(self):
+        """Test open tabs are still serialised live"""
+        url = reverse('get_tab', kwargs={'tab_id': self.tab.id})
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('payments', response.data)
+        self.assertFalse(TabSnapshot.objects.exists())
+    
+    def test_backfill_command(self):
+        """Test the backfill command freezes historical paid tabs only"""
+        self.tab.status = 'paid'
+        self.tab.save()
+        open_tab = Tab.objects.create(table_number=2, covers=1)
+        
+        call_command('freeze_tabs', batch_size=1, stdout=StringIO())
+        
+        self.assertTrue(TabSnapshot.objects.filter(tab=self.tab).exists())
+        self.assertFalse(TabSnapshot.objects.filter(tab=open_tab).exists())
+
+
+class ArchiveTabsTests(APITestCase):
+    """Test moving old tabs to the archive and detaching archive months"""
+    
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+    
+    def make_tab(self, opened_at, status='paid'):
+        tab = Tab.objects.create(table_number=1, covers=2, status=status)
+        TabItem.objects.create(
+            tab=tab,
+            menu_item=self.menu_item,
+            qty=1,
+            unit_price_p=500,
+            vat_rate_percent=Decimal('20.0'),
+            vat_p=100,
+            line_total_p=600
+        )
+        Payment.objects.create(
+            tab=tab,
+            payment_intent_id=f"pi_archive_{tab.id}",
+            amount_p=650,
+            status='succeeded'
+        )
+        # opened_at is auto_now_add, so backdate it with an update
+        Tab.objects.filter(id=tab.id).update(opened_at=opened_at)
+        # Tabs are only archived once their day is rolled up
+        build_daily_totals(timezone.localtime(opened_at).date())
+        return tab
+    
+    def test_archive_refused_without_rollups(self):
+        """Test tabs whose day isn't rolled up stay in the hot tables"""
+        old_tab = self.make_tab(timezone.now() - timedelta(days=365))
+        DailyTotals.objects.all().delete()
+        
+        with self.assertRaisesMessage(CommandError, 'Run rollup_daily'):
+            call_command('archive_tabs', keep_months=3, stdout=StringIO())
+        
+        self.assertTrue(Tab.objects.filter(id=old_tab.id).exists())
+        self.assertFalse(TabArchive.objects.exists())
+    
+    def test_old_paid_tabs_archived(self):
+        """Test old paid tabs leave the hot tables and are still readable"""
+        old_tab = self.make_tab(timezone.now() - timedelta(days=365))
+        recent_tab = self.make_tab(timezone.now())
+        old_open_tab = self.make_tab(timezone.now() - timedelta(days=365), status='open')
+        
+        call_command('archive_tabs', keep_months=3, stdout=StringIO())
+        
+        self.assertFalse(Tab.objects.filter(id=old_tab.id).exists())
+        self.assertFalse(TabItem.objects.filter(tab_id=old_tab.id).exists())
+        self.assertFalse(Payment.objects.filter(tab_id=old_tab.id).exists())
+        self.assertTrue(Tab.objects.filter(id=recent_tab.id).exists())
+        self.assertTrue(Tab.objects.filter(id=old_open_tab.id).exists())
+        
+        archived = TabArchive.objects.get(tab_id=old_tab.id)
+        self.assertEqual(len(archived.data['payments']), 1)
+        
+        response = self.client.get(reverse('get_tab', kwargs={'tab_id': old_tab.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], old_tab.id)
+        self.assertEqual(len(response.data['items']), 1)
+    
+    def test_detach_month(self):
+        """Test archived months are written to gzipped NDJSON and dropped"""
+        old_tab = self.make_tab(timezone.now() - timedelta(days=365))
+        call_command('archive_tabs', keep_months=3, stdout=StringIO())
+        month = TabArchive.objects.get(tab_id=old_tab.id).month
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command(
+                'archive_tabs',
+                detach_before=timezone.now().strftime('%Y-%m'),
+                output_dir=tmp,
+                stdout=StringIO()
+            )
+            
+            with gzip.open(os.path.join(tmp, f"tabs-{month:%Y-%m}.ndjson.gz"), 'rt') as f:
+                documents = [json.loads(line) for line in f]
+        
+        self.assertEqual([d['id'] for d in documents], [old_tab.id])
+        self.assertFalse(TabArchive.objects.exists())
+        response = self.client.get(reverse('get_tab', kwargs={'tab_id': old_tab.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_detach_keeps_rows_archived_after_writing(self):
+        """Test a tab archived into a month while it is being written out isn't dropped"""
+        old_tab = self.make_tab(timezone.now() - timedelta(days=365))
+        call_command('archive_tabs', keep_months=3, stdout=StringIO())
+        written = TabArchive.objects.get(tab_id=old_tab.id)
+        replace = os.replace
+        
+        def archive_another(src, dst):
+            TabArchive.objects.create(
+                tab_id=old_tab.id + 100, month=written.month, table_number=2, status='paid',
+                opened_at=written.opened_at, total_p=0, data={'id': old_tab.id + 100}
+            )
+            replace(src, dst)
+        
+        with tempfile.TemporaryDirectory() as tmp, patch('payment.archive.os.replace', archive_another):
+            path, count = detach_month(written.month, tmp)
+        
+        self.assertEqual(count, 1)
+        self.assertEqual(list(TabArchive.objects.values_list('tab_id', flat=True)), [old_tab.id + 100])
+
+
+class SyncAPITests(APITestCase):
+    """Test bulk ingestion of tabs from offline tills"""
+    
+    def setUp(self):
+        self.coffee = MenuItem.objects.create(
+            name="Coffee",
+            unit_price_p=350,  # £3.50
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.kids_meal = MenuItem.objects.create(
+            name="Kids Meal",
+            unit_price_p=700,  # £7.00
+            vat_rate_percent=Decimal('5.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+    
+    def tab_data(self, client_id, table_number=5, status='paid'):
+        return {
+            'client_id': client_id,
+            'table_number': table_number,
+            'covers': 2,
+            'status': status,
+            'opened_at': '2024-01-01T12:00:00Z',
+            'closed_at': '2024-01-01T12:45:00Z' if status == 'paid' else None,
+            'items': [
+                {'menu_item_id': self.coffee.id, 'qty': 2},
+                {'menu_item_id': self.kids_meal.id, 'qty': 1},
+            ],
+            'payments': [
+                {'status': 'succeeded', 'amount_p': 1978, 'confirmed_at': '2024-01-01T12:44:00Z'}
+            ] if status == 'paid' else [],
+        }
+    
+    def test_sync_paid_tab(self):
+        """Test a synced tab is stored with lines, totals, payments and snapshot"""
+        response = self.client.post(reverse('sync'), {'tabs': [self.tab_data('till-1')]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['duplicates'], [])
+        tab = Tab.objects.get(client_id='till-1')
+        self.assertEqual(response.data['created'], [{'client_id': 'till-1', 'tab_id': tab.id}])
+        
+        # Coffee: 700p + 140p VAT, Kids Meal: 700p + 35p VAT
+        self.assertEqual(tab.subtotal_p, 1400)
+        self.assertEqual(tab.vat_total_p, 175)
+        self.assertEqual(tab.service_charge_p, 140)
+        self.assertEqual(tab.total_p, 1715)
+        self.assertEqual(tab.opened_at.isoformat(), '2024-01-01T12:00:00+00:00')
+        self.assertEqual(tab.items.count(), 2)
+        self.assertEqual(tab.payments.get().status, 'succeeded')
+        self.assertTrue(TabSnapshot.objects.filter(tab=tab).exists())
+    
+    def test_sync_logs_events(self):
+        """Test a synced tab replays to the same totals and status"""
+        self.client.post(reverse('sync'), {'tabs': [self.tab_data('till-1')]}, format='json')
+        tab = Tab.objects.get(client_id='till-1')
+        
+        states, count = replay.replay(tab_ids=[tab.id], use_snapshots=False)
+        
+        self.assertEqual(count, 4)  # Opened, two lines, paid
+        self.assertEqual(states[tab.id]['status'], 'paid')
+        self.assertEqual(replay.totals(states[tab.id]).total_p, tab.total_p)
+    
+    def test_sync_is_idempotent(self):
+        """Test replaying a batch skips tabs that were already synced"""
+        batch = {'tabs': [self.tab_data('till-1'), self.tab_data('till-2'), self.tab_data('till-2')]}
+        
+        first = self.client.post(reverse('sync'), batch, format='json')
+        second = self.client.post(reverse('sync'), batch, format='json')
+        
+        self.assertEqual(len(first.data['created']), 2)
+        self.assertEqual(first.data['duplicates'], ['till-2'])
+        self.assertEqual(second.data['created'], [])
+        self.assertEqual(second.data['duplicates'], ['till-1', 'till-2', 'till-2'])
+        self.assertEqual(Tab.objects.count(), 2)
+        self.assertEqual(TabItem.objects.count(), 4)
+        self.assertEqual(Payment.objects.count(), 2)
+    
+    def test_sync_client_ids_per_site(self):
+        """Test tills at two sites can sync the same client_id"""
+        batch = {'tabs': [self.tab_data('till-3-0001')]}
+        
+        soho = self.client.post(reverse('sync'), batch, format='json', HTTP_X_SITE='soho')
+        shoreditch = self.client.post(reverse('sync'), batch, format='json', HTTP_X_SITE='shoreditch')
+        
+        self.assertEqual(soho.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(shoreditch.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(shoreditch.data['duplicates'], [])
+        self.assertEqual(
+            sorted(Tab.objects.filter(client_id='till-3-0001').values_list('site', flat=True)),
+            ['shoreditch', 'soho']
+        )
+    
+    def test_sync_open_tab_goes_on_floor(self):
+        """Test an open synced tab appears on the floor"""
+        self.client.post(reverse('sync'), {'tabs': [self.tab_data('till-1', status='open')]}, format='json')
+        
+        floor = self.client.get(reverse('floor')).data
+        self.assertEqual([entry['table_number'] for entry in floor], [5])
+    
+    def test_sync_rejects_unknown_menu_item(self):
+        """Test a batch with an unknown menu item writes nothing"""
+        bad = self.tab_data('till-2')
+        bad['items'].append({'menu_item_id': 9999, 'qty': 1})
+        
+        response = self.client.post(reverse('sync'), {'tabs': [self.tab_data('till-1'), bad]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['menu_item_ids'], [9999])
+        self.assertFalse(Tab.objects.exists())
+    
+    def test_sync_rejects_inconsistent_tabs(self):
+        """Test paid or closed tabs missing their close or payment are rejected, each with its own error"""
+        no_payment = self.tab_data('till-2')
+        no_payment['payments'] = []
+        not_closed = self.tab_data('till-3')
+        not_closed['closed_at'] = None
+        closed_early = self.tab_data('till-4', status='closed')
+        closed_early['closed_at'] = '2024-01-01T11:00:00Z'
+        open_closed = self.tab_data('till-5', status='open')
+        open_closed['closed_at'] = '2024-01-01T12:45:00Z'
+        
+        response = self.client.post(reverse('sync'), {
+            'tabs': [self.tab_data('till-1'), no_payment, not_closed, closed_early, open_closed]
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data['tabs']
+        self.assertEqual(errors[0], {})
+        self.assertIn('payments', errors[1])
+        self.assertEqual([list(error) for error in errors[2:]], [['closed_at'], ['closed_at'], ['closed_at']])
+        self.assertFalse(Tab.objects.exists())
+    
+    def test_sync_rejects_clashing_open_tabs(self):
+        """Test two open tabs for one table are rejected"""
+        Tab.objects.create(table_number=5, covers=2)
+        
+        response = self.client.post(reverse('sync'), {'tabs': [self.tab_data('till-1', status='open')]}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['table_numbers'], [5])
+    
+    def test_sync_query_count_does_not_grow_with_batch(self):
+        """Test the number of queries is the same for 1 and 20 tabs"""
+        def queries_for(client_ids):
+            batch = {'tabs': [self.tab_data(client_id) for client_id in client_ids]}
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(reverse('sync'), batch, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(ctx.captured_queries)
+        
+        self.assertEqual(
+            queries_for(['till-1']),
+            queries_for([f"till-batch-{i}" for i in range(20)])
+        )
+
+
+class PaymentFeedTests(APITestCase):
+    """Test the payment change-data feed segments"""
+    
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.feed_dir = tmp.name
+        override = override_settings(PAYMENT_FEED_DIR=self.feed_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.tab = Tab.objects.create(table_number=1, covers=2)
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+        url = reverse('add_menu_item', kwargs={'tab_id': self.tab.id})
+        self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 2}, format='json')
+    
+    def write(self, count, segment_bytes):
+        writer = changefeed.SegmentWriter(self.feed_dir, segment_bytes)
+        return writer.append([changefeed.encode({'n': n}) for n in range(count)])
+    
+    def test_payment_transitions_written(self):
+        """Test creating and taking a payment appends both states after commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            url = reverse('create_payment_intent', kwargs={'tab_id': self.tab.id})
+            client_secret = self.client.post(url, {}, format='json').data['client_secret']
+        with self.captureOnCommitCallbacks(execute=True):
+            url = reverse('take_payment', kwargs={'tab_id': self.tab.id})
+            self.client.post(url, {'client_secret': client_secret}, format='json')
+        changefeed.get_feed().flush()
+        
+        records = [record for _, _, record in changefeed.read(self.feed_dir)]
+        payment = Payment.objects.get()
+        self.assertEqual([r['status'] for r in records], ['requires_confirmation', 'succeeded'])
+        self.assertEqual({(r['shard'], r['site'], r['payment_id']) for r in records}, {('default', 'main', payment.id)})
+        self.assertEqual(records[1]['amount_p'], payment.amount_p)
+    
+    def test_segments_rotate_and_resume_from_offset(self):
+        """Test segments rotate by size and reads resume from any offset"""
+        end = self.write(10, segment_bytes=30)
+        
+        self.assertGreater(len(changefeed.segments(self.feed_dir)), 1)
+        read = list(changefeed.read(self.feed_dir))
+        self.assertEqual([record['n'] for _, _, record in read], list(range(10)))
+        self.assertEqual(read[-1][1], end)
+        
+        # Resume from the middle, across a segment boundary
+        resumed = list(changefeed.read(self.feed_dir, offset=read[4][1], limit=3))
+        self.assertEqual([record['n'] for _, _, record in resumed], [5, 6, 7])
+        self.assertEqual(list(changefeed.read(self.feed_dir, offset=end)), [])
+    
+    def test_partial_line_not_read(self):
+        """Test a record still being written is left for the next read"""
+        end = self.write(2, segment_bytes=1000)
+        with open(changefeed.segment_path(self.feed_dir, 0), 'ab') as f:
+            f.write(b'{"n":')
+        
+        self.assertEqual(list(changefeed.read(self.feed_dir, offset=end)), [])
+    
+    def test_tail_and_compact(self):
+        """Test a consumer commits its offset and compaction keeps unread segments"""
+        self.write(10, segment_bytes=30)
+        segment_count = len(changefeed.segments(self.feed_dir))
+        
+        out = StringIO()
+        call_command('tail_payment_feed', consumer='warehouse', limit=4, stdout=out, stderr=StringIO())
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['n'] for line in lines], [0, 1, 2, 3])
+        committed = changefeed.committed_offsets(self.feed_dir)['warehouse']
+        
+        call_command('compact_payment_feed', stdout=StringIO())
+        bases = changefeed.segments(self.feed_dir)
+        self.assertLess(len(bases), segment_count)
+        self.assertLessEqual(bases[0], committed)
+        
+        # The consumer carries on where it stopped
+        out = StringIO()
+        call_command('tail_payment_feed', consumer='warehouse', stdout=out, stderr=StringIO())
+        self.assertEqual([json.loads(line)['n'] for line in out.getvalue().splitlines()], list(range(4, 10)))
+    
+    def test_full_queue_writes_synchronously(self):
+        """Test records are written by the caller rather than dropped when the queue is full"""
+        feed = changefeed.ChangeFeed(self.feed_dir, 1000, queue_size=1)
+        feed._thread = Mock(is_alive=Mock(return_value=True))  # No writer draining the queue
+        
+        with patch.object(changefeed, 'PUT_TIMEOUT_SECONDS', 0.01), self.assertLogs('payment.changefeed', 'WARNING'):
+            feed.put([changefeed.encode({'n': n}) for n in range(3)])
+        
+        self.assertEqual([record['n'] for _, _, record in changefeed.read(self.feed_dir)], [1, 2])
+        self.assertEqual(feed.queue.get_nowait(), changefeed.encode({'n': 0}))
+
+
+class ReaperTests(APITestCase):
+    """Test expiring stale payment intents and closing abandoned tabs"""
+    
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+    
+    def open_tab(self, table_number, hours_ago=0):
+        response = self.client.post(reverse('create_tab'), {'table_number': table_number, 'covers': 2}, format='json')
+        tab = Tab.objects.get(id=response.data['id'])
+        url = reverse('add_menu_item', kwargs={'tab_id': tab.id})
+        self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 1}, format='json')
+        opened_at = timezone.now() - timedelta(hours=hours_ago)
+        Tab.objects.filter(id=tab.id).update(opened_at=opened_at)
+        OpenTab.objects.filter(tab_id=tab.id).update(opened_at=opened_at)
+        return tab
+    
+    def create_intent(self, tab, minutes_ago=0):
+        url = reverse('create_payment_intent', kwargs={'tab_id': tab.id})
+        client_secret = self.client.post(url, {}, format='json').data['client_secret']
+        Payment.objects.filter(tab=tab).update(created_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return client_secret
+    
+    def test_stale_intents_expired(self):
+        """Test intents older than the secret lifetime are expired and can't be confirmed"""
+        stale_tab = self.open_tab(1)
+        fresh_tab = self.open_tab(2)
+        client_secret = self.create_intent(stale_tab, minutes_ago=30)
+        self.create_intent(fresh_tab, minutes_ago=5)
+        
+        result = reaper.reap(batch_size=1)
+        
+        self.assertEqual(result['expired'], 1)
+        self.assertEqual(result['lag_after'], (0, 0))
+        self.assertEqual(Payment.objects.get(tab=stale_tab).status, 'expired')
+        self.assertEqual(Payment.objects.get(tab=fresh_tab).status, 'requires_confirmation')
+        self.assertTrue(TabEvent.objects.filter(tab_id=stale_tab.id, kind=TabEvent.INTENT_EXPIRED).exists())
+        
+        url = reverse('take_payment', kwargs={'tab_id': stale_tab.id})
+        response = self.client.post(url, {'client_secret': client_secret}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tab.objects.get(id=stale_tab.id).status, 'open')
+    
+    def test_abandoned_tabs_closed(self):
+        """Test tabs left open too long are closed, frozen and taken off the floor"""
+        abandoned = [self.open_tab(1, hours_ago=30), self.open_tab(2, hours_ago=20)]
+        current = self.open_tab(3, hours_ago=1)
+        
+        result = reaper.reap(batch_size=1)
+        
+        self.assertEqual(result['closed'], 2)
+        self.assertGreater(result['lag_before'][1], 0)
+        for tab in abandoned:
+            tab.refresh_from_db()
+            self.assertEqual(tab.status, 'closed')
+            self.assertIsNotNone(tab.closed_at)
+            self.assertTrue(TabSnapshot.objects.filter(tab=tab).exists())
+        self.assertEqual(list(OpenTab.objects.values_list('tab_id', flat=True)), [current.id])
+        self.assertEqual(Tab.objects.get(id=current.id).status, 'open')
+        
+        # The table can be opened again
+        response = self.client.post(reverse('create_tab'), {'table_number': 1, 'covers': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def test_tab_awaiting_payment_not_closed(self):
+        """Test a tab with a live intent stays open, and a closed tab can't be paid"""
+        paying = self.open_tab(1, hours_ago=30)
+        client_secret = self.create_intent(paying, minutes_ago=1)
+        
+        result = reaper.reap()
+        
+        self.assertEqual((result['closed'], result['lag_after']), (0, (0, 0)))
+        self.assertEqual(Tab.objects.get(id=paying.id).status, 'open')
+        
+        Tab.objects.filter(id=paying.id).update(status='closed')
+        url = reverse('take_payment', kwargs={'tab_id': paying.id})
+        response = self.client.post(url, {'client_secret': client_secret}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Payment.objects.get(tab=paying).status, 'requires_confirmation')
+        self.assertEqual(Tab.objects.get(id=paying.id).status, 'closed')
+    
+    def test_add_racing_reaper_keeps_tab_closed(self):
+        """Test an add that read the tab before the reaper closed it doesn't reopen it"""
+        tab = self.open_tab(1, hours_ago=30)
+        validate = views.add_menu_item_validator.validate
+        
+        def reap_then_validate(data):
+            reaper.reap()
+            return validate(data)
+        
+        url = reverse('add_menu_item', kwargs={'tab_id': tab.id})
+        with patch.object(views.add_menu_item_validator, 'validate', side_effect=reap_then_validate):
+            response = self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 1}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        tab.refresh_from_db()
+        self.assertEqual((tab.status, tab.items.count()), ('closed', 1))
+        self.assertFalse(OpenTab.objects.filter(tab_id=tab.id).exists())
+    
+    def test_payment_racing_close_not_taken(self):
+        """Test a payment that read the tab before it was closed is refused"""
+        tab = self.open_tab(1)
+        client_secret = self.create_intent(tab)
+        lookup = MockPaymentGateway.get_intent_id_from_secret
+        
+        def close_then_lookup(gateway, secret):
+            Tab.objects.filter(id=tab.id).update(status='closed')
+            return lookup(gateway, secret)
+        
+        url = reverse('take_payment', kwargs={'tab_id': tab.id})
+        with patch.object(MockPaymentGateway, 'get_intent_id_from_secret', close_then_lookup):
+            response = self.client.post(url, {'client_secret': client_secret}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Payment.objects.get(tab=tab).status, 'requires_confirmation')
+        self.assertEqual(Tab.objects.get(id=tab.id).status, 'closed')
+    
+    def test_reap_command_reports_throughput_and_lag(self):
+        """Test the command reports what it did"""
+        self.create_intent(self.open_tab(1), minutes_ago=30)
+        
+        out = StringIO()
+        call_command('reap', stdout=out)
+        
+        self.assertIn('Expired 1 intents and closed 0 tabs', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertIn('Lag before: intents', out.getvalue())
+
+
+class RetentionTests(APITestCase):
+    """Test daily rollups and pruning raw tabs past the retention period"""
+    
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+    
+    def make_tab(self, days_ago, status='paid'):
+        tab = Tab.objects.create(
+            table_number=1, covers=2, status=status,
+            opened_at=timezone.now() - timedelta(days=days_ago)
+        )
+        TabItem.objects.create(
+            tab=tab,
+            menu_item=self.menu_item,
+            qty=1,
+            unit_price_p=500,
+            vat_rate_percent=Decimal('20.0'),
+            vat_p=100,
+            line_total_p=600
+        )
+        from tabs.views import update_tab_totals
+        update_tab_totals(tab)  # 500 + 50 service charge + 100 VAT
+        Payment.objects.create(
+            tab=tab,
+            payment_intent_id=f"pi_retention_{tab.id}",
+            amount_p=tab.total_p,
+            status='succeeded'
+        )
+        TabEvent.objects.create(tab_id=tab.id, kind=TabEvent.TAB_OPENED)
+        return tab
+    
+    def test_prune_refused_without_rollups(self):
+        """Test nothing is deleted until the rollups for those days exist"""
+        old_tab = self.make_tab(days_ago=40)
+        
+        with self.assertRaisesMessage(CommandError, 'Run rollup_daily'):
+            call_command('prune_tabs', keep_days=30, throttle=0, stdout=StringIO())
+        
+        self.assertTrue(Tab.objects.filter(id=old_tab.id).exists())
+    
+    def test_prune_old_tabs(self):
+        """Test old paid tabs and their rows are pruned in chunks once rolled up"""
+        old_tabs = [self.make_tab(days_ago=40), self.make_tab(days_ago=40), self.make_tab(days_ago=35)]
+        old_open_tab = self.make_tab(days_ago=40, status='open')
+        recent_tab = self.make_tab(days_ago=5)
+        for tab in old_tabs:
+            build_daily_totals(timezone.localtime(tab.opened_at).date())
+        
+        call_command('prune_tabs', keep_days=30, chunk_size=2, throttle=0, stdout=StringIO())
+        
+        old_ids = [tab.id for tab in old_tabs]
+        self.assertFalse(Tab.objects.filter(id__in=old_ids).exists())
+        self.assertFalse(TabItem.objects.filter(tab_id__in=old_ids).exists())
+        self.assertFalse(Payment.objects.filter(tab_id__in=old_ids).exists())
+        self.assertFalse(TabEvent.objects.filter(tab_id__in=old_ids).exists())
+        self.assertEqual(
+            set(Tab.objects.values_list('id', flat=True)), {old_open_tab.id, recent_tab.id}
+        )
+        
+        # The takings survive in the rollups
+        self.assertEqual(DailyTotals.objects.get(day=timezone.localtime(old_tabs[0].opened_at).date()).tabs, 2)
+        self.assertEqual(sum(DailyTotals.objects.values_list('total_p', flat=True)), 650 * 3)
+    
+    def test_prune_waits_for_late_close(self):
+        """Test a tab closed after its day was rolled up isn't pruned until the day is rebuilt"""
+        tab = self.make_tab(days_ago=40, status='open')
+        day = timezone.localtime(tab.opened_at).date()
+        build_daily_totals(day)
+        Tab.objects.filter(id=tab.id).update(status='paid', closed_at=timezone.now())
+        
+        with self.assertRaisesMessage(CommandError, str(day)):
+            call_command('prune_tabs', keep_days=30, throttle=0, stdout=StringIO())
+        self.assertTrue(Tab.objects.filter(id=tab.id).exists())
+        
+        build_daily_totals(day)
+        call_command('prune_tabs', keep_days=30, throttle=0, stdout=StringIO())
+        self.assertFalse(Tab.objects.filter(id=tab.id).exists())
+        self.assertEqual(DailyTotals.objects.get(day=day).total_p, 650)
+    
+    def test_rollup_counts_archived_tabs(self):
+        """Test rollups are the same whether a day's tabs are archived or not"""
+        tab = self.make_tab(days_ago=200)
+        day = timezone.localtime(tab.opened_at).date()
+        before = build_daily_totals(day)
+        
+        call_command('archive_tabs', keep_months=3, stdout=StringIO())
+        after = build_daily_totals(day)
+        
+        fields = ['tabs', 'covers', 'subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p', 'payments_p']
+        self.assertFalse(Tab.objects.filter(id=tab.id).exists())
+        self.assertEqual([getattr(after, f) for f in fields], [getattr(before, f) for f in fields])
+        self.assertEqual(after.payments_p, 650)
+        
+        call_command('prune_tabs', keep_days=30, throttle=0, stdout=StringIO())
+        self.assertFalse(TabArchive.objects.filter(tab_id=tab.id).exists())
+    
+    def test_rollup_command_refuses_pruned_days(self):
+        """Test days that may already be pruned are never rebuilt"""
+        since = (timezone.localdate() - timedelta(days=800)).isoformat()
+        
+        with self.assertRaisesMessage(CommandError, 'refusing to rebuild'):
+            call_command('rollup_daily', since=since, stdout=StringIO())
+
+
+class TakePaymentValidationTests(TestCase):
+    """Test compiled take-payment validation matches TakePaymentSerializer"""
+
+    def test_matches_serializer(self):
+        """Test results and error payloads are the same as the serializer's"""
+        compiled = CompiledSerializer(TakePaymentSerializer)
+        bodies = [
+            {'client_secret': 'secret_abc'},
+            {'client_secret': '  secret_abc  '},
+            {'client_secret': 12.5},
+            {'client_secret': ''},
+            {'client_secret': '   '},
+            {'client_secret': 'x' * 101},
+            {'client_secret': True},
+            {'client_secret': ['secret_abc']},
+            {'client_secret': 'secret\x00abc'},
+            {'client_secret': None},
+            {},
+            [],
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                serializer = TakePaymentSerializer(data=body)
+                validated_data, errors = compiled.validate(body)
+                if serializer.is_valid():
+                    self.assertEqual(validated_data, serializer.validated_data)
+                else:
+                    self.assertEqual(JSONRenderer().render(errors), JSONRenderer().render(serializer.errors))
+
+
+@skipUnless(settings.SHARD_DATABASES, 'Set POSTGRES_SHARDS, e.g. shard_1,shard_2, to test sharding')
+class ShardTests(APITransactionTestCase):
+    """Test each site's tabs and payments live on its shard and reports cover every shard"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.shard = settings.SHARD_DATABASES[0]
+        self.enterContext(override_settings(SITE_SHARDS={'soho': self.shard}))
+        self.client.defaults['HTTP_X_API_KEY'] = keys.create('Bar till 1', site='soho')[1]
+        self.menu_item = MenuItem.objects.create(
+            name="Flat White", unit_price_p=350, vat_rate_percent=Decimal('20.0')
+        )
+
+    def test_site_rows_on_shard(self):
+        """Test a till's tab, lines and payment are written to its site's shard only"""
+        tab_id = self.client.post(reverse('create_tab'), {'table_number': 5, 'covers': 2}, format='json').data['id']
+        self.client.post(
+            reverse('add_menu_item', kwargs={'tab_id': tab_id}),
+            {'menu_item_id': self.menu_item.id, 'qty': 2}, format='json'
+        )
+        intent = self.client.post(reverse('create_payment_intent', kwargs={'tab_id': tab_id}), {}, format='json')
+        response = self.client.get(reverse('get_tab', kwargs={'tab_id': tab_id}))
+
+        self.assertEqual(intent.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['items']), 1)
+        self.assertEqual(Tab.objects.using(self.shard).get(id=tab_id).site, 'soho')
+        self.assertEqual(TabItem.objects.using(self.shard).filter(tab_id=tab_id).count(), 1)
+        self.assertEqual(Payment.objects.using(self.shard).get(tab_id=tab_id).site, 'soho')
+        self.assertFalse(Tab.objects.using('default').exists())
+        self.assertFalse(Payment.objects.using('default').exists())
+
+    def test_menu_edits_reach_every_shard(self):
+        """Test menu items are written to the default database and copied to each shard with their ID"""
+        self.menu_item.unit_price_p = 380
+        self.menu_item.save()
+        croissant = MenuItem.objects.create(name="Croissant", unit_price_p=280, vat_rate_percent=Decimal('20.0'))
+        croissant.delete()
+
+        for shard in sharding.all_shards():
+            self.assertEqual(
+                list(MenuItem.objects.using(shard).values_list('id', 'name', 'unit_price_p')),
+                [(self.menu_item.id, 'Flat White', 380)]
+            )
+
+    def test_sync_menu(self):
+        """Test sync_menu puts back a shard's drifted copy of the menu"""
+        MenuItem.objects.using(self.shard).filter(id=self.menu_item.id).update(unit_price_p=1)
+        MenuItem.objects.using(self.shard).create(name="Local special", unit_price_p=500, vat_rate_percent=Decimal('20.0'))
+
+        out = StringIO()
+        call_command('sync_menu', stdout=out)
+
+        self.assertEqual(MenuItem.objects.using(self.shard).get(id=self.menu_item.id).unit_price_p, 350)
+        self.assertIn(f"{self.shard} has menu items that aren't on default", out.getvalue())
+        self.assertIn(f"Copied 1 menu items to {len(sharding.all_shards()) - 1} shards", out.getvalue())
+
+    def test_reports_fan_out(self):
+        """Test rollups are built on every shard and the takings report adds them up"""
+        yesterday = timezone.localdate() - timedelta(days=1)
+        opened_at = timezone.make_aware(timezone.datetime.combine(yesterday, timezone.datetime.min.time()))
+        for number, shard in enumerate(sharding.all_shards(), start=1):
+            Tab.objects.using(shard).create(
+                table_number=number, covers=2, status='paid', opened_at=opened_at, total_p=1000 * number
+            )
+
+        call_command('rollup_daily', stdout=StringIO())
+        out = StringIO()
+        call_command('takings_report', since=str(yesterday), stdout=out)
+
+        for number, shard in enumerate(sharding.all_shards(), start=1):
+            self.assertEqual(DailyTotals.objects.using(shard).get(day=yesterday).total_p, 1000 * number)
+        count = len(sharding.all_shards())
+        self.assertIn(f"all: {count} tabs, {2 * count} covers, {500 * count * (count + 1)}p taken", out.getvalue())
@@ -3,18 +3,30 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.db import IntegrityError
 from django.utils import timezone
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
+from epos import sharding
+from epos.validation import CompiledSerializer
 
-from tabs.models import Tab
+from tabs import events, floor
+from tabs.models import Tab, TabEvent
 from .models import Payment
-from .serializers import PaymentSerializer, CreatePaymentIntentSerializer, TakePaymentSerializer
+from .serializers import (
+    PaymentSerializer, CreatePaymentIntentSerializer, TakePaymentSerializer,
+    SyncRequestSerializer, SyncResultSerializer
+)
 from .gateway import MockPaymentGateway
+from . import changefeed
+from .snapshots import freeze_tab
+from .sync import SyncError, ingest
 
 
 # Create your views here.
 
+take_payment_validator = CompiledSerializer(TakePaymentSerializer)
+
 
 class CreatePaymentIntentView(APIView):
     """Create a payment intent for a tab"""
@@ -41,8 +53,8 @@ class CreatePaymentIntentView(APIView):
         ]
     )
     def post(self, request, tab_id):
-        # Get the tab
-        tab = get_object_or_404(Tab, id=tab_id)
+        # Get the tab, only at the requesting site
+        tab = get_object_or_404(Tab, id=tab_id, site=sharding.current_site())
         
         # Check if tab is closed or paid
         if tab.status in ['closed', 'paid']:
@@ -70,18 +82,34 @@ class CreatePaymentIntentView(APIView):
                     'currency': existing_payment.currency
                 }, status=status.HTTP_200_OK)
         
-        # Create payment intent using mock gateway
         gateway = MockPaymentGateway()
-        intent_data = gateway.create_payment_intent(amount_p=tab.total_p)
-        
-        # Store payment record in database (only intent_id, not client_secret)
-        payment = Payment.objects.create(
-            tab=tab,
-            payment_intent_id=intent_data['intent_id'],  # Internal ID only
-            amount_p=intent_data['amount'],
-            currency=intent_data['currency'],
-            status=intent_data['status']
-        )
+        with sharding.atomic():
+            # Lock the tab, so the reaper can't close it and adds can't change
+            # its total while the intent is created
+            tab = Tab.objects.select_for_update().get(id=tab.id)
+            if tab.status != 'open':
+                return Response({
+                    'error': 'Cannot create payment intent for closed or paid tab'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Create payment intent using mock gateway
+            intent_data = gateway.create_payment_intent(amount_p=tab.total_p)
+            
+            # Store payment record in database (only intent_id, not client_secret)
+            payment = Payment.objects.create(
+                tab=tab,
+                site=tab.site,
+                payment_intent_id=intent_data['intent_id'],  # Internal ID only
+                amount_p=intent_data['amount'],
+                currency=intent_data['currency'],
+                status=intent_data['status']
+            )
+            events.record(
+                tab.id, TabEvent.INTENT_CREATED,
+                payment_intent_id=payment.payment_intent_id,
+                amount_p=payment.amount_p
+            )
+            changefeed.record(payment)
         
         # Store the mapping in Redis: client_secret -> intent_id
         gateway.store_secret_mapping(
@@ -89,6 +117,8 @@ class CreatePaymentIntentView(APIView):
             intent_id=intent_data['intent_id']
         )
         
+        events.publish(tab, events.PAYMENT_INTENT_CREATED, amount_p=payment.amount_p)
+        
         # Return payment intent data to user
         return Response({
             'client_secret': intent_data['client_secret'],
@@ -148,15 +178,15 @@ class TakePaymentView(APIView):
         ]
     )
     def post(self, request, tab_id):
-        # Get the tab
-        tab = get_object_or_404(Tab, id=tab_id)
+        # Get the tab, only at the requesting site
+        tab = get_object_or_404(Tab, id=tab_id, site=sharding.current_site())
         
         # Validate request data
-        serializer = TakePaymentSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        validated_data, errors = take_payment_validator.validate(request.data)
+        if errors is not None:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
         
-        client_secret = serializer.validated_data['client_secret']
+        client_secret = validated_data['client_secret']
         
         # Get the intent_id from Redis using client_secret
         gateway = MockPaymentGateway()
@@ -167,35 +197,80 @@ class TakePaymentView(APIView):
                 'error': 'Payment intent not found or expired'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get the payment record from database using intent_id
-        payment = get_object_or_404(Payment, payment_intent_id=intent_id, tab=tab)
-        
-        # Check if payment is already confirmed (idempotency check)
-        if payment.status == 'succeeded':
-            # Idempotent: return success if already paid
-            return Response({
-                'status': payment.status,
-                'amount_p': payment.amount_p,
-                'currency': payment.currency,
-                'confirmed_at': payment.confirmed_at
-            }, status=status.HTTP_200_OK)
+        with sharding.atomic():
+            # Lock the tab, so the reaper or a payment with another intent can't
+            # close it between the checks below and writing the result
+            tab = Tab.objects.select_for_update().get(id=tab.id)
+            
+            # Get the payment record from database using intent_id
+            payment = get_object_or_404(Payment, payment_intent_id=intent_id, tab=tab)
+            
+            # Check if payment is already confirmed (idempotency check)
+            if payment.status == 'succeeded':
+                # Idempotent: return success if already paid
+                return Response({
+                    'status': payment.status,
+                    'amount_p': payment.amount_p,
+                    'currency': payment.currency,
+                    'confirmed_at': payment.confirmed_at
+                }, status=status.HTTP_200_OK)
+            
+            if payment.status == 'failed':
+                return Response({
+                    'error': 'Payment has already failed'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            if payment.status == 'expired':
+                return Response({
+                    'error': 'Payment intent not found or expired'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # A tab closed by the reaper, or paid with another intent, stays as it is
+            if tab.status != 'open':
+                return Response({
+                    'error': 'Cannot take payment for a closed or paid tab'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Confirm payment using intent_id
+            confirmation_data = gateway.confirm_payment_intent(intent_id, payment.amount_p)
+            
+            # Update payment status
+            payment.status = confirmation_data['status']
+            payment.confirmed_at = timezone.now()
+            
+            if confirmation_data['status'] == 'failed':
+                payment.failure_reason = confirmation_data.get('reason', 'Payment failed')
+                payment.save()
+                events.record(
+                    tab.id, TabEvent.PAYMENT_FAILED,
+                    payment_intent_id=payment.payment_intent_id,
+                    amount_p=payment.amount_p,
+                    reason=payment.failure_reason
+                )
+                changefeed.record(payment)
+            else:
+                # Payment succeeded
+                payment.save()
+                
+                # Update tab status
+                tab.status = 'paid'
+                tab.closed_at = timezone.now()
+                tab.save(update_fields=['status', 'closed_at'])
+                
+                # A paid tab never changes again, so freeze it for reads
+                freeze_tab(tab)
+                floor.remove(tab)
+                
+                events.record(
+                    tab.id, TabEvent.PAYMENT_SUCCEEDED,
+                    payment_intent_id=payment.payment_intent_id,
+                    amount_p=payment.amount_p,
+                    closed_at=tab.closed_at
+                )
+                changefeed.record(payment)
+                events.publish(tab, events.TAB_PAID, total_p=tab.total_p, amount_p=payment.amount_p)
         
         if payment.status == 'failed':
-            return Response({
-                'error': 'Payment has already failed'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Confirm payment using intent_id
-        confirmation_data = gateway.confirm_payment_intent(intent_id, payment.amount_p)
-        
-        # Update payment status
-        payment.status = confirmation_data['status']
-        payment.confirmed_at = timezone.now()
-        
-        if confirmation_data['status'] == 'failed':
-            payment.failure_reason = confirmation_data.get('reason', 'Payment failed')
-            payment.save()
-            
             # Clean up Redis mapping on failure
             gateway.cleanup_secret_mapping(client_secret)
             
@@ -204,14 +279,6 @@ class TakePaymentView(APIView):
                 'reason': payment.failure_reason
             }, status=status.HTTP_402_PAYMENT_REQUIRED)
         
-        # Payment succeeded
-        payment.save()
-        
-        # Update tab status
-        tab.status = 'paid'
-        tab.closed_at = timezone.now()
-        tab.save()
-        
         # DON'T clean up Redis mapping immediately - keep it for idempotency
         # The mapping will expire naturally after 15 minutes
         
@@ -221,3 +288,64 @@ class TakePaymentView(APIView):
             'currency': payment.currency,
             'confirmed_at': payment.confirmed_at
         }, status=status.HTTP_200_OK)
+
+
+class SyncView(APIView):
+    """Bulk ingest tabs recorded by a till while it was offline"""
+    
+    @extend_schema(
+        summary="Sync offline tabs",
+        description=(
+            "Ingest a batch of complete tabs with their lines and payment outcomes in one "
+            "transaction. Tabs are identified by a till-generated client_id; tabs that were "
+            "already synced are skipped and listed as duplicates, so a batch can be retried safely."
+        ),
+        request=SyncRequestSerializer,
+        responses={
+            201: SyncResultSerializer,
+            400: OpenApiTypes.OBJECT,
+            409: OpenApiTypes.OBJECT
+        },
+        examples=[
+            OpenApiExample(
+                'Sync Request',
+                summary='One paid tab',
+                description='A tab taken offline and paid by card',
+                value={
+                    'tabs': [{
+                        'client_id': 'till-3-0001',
+                        'table_number': 5,
+                        'covers': 2,
+                        'status': 'paid',
+                        'opened_at': '2024-01-01T12:00:00Z',
+                        'closed_at': '2024-01-01T12:45:00Z',
+                        'items': [{'menu_item_id': 1, 'qty': 2}],
+                        'payments': [{
+                            'status': 'succeeded',
+                            'amount_p': 910,
+                            'confirmed_at': '2024-01-01T12:44:00Z'
+                        }]
+                    }]
+                }
+            )
+        ]
+    )
+    def post(self, request):
+        serializer = SyncRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            created, duplicates = ingest(serializer.validated_data['tabs'])
+        except SyncError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            # Another sync of the same tabs (or a new open tab) got there first
+            return Response({
+                'error': 'Sync conflicted with a concurrent change, retry the batch'
+            }, status=status.HTTP_409_CONFLICT)
+        
+        return Response(SyncResultSerializer({
+            'created': [{'client_id': client_id, 'tab_id': tab_id} for client_id, tab_id in created],
+            'duplicates': duplicates
+        }).data, status=status.HTTP_201_CREATED)
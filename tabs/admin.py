@@ -1,4 +1,6 @@
 from django.contrib import admin
+from epos.admin_search import ExactSearchMixin
+from epos.paginators import EstimatedCountPaginator
 from .models import MenuItem, Tab, TabItem
 
 # Register your models here.
@@ -9,14 +11,25 @@ class MenuItemAdmin(admin.ModelAdmin):
     list_filter = ['vat_rate_percent']
 
 @admin.register(Tab)
-class TabAdmin(admin.ModelAdmin):
+class TabAdmin(ExactSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'table_number', 'covers', 'status', 'opened_at', 'total_p']
-    list_filter = ['status', 'opened_at']
-    search_fields = ['table_number']
+    list_filter = ['status']
+    # Drill-down filters become ranges on tabs_tab_opened_at_idx
+    date_hierarchy = 'opened_at'
+    # Exact matches on indexed columns only (see epos.admin_search)
+    search_fields = ['id', 'client_id']
+    search_help_text = 'Tab ID or till client ID'
     readonly_fields = ['opened_at', 'closed_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(TabItem)
-class TabItemAdmin(admin.ModelAdmin):
+class TabItemAdmin(ExactSearchMixin, admin.ModelAdmin):
     list_display = ['tab', 'menu_item', 'qty', 'unit_price_p', 'line_total_p']
-    list_filter = ['tab__status', 'menu_item']
-    search_fields = ['tab__table_number', 'menu_item__name']
+    list_select_related = ['tab', 'menu_item']
+    list_filter = ['menu_item']
+    search_fields = ['tab_id']
+    search_help_text = 'Tab ID'
+    raw_id_fields = ['tab']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TabsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tabs'
+
+    def ready(self):
+        # Connect the signals that clear the menu ID set
+        from . import menu  # noqa: F401
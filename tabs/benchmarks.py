@@ -0,0 +1,230 @@
+import json
+from decimal import Decimal
+from io import BytesIO
+
+from django.conf import settings
+from django.test import RequestFactory, override_settings
+from django.test.client import ClientHandler
+from epos.parsers import FastJSONParser
+from epos.renderers import FastJSONRenderer
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from epos.bench import benchmark
+from epos.validation import CompiledSerializer
+
+from . import fast_serializers, menu, pricing, replay
+from .models import MenuItem, Tab, TabEvent, TabItem
+from .serializers import AddMenuItemSerializer, TabSerializer
+from .views import update_tab_totals
+
+
+def make_tab(lines):
+    """Create an open tab with the given number of lines"""
+    menu_item = MenuItem.objects.create(
+        name='Benchmark Item',
+        unit_price_p=350,
+        vat_rate_percent=Decimal('20.00')
+    )
+    tab = Tab.objects.create(table_number=1, covers=2)
+    TabItem.objects.bulk_create([
+        TabItem(
+            tab=tab,
+            menu_item=menu_item,
+            qty=2,
+            unit_price_p=350,
+            vat_rate_percent=Decimal('20.00'),
+            vat_p=140,
+            line_total_p=840
+        )
+        for _ in range(lines)
+    ])
+    return tab
+
+
+def update_tab_totals_case(lines):
+    def setup():
+        tab = make_tab(lines)
+        return lambda: update_tab_totals(tab)
+    return setup
+
+
+def tab_serializer_case(lines):
+    def setup():
+        tab = make_tab(lines)
+        return lambda: TabSerializer(tab).data
+    return setup
+
+
+for lines in (1, 50, 500):
+    benchmark(f'tabs.update_tab_totals[{lines}]')(update_tab_totals_case(lines))
+
+for lines in (50, 500):
+    benchmark(f'tabs.tab_serializer[{lines}]')(tab_serializer_case(lines))
+
+
+def tab_response_case(lines, fast):
+    """Fetch and serialise a tab, as GetTabView does for an open tab"""
+    def setup():
+        tab = make_tab(lines)
+        if fast:
+            return lambda: fast_serializers.get_tab(id=tab.id)
+        return lambda: TabSerializer(Tab.objects.get(id=tab.id)).data
+    return setup
+
+
+for lines in (10, 100, 1000):
+    benchmark(f'tabs.tab_response[drf,{lines}]')(tab_response_case(lines, fast=False))
+    benchmark(f'tabs.tab_response[fast,{lines}]')(tab_response_case(lines, fast=True))
+
+
+@benchmark('tabs.tab_response[totals,1000]')
+def tab_totals_response_case():
+    """A ?fields=status,total_p read of a large tab, which never touches its lines"""
+    tab = make_tab(1000)
+    return lambda: fast_serializers.get_tab(fields={'status', 'total_p'}, id=tab.id)
+
+
+def decimal_line_vat(line_subtotal_p, vat_rate_percent):
+    """The per-line VAT formula used before tabs.pricing, kept for comparison"""
+    return int(Decimal(line_subtotal_p) * vat_rate_percent / 100)
+
+
+BATCH_LINES = [(350 + i, 1 + i % 4, (2000, 500, 0)[i % 3]) for i in range(500)]
+
+
+@benchmark('tabs.pricing.line_vat_decimal')
+def line_vat_decimal_case():
+    vat_rate_percent = Decimal('20.00')
+    return lambda: decimal_line_vat(1050, vat_rate_percent)
+
+
+@benchmark('tabs.pricing.price_line')
+def price_line_case():
+    return lambda: pricing.price_line(350, 3, 2000)
+
+
+@benchmark('tabs.pricing.price_lines_decimal[500]')
+def price_lines_decimal_case():
+    lines = [
+        (unit_price_p, qty, Decimal(vat_rate_bp) / 100)
+        for unit_price_p, qty, vat_rate_bp in BATCH_LINES
+    ]
+
+    def price_all():
+        priced = []
+        for unit_price_p, qty, vat_rate_percent in lines:
+            line_subtotal_p = unit_price_p * qty
+            vat_p = decimal_line_vat(line_subtotal_p, vat_rate_percent)
+            priced.append((line_subtotal_p, vat_p, line_subtotal_p + vat_p))
+        return priced
+    return price_all
+
+
+@benchmark('tabs.pricing.price_lines[500]')
+def price_lines_case():
+    return lambda: pricing.price_lines(BATCH_LINES)
+
+
+@benchmark('tabs.replay[10000]')
+def replay_case():
+    # 100 tabs of 98 lines each, opened and paid
+    events = []
+    for tab_id in range(1, 101):
+        events.append(TabEvent(tab_id=tab_id, kind=TabEvent.TAB_OPENED, data={
+            'table_number': tab_id, 'covers': 2, 'opened_at': '2025-01-01T12:00:00Z'
+        }))
+        events.extend(
+            TabEvent(tab_id=tab_id, kind=TabEvent.LINE_ADDED, data={
+                'tab_item_id': tab_id * 100 + line, 'menu_item_id': 1, 'qty': 2,
+                'unit_price_p': 350, 'vat_p': 140, 'line_total_p': 840
+            })
+            for line in range(98)
+        )
+        events.append(TabEvent(tab_id=tab_id, kind=TabEvent.PAYMENT_SUCCEEDED, data={
+            'payment_intent_id': f'pi_{tab_id}', 'amount_p': 90000, 'closed_at': '2025-01-01T13:00:00Z'
+        }))
+    TabEvent.objects.bulk_create(events)
+    return lambda: replay.replay(use_snapshots=False)
+
+
+def get_tab_request_case(middleware):
+    """A whole GET /api/tabs/<id> through the request handler with the given MIDDLEWARE"""
+    def setup():
+        tab = make_tab(5)
+        handler = ClientHandler()
+        with override_settings(MIDDLEWARE=middleware):
+            handler.load_middleware()
+        host = next((host for host in settings.ALLOWED_HOSTS if host and host[0] not in '.*'), 'localhost')
+        environ = RequestFactory()._base_environ(
+            PATH_INFO=f'/api/tabs/{tab.id}', REQUEST_METHOD='GET', HTTP_HOST=host, HTTP_X_API_KEY='demo'
+        )
+        response = handler(environ)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET /api/tabs/{tab.id} returned {response.status_code}, check ALLOWED_HOSTS")
+        return lambda: handler(environ)
+    return setup
+
+
+# The routed stack, against every request running the admin's middleware.
+# Rate limiting is off so every timed request is served rather than refused.
+benchmark('epos.middleware.get_tab[routed]', RATE_LIMITS={'default': None})(get_tab_request_case(settings.MIDDLEWARE))
+benchmark('epos.middleware.get_tab[full]', RATE_LIMITS={'default': None})(get_tab_request_case(
+    ['django.middleware.security.SecurityMiddleware', *settings.SITE_MIDDLEWARE]
+))
+
+
+
+def validate_add_item_case(compiled):
+    """Validate an add-item body, as AddMenuItemView does before writing"""
+    def setup():
+        menu_item = MenuItem.objects.create(
+            name='Benchmark Item',
+            unit_price_p=350,
+            vat_rate_percent=Decimal('20.00')
+        )
+        body = {'menu_item_id': menu_item.id, 'qty': 2}
+        if compiled:
+            validator = CompiledSerializer(AddMenuItemSerializer, menu_item_id=menu.validate_menu_item_id)
+            return lambda: validator.validate(body)
+        return lambda: AddMenuItemSerializer(data=body).is_valid()
+    return setup
+
+
+benchmark('tabs.validate_add_item[drf]')(validate_add_item_case(compiled=False))
+benchmark('tabs.validate_add_item[compiled]')(validate_add_item_case(compiled=True))
+
+
+def render_tab_case(renderer_class):
+    """Render a 1000-line tab response to JSON"""
+    def setup():
+        data = fast_serializers.get_tab(id=make_tab(1000).id)
+        renderer = renderer_class()
+        return lambda: renderer.render(data)
+    return setup
+
+
+def parse_sync_case(parser_class):
+    """Parse an offline sync body of 100 tabs with 10 lines each"""
+    def setup():
+        body = json.dumps({'tabs': [
+            {
+                'client_id': f'till-1-{index}',
+                'table_number': index + 1,
+                'covers': 2,
+                'status': 'paid',
+                'opened_at': '2025-01-01T12:00:00Z',
+                'closed_at': '2025-01-01T13:00:00Z',
+                'items': [{'menu_item_id': 1, 'qty': 2}] * 10,
+                'payments': [{'status': 'succeeded', 'amount_p': 9240}],
+            }
+            for index in range(100)
+        ]}).encode()
+        parser = parser_class()
+        return lambda: parser.parse(BytesIO(body))
+    return setup
+
+
+benchmark('epos.renderers.tab[drf,1000]')(render_tab_case(JSONRenderer))
+benchmark('epos.renderers.tab[fast,1000]')(render_tab_case(FastJSONRenderer))
+benchmark('epos.parsers.sync[drf,100]')(parse_sync_case(JSONParser))
+benchmark('epos.parsers.sync[fast,100]')(parse_sync_case(FastJSONParser))
@@ -0,0 +1,222 @@
+"""
+Micro-batching of line adds to the same tab.
+
+At the bar one tab gets bursts of adds, and each add is its own
+transaction with an insert, a totals update and a tab save. With
+ADD_ITEM_COALESCE_MS set, the first add to a tab waits that long for others
+to the same tab in this process and then writes them all in one
+transaction: the tab row is locked, the lines are bulk inserted and the
+totals are updated once, on top of the tab's stored totals. A batch is
+written early once it holds ADD_ITEM_BATCH_MAX adds.
+
+Every caller still gets its own line and the totals as they stood just
+after it, as if the adds had been made one by one in arrival order.
+Batch sizes and how long adds waited for their batch are counted in Redis
+(see ``metrics``) by every process.
+"""
+
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from epos import sharding
+
+from . import events, floor, pricing
+from .models import Tab, TabEvent, TabItem
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'add_item_batches'
+
+# Upper bounds of the batch size and wait histograms
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50)
+
+
+class TabNotOpen(Exception):
+    """The tab was paid or closed before the batch was written"""
+
+
+class Add:
+    """One caller's line, and its result once the batch is written"""
+
+    def __init__(self, menu_item, qty, line):
+        self.menu_item = menu_item
+        self.qty = qty
+        self.line = line
+        self.arrived = time.monotonic()
+        self.tab_item = None
+        self.totals = None
+
+
+class Batch:
+    def __init__(self):
+        self.adds = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+
+
+_pending = {}
+_lock = threading.Lock()
+
+
+def add(tab_id, menu_item, qty, line):
+    """
+    Add a line to a tab as part of the next batch for it
+
+    Args:
+        line: The line priced with pricing.price_line
+
+    Returns:
+        (TabItem, pricing.Totals) with the tab's totals just after this line
+
+    Raises:
+        TabNotOpen: If the tab is no longer open
+    """
+    entry = Add(menu_item, qty, line)
+    key = (sharding.current_shard(), tab_id)
+    with _lock:
+        batch = _pending.get(key)
+        leader = batch is None
+        if leader:
+            batch = _pending[key] = Batch()
+        batch.adds.append(entry)
+        if len(batch.adds) >= settings.ADD_ITEM_BATCH_MAX:
+            # Later adds start the next batch
+            del _pending[key]
+            batch.full.set()
+
+    if leader:
+        batch.full.wait(settings.ADD_ITEM_COALESCE_MS / 1000)
+        with _lock:
+            if _pending.get(key) is batch:
+                del _pending[key]
+        try:
+            waits = write(tab_id, batch.adds)
+        except Exception as exc:
+            batch.error = exc
+        finally:
+            batch.done.set()
+        if batch.error is None:
+            record(waits)
+    else:
+        batch.done.wait()
+
+    if batch.error is not None:
+        raise batch.error
+    return entry.tab_item, entry.totals
+
+
+def write(tab_id, adds):
+    """
+    Write a batch of adds in one transaction and set each one's result
+
+    Returns:
+        Seconds each add waited for the batch to start
+    """
+    started = time.monotonic()
+    with sharding.atomic():
+        tab = Tab.objects.select_for_update().get(id=tab_id, site=sharding.current_site())
+        if tab.status != 'open':
+            raise TabNotOpen(tab_id)
+
+        tab_items = TabItem.objects.bulk_create([
+            TabItem(
+                tab=tab,
+                menu_item=entry.menu_item,
+                qty=entry.qty,
+                unit_price_p=entry.menu_item.unit_price_p,
+                vat_rate_percent=entry.menu_item.vat_rate_percent,
+                vat_p=entry.line.vat_p,
+                line_total_p=entry.line.line_total_p
+            )
+            for entry in adds
+        ])
+
+        # Running totals in arrival order, on top of the locked tab's totals
+        totals = pricing.tab_totals(tab.subtotal_p, tab.vat_total_p)
+        for entry, tab_item in zip(adds, tab_items):
+            totals = pricing.total_lines([entry.line], totals.subtotal_p, totals.vat_total_p)
+            entry.tab_item = tab_item
+            entry.totals = totals
+
+        tab.subtotal_p, tab.service_charge_p, tab.vat_total_p, tab.total_p = totals
+        tab.save(update_fields=['subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p'])
+        floor.update_total(tab)
+
+        TabEvent.objects.bulk_create([
+            TabEvent(tab_id=tab.id, kind=TabEvent.LINE_ADDED, data={
+                'tab_item_id': entry.tab_item.id,
+                'menu_item_id': entry.menu_item.id,
+                'qty': entry.qty,
+                'unit_price_p': entry.tab_item.unit_price_p,
+                'vat_p': entry.tab_item.vat_p,
+                'line_total_p': entry.tab_item.line_total_p,
+            })
+            for entry in adds
+        ])
+        for entry in adds:
+            events.publish(
+                tab, events.ITEM_ADDED,
+                tab_item_id=entry.tab_item.id,
+                menu_item_name=entry.menu_item.name,
+                qty=entry.qty,
+                total_p=entry.totals.total_p
+            )
+
+    return [started - entry.arrived for entry in adds]
+
+
+def bucket(value, bounds):
+    for bound in bounds:
+        if value <= bound:
+            return f'le_{bound}'
+    return 'le_inf'
+
+
+def record(waits):
+    """Count a written batch and how long each of its adds waited for it"""
+    pipe = events.get_redis().pipeline(transaction=False)
+    pipe.hincrby(METRICS_KEY, 'batches', 1)
+    pipe.hincrby(METRICS_KEY, 'adds', len(waits))
+    pipe.hincrby(METRICS_KEY, f'size_{bucket(len(waits), SIZE_BUCKETS)}', 1)
+    pipe.hincrby(METRICS_KEY, 'wait_us_total', int(sum(waits) * 1_000_000))
+    for wait in waits:
+        pipe.hincrby(METRICS_KEY, f'wait_{bucket(wait * 1000, WAIT_BUCKETS_MS)}ms', 1)
+    try:
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("Could not record add-item batch metrics", exc_info=True)
+
+
+def metrics():
+    """
+    Batching metrics from every process since they were last reset
+
+    Returns:
+        Dict with the number of batches and adds, the mean batch size and
+        wait, and histograms of batch sizes and waits keyed by upper bound
+    """
+    counts = {field: int(value) for field, value in events.get_redis().hgetall(METRICS_KEY).items()}
+    batches = counts.get('batches', 0)
+    adds = counts.get('adds', 0)
+    return {
+        'batches': batches,
+        'adds': adds,
+        'mean_batch_size': adds / batches if batches else 0,
+        'mean_wait_ms': counts.get('wait_us_total', 0) / 1000 / adds if adds else 0,
+        'batch_sizes': {
+            label: counts.get(f'size_le_{label}', 0) for label in [*SIZE_BUCKETS, 'inf']
+        },
+        'waits_ms': {
+            label: counts.get(f'wait_le_{label}ms', 0) for label in [*WAIT_BUCKETS_MS, 'inf']
+        },
+    }
+
+
+def reset_metrics():
+    events.get_redis().delete(METRICS_KEY)
@@ -0,0 +1,85 @@
+"""
+Tab events.
+
+``record`` appends to the TabEvent log inside the caller's transaction, so
+the log only ever holds changes that committed. ``publish`` sends events to
+Redis pub/sub for the live kitchen and floor feed once the surrounding
+transaction commits, and a Redis outage is logged rather than failing the
+till's request.
+"""
+
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from epos import sharding
+
+from .models import TabEvent
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'tab_events'
+
+ITEM_ADDED = 'item_added'
+PAYMENT_INTENT_CREATED = 'payment_intent_created'
+TAB_PAID = 'tab_paid'
+TAB_CLOSED = 'tab_closed'
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=int(settings.REDIS_DB),
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def record(tab_id, kind, **data):
+    """
+    Append an event to the tab event log
+
+    Must be called inside the transaction that makes the change.
+
+    Args:
+        tab_id: ID of the tab that changed
+        kind: Event kind, e.g. TabEvent.LINE_ADDED
+        **data: Fields the replay reducers need to apply the event
+    """
+    return TabEvent.objects.create(tab_id=tab_id, kind=kind, data=data)
+
+
+def publish(tab, event, **data):
+    """
+    Publish a tab event after the current transaction commits
+
+    Args:
+        tab: Tab the event is about (its table number and status are included
+            so subscribers can filter without another lookup)
+        event: Event name, e.g. ITEM_ADDED
+        **data: Extra JSON-serialisable fields for the event
+    """
+    message = json.dumps({
+        'event': event,
+        'tab_id': tab.id,
+        'site': tab.site,
+        'table_number': tab.table_number,
+        'status': tab.status,
+        **data,
+    }, cls=DjangoJSONEncoder)
+    sharding.on_commit(lambda: send(message))
+
+
+def send(message):
+    try:
+        get_redis().publish(CHANNEL, message)
+    except redis.RedisError:
+        logger.warning("Could not publish tab event", exc_info=True)
@@ -0,0 +1,144 @@
+"""
+Fast serialisation of tab responses.
+
+TabSerializer and TabItemSerializer describe the API and drive the schema,
+but on a large tab their per-field machinery costs more than the queries.
+These functions build the same dicts straight from ``values()`` rows, field
+for field, so the rendered JSON is byte-for-byte what the serializers give.
+FastSerializerTests holds the two paths to that.
+"""
+
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Tab, TabItem
+
+
+TAB_FIELDS = (
+    'id', 'table_number', 'covers', 'status', 'opened_at', 'closed_at',
+    'subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p',
+)
+ITEM_FIELDS = (
+    'id', 'tab_id', 'menu_item_id', 'menu_item__name', 'qty', 'unit_price_p',
+    'vat_rate_percent', 'vat_p', 'line_total_p',
+)
+
+# Every field of TabSerializer output, in order
+RESPONSE_FIELDS = TAB_FIELDS + ('items',)
+DATETIME_FIELDS = {'opened_at', 'closed_at'}
+
+CENTS = Decimal('0.01')
+
+
+def datetime_data(value):
+    """A datetime as DRF's DateTimeField renders it, ISO 8601 with Z for UTC"""
+    if value is None:
+        return None
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def decimal_data(value):
+    """A two-place decimal as DRF's DecimalField renders it, a fixed-point string"""
+    return f'{value.quantize(CENTS):f}'
+
+
+def item_data(row):
+    """TabItemSerializer output for a TabItem row with ITEM_FIELDS"""
+    return {
+        'id': row['id'],
+        'menu_item': row['menu_item_id'],
+        'menu_item_name': row['menu_item__name'],
+        'qty': row['qty'],
+        'unit_price_p': row['unit_price_p'],
+        'vat_rate_percent': decimal_data(row['vat_rate_percent']),
+        'vat_p': row['vat_p'],
+        'line_total_p': row['line_total_p'],
+    }
+
+
+def tab_data(row, items):
+    """TabSerializer output for a Tab row with TAB_FIELDS and its item rows"""
+    return {
+        'id': row['id'],
+        'table_number': row['table_number'],
+        'covers': row['covers'],
+        'status': row['status'],
+        'opened_at': datetime_data(row['opened_at']),
+        'closed_at': datetime_data(row['closed_at']),
+        'subtotal_p': row['subtotal_p'],
+        'service_charge_p': row['service_charge_p'],
+        'vat_total_p': row['vat_total_p'],
+        'total_p': row['total_p'],
+        'items': [item_data(item) for item in items],
+    }
+
+
+def tab_row(tab):
+    """A Tab row for a model instance already in memory"""
+    return {field: getattr(tab, field) for field in TAB_FIELDS}
+
+
+def item_row(tab_item, menu_item):
+    """A TabItem row for a model instance already in memory"""
+    row = {field: getattr(tab_item, field) for field in ITEM_FIELDS if field != 'menu_item__name'}
+    row['menu_item__name'] = menu_item.name
+    return row
+
+
+def item_rows(tab_ids):
+    """Item rows for some tabs in id order, grouped by tab ID"""
+    items = {}
+    for row in TabItem.objects.filter(tab_id__in=tab_ids).order_by('id').values(*ITEM_FIELDS):
+        items.setdefault(row['tab_id'], []).append(row)
+    return items
+
+
+def get_tab(fields=None, **filters):
+    """
+    Serialise the tab matching some filters with two queries
+
+    Args:
+        fields: Only these TabSerializer fields, in the serializer's order.
+            Only their columns are read and the items only when 'items' is
+            one of them, so without items this is a single-row query.
+
+    Returns:
+        TabSerializer output, or None when no tab matches
+    """
+    if fields is None:
+        row = Tab.objects.filter(**filters).values(*TAB_FIELDS).first()
+        if row is None:
+            return None
+        items = TabItem.objects.filter(tab_id=row['id']).order_by('id').values(*ITEM_FIELDS)
+        return tab_data(row, items)
+
+    columns = [field for field in TAB_FIELDS if field in fields]
+    row = Tab.objects.filter(**filters).values(*dict.fromkeys(['id', *columns])).first()
+    if row is None:
+        return None
+    data = {
+        field: datetime_data(row[field]) if field in DATETIME_FIELDS else row[field]
+        for field in columns
+    }
+    if 'items' in fields:
+        items = TabItem.objects.filter(tab_id=row['id']).order_by('id').values(*ITEM_FIELDS)
+        data['items'] = [item_data(item) for item in items]
+    return data
+
+
+def tabs_data(tab_ids):
+    """
+    Serialise a batch of tabs with two queries
+
+    Returns:
+        Dict of tab ID to TabSerializer output
+    """
+    items = item_rows(tab_ids)
+    return {
+        row['id']: tab_data(row, items.get(row['id'], ()))
+        for row in Tab.objects.filter(id__in=tab_ids).values(*TAB_FIELDS)
+    }
@@ -0,0 +1,65 @@
+"""
+Open-tab floor summary.
+
+OpenTab holds one small row per open tab so the floor plan never has to
+scan tabs_tab. The tab write paths call these helpers inside their own
+transactions, and ``reconcile`` repairs any drift.
+"""
+
+from .models import OpenTab, Tab
+
+
+def add(tab):
+    """Put a newly opened tab on the floor"""
+    OpenTab.objects.create(
+        tab=tab,
+        site=tab.site,
+        table_number=tab.table_number,
+        covers=tab.covers,
+        opened_at=tab.opened_at,
+        total_p=tab.total_p
+    )
+
+
+def update_total(tab):
+    """Refresh the total shown for an open tab"""
+    OpenTab.objects.filter(tab_id=tab.id).update(total_p=tab.total_p)
+
+
+def remove(tab):
+    """Take a paid or closed tab off the floor"""
+    OpenTab.objects.filter(tab_id=tab.id).delete()
+
+
+def reconcile():
+    """
+    Make the floor summary match the open tabs
+
+    Returns:
+        Dict with the number of rows added, updated and removed
+    """
+    removed, _ = OpenTab.objects.exclude(tab__status='open').delete()
+
+    missing = Tab.objects.filter(status='open', floor_entry__isnull=True)
+    added = OpenTab.objects.bulk_create(
+        OpenTab(
+            tab=tab,
+            site=tab.site,
+            table_number=tab.table_number,
+            covers=tab.covers,
+            opened_at=tab.opened_at,
+            total_p=tab.total_p
+        )
+        for tab in missing
+    )
+
+    drifted = []
+    for entry in OpenTab.objects.select_related('tab'):
+        tab = entry.tab
+        current = (tab.site, tab.table_number, tab.covers, tab.opened_at, tab.total_p)
+        if (entry.site, entry.table_number, entry.covers, entry.opened_at, entry.total_p) != current:
+            entry.site, entry.table_number, entry.covers, entry.opened_at, entry.total_p = current
+            drifted.append(entry)
+    OpenTab.objects.bulk_update(drifted, ['site', 'table_number', 'covers', 'opened_at', 'total_p'])
+
+    return {'added': len(added), 'updated': len(drifted), 'removed': removed}
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from tabs import coalescer
+
+
+class Command(BaseCommand):
+    help = 'Show how item adds have been batched (see ADD_ITEM_COALESCE_MS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Clear the counts after showing them',
+        )
+
+    def handle(self, *args, **options):
+        metrics = coalescer.metrics()
+        self.stdout.write(f"Batches:          {metrics['batches']}")
+        self.stdout.write(f"Adds:             {metrics['adds']}")
+        self.stdout.write(f"Mean batch size:  {metrics['mean_batch_size']:.2f}")
+        self.stdout.write(f"Mean added wait:  {metrics['mean_wait_ms']:.2f} ms")
+
+        self.stdout.write('\nBatch sizes:')
+        for bound, count in metrics['batch_sizes'].items():
+            self.stdout.write(f"  <= {bound:<6} {count}")
+        self.stdout.write('\nWaits:')
+        for bound, count in metrics['waits_ms'].items():
+            self.stdout.write(f"  <= {bound:<3} ms {count}")
+
+        if options['reset']:
+            coalescer.reset_metrics()
+            self.stdout.write(self.style.SUCCESS('\nCounts reset'))
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from epos import bench
+
+
+class Command(BaseCommand):
+    help = 'Run the microbenchmark suite and save or compare against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help='Only run benchmarks whose name contains one of these strings',
+        )
+        parser.add_argument(
+            '--save',
+            action='store_true',
+            help='Store the results as the new baseline',
+        )
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help='Compare the results against the stored baseline and fail on regressions',
+        )
+        parser.add_argument(
+            '--baseline',
+            default=str(settings.BENCHMARK_BASELINE),
+            help='Path of the baseline file (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.10,
+            help='Allowed slowdown before a case counts as a regression (default: 0.10 = 10%%)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timing rounds per case, the best is kept (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        cases = bench.discover()
+        if options['names']:
+            cases = {
+                name: setup for name, setup in cases.items()
+                if any(pattern in name for pattern in options['names'])
+            }
+        if not cases:
+            raise CommandError('No benchmarks matched')
+
+        results = {}
+        for name, setup in cases.items():
+            seconds = bench.run_case(setup, repeat=options['repeat'])
+            results[name] = seconds
+            self.stdout.write(f"{name:50s} {seconds * 1e6:12.2f} us/op")
+
+        if options['save']:
+            bench.save_baseline(options['baseline'], results)
+            self.stdout.write(
+                self.style.SUCCESS(f"\nBaseline saved to {options['baseline']}")
+            )
+
+        if options['compare']:
+            try:
+                baseline = bench.load_baseline(options['baseline'])
+            except FileNotFoundError:
+                raise CommandError(f"Baseline file not found: {options['baseline']}")
+
+            regressions = bench.compare(results, baseline, options['threshold'])
+            if regressions:
+                self.stdout.write('\nRegressions:')
+                for name, base, current, ratio in regressions:
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f"{name:50s} {base * 1e6:10.2f} -> {current * 1e6:10.2f} us/op ({ratio:.2f}x)"
+                        )
+                    )
+                raise CommandError(
+                    f"{len(regressions)} benchmark(s) regressed by more than {options['threshold']:.0%}"
+                )
+            self.stdout.write(self.style.SUCCESS('\nNo regressions against baseline'))
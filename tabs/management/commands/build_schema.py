@@ -0,0 +1,26 @@
+import os
+
+from django.core.management.base import BaseCommand
+from drf_spectacular.renderers import OpenApiJsonRenderer
+from epos.schema import generate_schema
+
+
+class Command(BaseCommand):
+    help = 'Write the OpenAPI schema to a file for GET /api/schema/ to serve (set OPENAPI_SCHEMA_FILE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='openapi-schema.json',
+            help='File to write (default: %(default)s)',
+        )
+
+    def handle(self, *args, **options):
+        body = OpenApiJsonRenderer().render(generate_schema())
+
+        tmp_path = f"{options['output']}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, options['output'])
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(body)} bytes to {options['output']}"))
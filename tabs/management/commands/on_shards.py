@@ -0,0 +1,21 @@
+import argparse
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from epos import sharding
+
+
+class Command(BaseCommand):
+    help = 'Run a management command once on each shard, e.g. on_shards reap --batch-size 200'
+
+    def add_arguments(self, parser):
+        parser.add_argument('command_name', help='Command to run')
+        parser.add_argument('command_args', nargs=argparse.REMAINDER, help='Its arguments')
+
+    def handle(self, *args, **options):
+        shards = sharding.all_shards()
+        for shard in shards:
+            self.stdout.write(f'{shard}:')
+            with sharding.using_shard(shard):
+                call_command(options['command_name'], *options['command_args'], stdout=self.stdout, stderr=self.stderr)
+        self.stdout.write(self.style.SUCCESS(f"Successfully ran {options['command_name']} on {len(shards)} shards"))
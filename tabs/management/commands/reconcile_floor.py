@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from epos import sharding
+from tabs import floor
+
+
+class Command(BaseCommand):
+    help = 'Repair drift between the open-tab floor summary and the tabs'
+
+    def handle(self, *args, **options):
+        with sharding.atomic():
+            result = floor.reconcile()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Floor reconciled: {result['added']} added, "
+                f"{result['updated']} updated, {result['removed']} removed"
+            )
+        )
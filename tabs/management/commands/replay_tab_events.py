@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+from epos import sharding
+from tabs import floor, replay
+from tabs.models import Tab
+
+
+class Command(BaseCommand):
+    help = 'Rebuild tab totals from the event log and check or repair the stored totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tab_ids',
+            nargs='*',
+            type=int,
+            help='Only replay these tabs (default: every tab in the log)',
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Replay from the first event instead of the snapshots',
+        )
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Overwrite stored totals that disagree with the log',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        states, count = replay.replay(
+            tab_ids=options['tab_ids'] or None,
+            use_snapshots=not options['full'],
+        )
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write(
+            f"Replayed {count} events for {len(states)} tabs in {elapsed:.2f}s ({rate:,.0f} events/s)"
+        )
+
+        # Tabs opened before the log existed have no history to compare, and
+        # archived tabs are no longer in tabs_tab
+        rebuilt = {
+            tab_id: replay.totals(state)
+            for tab_id, state in states.items() if state['opened_at'] is not None
+        }
+        drifted = []
+        for tab in Tab.objects.filter(id__in=rebuilt).order_by('id').iterator(chunk_size=2000):
+            totals = rebuilt[tab.id]
+            stored = (tab.subtotal_p, tab.service_charge_p, tab.vat_total_p, tab.total_p)
+            if stored != tuple(totals):
+                self.stdout.write(
+                    self.style.WARNING(f"Tab {tab.id}: stored {stored}, log {tuple(totals)}")
+                )
+                tab.subtotal_p, tab.service_charge_p, tab.vat_total_p, tab.total_p = totals
+                drifted.append(tab)
+
+        if drifted and options['repair']:
+            with sharding.atomic():
+                Tab.objects.bulk_update(
+                    drifted, ['subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p'], batch_size=1000
+                )
+                for tab in drifted:
+                    floor.update_total(tab)
+            self.stdout.write(self.style.SUCCESS(f'Repaired totals on {len(drifted)} tabs'))
+        elif drifted:
+            self.stdout.write(self.style.ERROR(f'{len(drifted)} tabs disagree with the log, rerun with --repair'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All tab totals match the log'))
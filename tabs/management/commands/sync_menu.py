@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from epos import sharding
+from tabs import menu
+from tabs.models import MenuItem
+
+
+class Command(BaseCommand):
+    help = "Copy the default database's menu to every shard, e.g. after creating a shard"
+
+    def handle(self, *args, **options):
+        items = list(MenuItem.objects.using(DEFAULT_DB_ALIAS).order_by('id'))
+        shards = menu.copy_to_shards(items)
+
+        # Items only a shard has were added there directly, and lines may still use them
+        item_ids = {item.id for item in items}
+        for alias in sharding.all_shards():
+            extra = MenuItem.objects.using(alias).exclude(id__in=item_ids).values_list('id', flat=True)
+            if extra:
+                self.stdout.write(self.style.WARNING(
+                    f"{alias} has menu items that aren't on {DEFAULT_DB_ALIAS}: {', '.join(map(str, extra))}"
+                ))
+
+        self.stdout.write(self.style.SUCCESS(f'Copied {len(items)} menu items to {shards} shards'))
@@ -0,0 +1,119 @@
+"""
+In-process set of menu item IDs.
+
+Adding a line checks the menu item exists before anything else, which was a
+query on every add. The IDs are loaded once and reloaded every
+MENU_IDS_TTL_SECONDS. Saving or deleting a menu item clears them in the
+process that made the change. Other processes pick it up when their copy
+expires. An ID missing from the set is looked up once before it is
+rejected, so a new item is never refused. A deleted item can pass the check
+until the set reloads, and the view's own lookup then returns 404. Each
+shard has its own copy of the menu, so there is a set per shard.
+
+The menu is only written to the default database (see epos.sharding).
+Saving or deleting an item there copies the change to every shard once it
+commits, with the same ID, and ``manage.py sync_menu`` copies the whole
+menu to a new shard.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import serializers
+from epos import sharding
+
+from .models import MenuItem
+
+
+# Shard alias to (loaded_at, IDs)
+_ids = {}
+_lock = threading.Lock()
+
+
+def ids():
+    """IDs of every menu item on the current shard, reloaded once MENU_IDS_TTL_SECONDS old"""
+    shard = sharding.current_shard()
+    entry = _ids.get(shard)
+    if entry is None or time.monotonic() - entry[0] > settings.MENU_IDS_TTL_SECONDS:
+        with _lock:
+            entry = _ids[shard] = (time.monotonic(), set(MenuItem.objects.values_list('id', flat=True)))
+    return entry[1]
+
+
+def exists(menu_item_id):
+    """True if a menu item exists, only querying for IDs not in the set"""
+    known = ids()
+    if menu_item_id in known:
+        return True
+    if MenuItem.objects.filter(id=menu_item_id).exists():
+        known.add(menu_item_id)
+        return True
+    return False
+
+
+def validate_menu_item_id(value):
+    """AddMenuItemSerializer.validate_menu_item_id against the ID set"""
+    if not exists(value):
+        raise serializers.ValidationError("Menu item not found")
+    return value
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def clear(**kwargs):
+    """Forget the IDs so the next check reloads them"""
+    with _lock:
+        _ids.clear()
+
+
+def copy_to_shards(items):
+    """
+    Write menu items to every shard other than the default database
+
+    Items are inserted, or updated if the shard already has their ID.
+
+    Returns:
+        Number of shards written to
+    """
+    copies = [copy(item) for item in items]
+    shards = [alias for alias in sharding.all_shards() if alias != DEFAULT_DB_ALIAS]
+    for alias in shards:
+        MenuItem.objects.using(alias).bulk_create(
+            copies,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=[field.name for field in MenuItem._meta.concrete_fields if not field.primary_key],
+        )
+    return len(shards)
+
+
+def copy(item):
+    """An unsaved MenuItem with the same ID and values"""
+    return MenuItem(**{field.attname: getattr(item, field.attname) for field in MenuItem._meta.concrete_fields})
+
+
+@receiver(post_save, sender=MenuItem)
+def copy_saved(instance, using, **kwargs):
+    """Copy an item saved on the default database to the shards"""
+    if using == DEFAULT_DB_ALIAS:
+        # Copied now, the instance may change again before the commit
+        saved = copy(instance)
+        transaction.on_commit(lambda: copy_to_shards([saved]), using=using)
+
+
+@receiver(post_delete, sender=MenuItem)
+def delete_from_shards(instance, using, **kwargs):
+    """Delete an item deleted from the default database from the shards"""
+    if using == DEFAULT_DB_ALIAS:
+        item_id = instance.id
+
+        def delete():
+            for alias in sharding.all_shards():
+                if alias != DEFAULT_DB_ALIAS:
+                    MenuItem.objects.using(alias).filter(id=item_id).delete()
+
+        transaction.on_commit(delete, using=using)
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0002_alter_tab_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TabSnapshot',
+            fields=[
+                ('tab', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='tabs.tab')),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0003_tabsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TabArchive',
+            fields=[
+                ('tab_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('month', models.DateField(db_index=True)),
+                ('table_number', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('open', 'Open'), ('paid', 'Paid'), ('closed', 'Closed')], max_length=10)),
+                ('opened_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('total_p', models.PositiveIntegerField()),
+                ('data', models.JSONField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tab',
+            index=models.Index(fields=['opened_at'], name='tabs_tab_opened_at_idx'),
+        ),
+    ]
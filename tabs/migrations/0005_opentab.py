@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_open_tabs(apps, schema_editor):
+    Tab = apps.get_model('tabs', 'Tab')
+    OpenTab = apps.get_model('tabs', 'OpenTab')
+    OpenTab.objects.bulk_create(
+        OpenTab(
+            tab_id=tab.id,
+            table_number=tab.table_number,
+            covers=tab.covers,
+            opened_at=tab.opened_at,
+            total_p=tab.total_p,
+        )
+        for tab in Tab.objects.filter(status='open').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0004_tab_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenTab',
+            fields=[
+                ('tab', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='floor_entry', serialize=False, to='tabs.tab')),
+                ('table_number', models.PositiveIntegerField()),
+                ('covers', models.PositiveIntegerField()),
+                ('opened_at', models.DateTimeField()),
+                ('total_p', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_open_tabs, migrations.RunPython.noop),
+    ]
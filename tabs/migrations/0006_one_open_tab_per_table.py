@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:57
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def close_duplicate_open_tabs(apps, schema_editor):
+    """Leave only the newest open tab on each table, closing the rest as the reaper would"""
+    Tab = apps.get_model('tabs', 'Tab')
+    OpenTab = apps.get_model('tabs', 'OpenTab')
+    newest = {}
+    duplicates = []
+    for tab_id, table_number in (
+        Tab.objects.filter(status='open').order_by('opened_at', 'id').values_list('id', 'table_number').iterator()
+    ):
+        if table_number in newest:
+            duplicates.append(newest[table_number])
+        newest[table_number] = tab_id
+    if duplicates:
+        Tab.objects.filter(id__in=duplicates).update(status='closed', closed_at=timezone.now())
+        OpenTab.objects.filter(tab_id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0005_opentab'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_tabs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tab',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'open')), fields=('table_number',), name='tabs_tab_one_open_per_table'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0006_one_open_tab_per_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tab',
+            name='client_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tab',
+            name='opened_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:01
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0007_tab_client_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TabStateSnapshot',
+            fields=[
+                ('tab_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('event_id', models.BigIntegerField(db_index=True)),
+                ('state', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TabEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tab_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('tab_opened', 'Tab Opened'), ('line_added', 'Line Added'), ('intent_created', 'Payment Intent Created'), ('payment_succeeded', 'Payment Succeeded'), ('payment_failed', 'Payment Failed'), ('tab_closed', 'Tab Closed')], max_length=30)),
+                ('data', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tab_id', 'id'], name='tabs_tabevent_tab_idx')],
+            },
+        ),
+    ]
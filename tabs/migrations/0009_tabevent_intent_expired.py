@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0008_tab_event_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tabevent',
+            name='kind',
+            field=models.CharField(choices=[('tab_opened', 'Tab Opened'), ('line_added', 'Line Added'), ('intent_created', 'Payment Intent Created'), ('payment_succeeded', 'Payment Succeeded'), ('payment_failed', 'Payment Failed'), ('intent_expired', 'Payment Intent Expired'), ('tab_closed', 'Tab Closed')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:39
+
+import epos.sharding
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0009_tabevent_intent_expired'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='tab',
+            name='tabs_tab_one_open_per_table',
+        ),
+        migrations.AddField(
+            model_name='opentab',
+            name='site',
+            field=models.CharField(default=epos.sharding.current_site, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='tab',
+            name='site',
+            field=models.CharField(default=epos.sharding.current_site, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='opentab',
+            index=models.Index(fields=['site', 'table_number'], name='tabs_opentab_site_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tab',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'open')), fields=('site', 'table_number'), name='tabs_tab_one_open_per_table'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 01:54
+
+import epos.sharding
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0010_site'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tabarchive',
+            name='site',
+            field=models.CharField(default=epos.sharding.current_site, max_length=50),
+        ),
+    ]
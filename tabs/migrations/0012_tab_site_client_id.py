@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabs', '0011_tabarchive_site'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='tab',
+            constraint=models.UniqueConstraint(fields=('site', 'client_id'), name='tabs_tab_site_client_id_uniq'),
+        ),
+        migrations.AlterField(
+            model_name='tab',
+            name='client_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
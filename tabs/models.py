@@ -1,7 +1,12 @@
 from django.db import models
 
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+from epos.sharding import current_site
+
+from .pricing import to_basis_points
 
 class MenuItem(models.Model):
 	name = models.CharField(max_length=100)
@@ -11,22 +16,46 @@ class MenuItem(models.Model):
 	def __str__(self):
 		return self.name
 
+	@property
+	def vat_rate_bp(self):
+		return to_basis_points(self.vat_rate_percent)
+
 class Tab(models.Model):
 	STATUS_CHOICES = [
 		('open', 'Open'),
 		('paid', 'Paid'),
 		('closed', 'Closed'),
 	]
+	# Site the tab belongs to, which also decides its shard (see epos.sharding)
+	site = models.CharField(max_length=50, default=current_site)
 	table_number = models.PositiveIntegerField()
 	covers = models.PositiveIntegerField()
 	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
-	opened_at = models.DateTimeField(auto_now_add=True)
+	opened_at = models.DateTimeField(default=timezone.now)
 	closed_at = models.DateTimeField(null=True, blank=True)
+	# ID generated by an offline till, used to de-duplicate bulk syncs at a
+	# site. Indexed on its own too for the admin search across sites
+	client_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 	subtotal_p = models.PositiveIntegerField(default=0)
 	service_charge_p = models.PositiveIntegerField(default=0)
 	vat_total_p = models.PositiveIntegerField(default=0)
 	total_p = models.PositiveIntegerField(default=0)
 
+	class Meta:
+		indexes = [
+			models.Index(fields=['opened_at'], name='tabs_tab_opened_at_idx'),
+		]
+		constraints = [
+			# At most one open tab per table at a site, also the index behind the table lookup
+			models.UniqueConstraint(
+				fields=['site', 'table_number'],
+				condition=models.Q(status='open'),
+				name='tabs_tab_one_open_per_table',
+			),
+			# Tills at different sites number their tabs independently
+			models.UniqueConstraint(fields=['site', 'client_id'], name='tabs_tab_site_client_id_uniq'),
+		]
+
 	def __str__(self):
 		return f"Tab {self.id} (Table {self.table_number})"
 
@@ -40,4 +69,88 @@ class TabItem(models.Model):
 	line_total_p = models.PositiveIntegerField()
 
 	def __str__(self):
-		return f"{self.qty} x {self.menu_item.name} for Tab {self.tab.id}"
+		return f"{self.qty} x {self.menu_item.name} for Tab {self.tab_id}"
+
+class TabSnapshot(models.Model):
+	"""Frozen serialised representation of a paid or closed tab and its payments"""
+	tab = models.OneToOneField(Tab, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+	data = models.JSONField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"Snapshot of Tab {self.tab_id}"
+
+class TabArchive(models.Model):
+	"""Paid or closed tab moved out of the hot tables, stored as its frozen snapshot"""
+	tab_id = models.BigIntegerField(primary_key=True)
+	site = models.CharField(max_length=50, default=current_site)
+	month = models.DateField(db_index=True)  # First day of the month the tab was opened
+	table_number = models.PositiveIntegerField()
+	status = models.CharField(max_length=10, choices=Tab.STATUS_CHOICES)
+	opened_at = models.DateTimeField()
+	closed_at = models.DateTimeField(null=True, blank=True)
+	total_p = models.PositiveIntegerField()
+	data = models.JSONField()
+	archived_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"Archived Tab {self.tab_id} (Table {self.table_number})"
+
+class OpenTab(models.Model):
+	"""Floor plan summary of an open tab, kept in sync by the tab write paths"""
+	tab = models.OneToOneField(Tab, on_delete=models.CASCADE, primary_key=True, related_name='floor_entry')
+	site = models.CharField(max_length=50, default=current_site)
+	table_number = models.PositiveIntegerField()
+	covers = models.PositiveIntegerField()
+	opened_at = models.DateTimeField()
+	total_p = models.PositiveIntegerField(default=0)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['site', 'table_number'], name='tabs_opentab_site_idx'),
+		]
+
+	def __str__(self):
+		return f"Open Tab {self.tab_id} (Table {self.table_number})"
+
+class TabEvent(models.Model):
+	"""Append-only log of tab changes, written in the same transaction as the change"""
+	TAB_OPENED = 'tab_opened'
+	LINE_ADDED = 'line_added'
+	INTENT_CREATED = 'intent_created'
+	PAYMENT_SUCCEEDED = 'payment_succeeded'
+	PAYMENT_FAILED = 'payment_failed'
+	INTENT_EXPIRED = 'intent_expired'
+	TAB_CLOSED = 'tab_closed'
+	KIND_CHOICES = [
+		(TAB_OPENED, 'Tab Opened'),
+		(LINE_ADDED, 'Line Added'),
+		(INTENT_CREATED, 'Payment Intent Created'),
+		(PAYMENT_SUCCEEDED, 'Payment Succeeded'),
+		(PAYMENT_FAILED, 'Payment Failed'),
+		(INTENT_EXPIRED, 'Payment Intent Expired'),
+		(TAB_CLOSED, 'Tab Closed'),
+	]
+	# Not a foreign key: the log outlives tabs that are archived
+	tab_id = models.BigIntegerField()
+	kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+	data = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+	created_at = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['tab_id', 'id'], name='tabs_tabevent_tab_idx'),
+		]
+
+	def __str__(self):
+		return f"{self.kind} for Tab {self.tab_id}"
+
+class TabStateSnapshot(models.Model):
+	"""Tab state folded from its events up to and including event_id, bounds replay cost"""
+	tab_id = models.BigIntegerField(primary_key=True)
+	event_id = models.BigIntegerField(db_index=True)
+	state = models.JSONField()
+	updated_at = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return f"State of Tab {self.tab_id} at event {self.event_id}"
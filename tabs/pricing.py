@@ -0,0 +1,99 @@
+"""
+Integer money arithmetic for tabs.
+
+All amounts are integer pence and VAT rates are integer basis points
+(1bp = 0.01%, so 20% = 2000bp). Nothing here builds Decimal objects apart
+from the one-off, cached conversion of a stored rate to basis points.
+
+Rounding: every percentage is truncated to whole pence, i.e. rounded
+towards zero. Amounts are never negative, so this is plain floor division
+and gives exactly the same pence as the original
+``int(Decimal(amount) * rate / 100)`` calculations.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+from functools import lru_cache
+
+
+BASIS_POINTS = 10000
+
+# Service charge is 10% of the subtotal
+SERVICE_CHARGE_BP = 1000
+
+PricedLine = namedtuple('PricedLine', ['subtotal_p', 'vat_p', 'line_total_p'])
+Totals = namedtuple('Totals', ['subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p'])
+
+
+@lru_cache(maxsize=256)
+def to_basis_points(rate_percent):
+    """
+    Convert a VAT rate in percent (e.g. Decimal('20.00')) to basis points
+
+    Raises ValueError if the rate has more precision than basis points can hold.
+    """
+    # Go through str() so floats such as 17.5 convert by their repr
+    bp = Decimal(str(rate_percent)) * 100
+    if bp != bp.to_integral_value():
+        raise ValueError(f"VAT rate {rate_percent}% is not a whole number of basis points")
+    return int(bp)
+
+
+def price_line(unit_price_p, qty, vat_rate_bp):
+    """Price a single line: VAT is charged on the line subtotal, then truncated"""
+    subtotal_p = unit_price_p * qty
+    vat_p = subtotal_p * vat_rate_bp // BASIS_POINTS
+    return PricedLine(subtotal_p, vat_p, subtotal_p + vat_p)
+
+
+def price_lines(lines):
+    """
+    Price many lines at once
+
+    Args:
+        lines: Iterable of (unit_price_p, qty, vat_rate_bp) tuples
+
+    Returns:
+        List of PricedLine in the same order
+    """
+    priced = []
+    append = priced.append
+    for unit_price_p, qty, vat_rate_bp in lines:
+        subtotal_p = unit_price_p * qty
+        vat_p = subtotal_p * vat_rate_bp // BASIS_POINTS
+        append(PricedLine(subtotal_p, vat_p, subtotal_p + vat_p))
+    return priced
+
+
+def service_charge(subtotal_p):
+    """Service charge on a subtotal, truncated to whole pence"""
+    return subtotal_p * SERVICE_CHARGE_BP // BASIS_POINTS
+
+
+def tab_totals(subtotal_p, vat_total_p):
+    """
+    Tab totals from the sum of line subtotals (before VAT) and line VAT
+
+    The service charge is taken on the subtotal only, and the total is
+    subtotal + service charge + VAT.
+    """
+    service_charge_p = service_charge(subtotal_p)
+    return Totals(
+        subtotal_p,
+        service_charge_p,
+        vat_total_p,
+        subtotal_p + service_charge_p + vat_total_p
+    )
+
+
+def total_lines(priced_lines, subtotal_p=0, vat_total_p=0):
+    """
+    Tab totals for a set of priced lines
+
+    subtotal_p and vat_total_p let callers add the lines on top of totals
+    they already have, e.g. the stored totals of an existing tab.
+    """
+    for line in priced_lines:
+        subtotal_p += line.subtotal_p
+        vat_total_p += line.vat_p
+    return tab_totals(subtotal_p, vat_total_p)
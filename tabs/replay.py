@@ -0,0 +1,195 @@
+"""
+Replay of the append-only tab event log.
+
+``stream`` reads events in id order in large chunks, ``apply`` folds one
+event into a tab's state and ``replay`` combines the two to rebuild every
+tab (or a few) from the log. Other reducers, e.g. a rollup or an index
+keyed by menu item, can consume ``stream`` directly.
+
+``snapshot`` stores the folded state of every tab touched since its last
+run in TabStateSnapshot. The highest snapshotted event id is the watermark:
+every tab's snapshot is correct up to it, so ``replay`` starts from the
+snapshots and only reads events after the watermark.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from epos import sharding
+
+from . import pricing
+from .models import TabEvent, TabStateSnapshot
+
+
+def initial_state():
+    """State of a tab before any events"""
+    return {
+        'table_number': None,
+        'covers': None,
+        'opened_at': None,
+        'closed_at': None,
+        'status': 'open',
+        'lines': 0,
+        'subtotal_p': 0,
+        'vat_total_p': 0,
+        'paid_p': 0,
+        'failed_payments': 0,
+    }
+
+
+def _tab_opened(state, data):
+    state['table_number'] = data['table_number']
+    state['covers'] = data['covers']
+    state['opened_at'] = data['opened_at']
+
+
+def _line_added(state, data):
+    state['lines'] += 1
+    state['subtotal_p'] += data['line_total_p'] - data['vat_p']
+    state['vat_total_p'] += data['vat_p']
+
+
+def _payment_succeeded(state, data):
+    state['status'] = 'paid'
+    state['paid_p'] += data['amount_p']
+    state['closed_at'] = data['closed_at']
+
+
+def _payment_failed(state, data):
+    state['failed_payments'] += 1
+
+
+def _tab_closed(state, data):
+    state['status'] = 'closed'
+    state['closed_at'] = data['closed_at']
+
+
+HANDLERS = {
+    TabEvent.TAB_OPENED: _tab_opened,
+    TabEvent.LINE_ADDED: _line_added,
+    TabEvent.PAYMENT_SUCCEEDED: _payment_succeeded,
+    TabEvent.PAYMENT_FAILED: _payment_failed,
+    TabEvent.TAB_CLOSED: _tab_closed,
+}
+
+
+def apply(state, kind, data):
+    """Fold one event into a tab's state, kinds that don't change it are ignored"""
+    handler = HANDLERS.get(kind)
+    if handler is not None:
+        handler(state, data)
+    return state
+
+
+def totals(state):
+    """Tab totals for a replayed state"""
+    return pricing.tab_totals(state['subtotal_p'], state['vat_total_p'])
+
+
+def watermark():
+    """ID of the last event folded into the snapshots, 0 before the first snapshot"""
+    return TabStateSnapshot.objects.aggregate(last=Max('event_id'))['last'] or 0
+
+
+def stream(after=0, upto=None, tab_ids=None, chunk_size=None):
+    """
+    Stream events in id order as (id, tab_id, kind, data) tuples
+
+    Args:
+        after: Only events with a larger id
+        upto: Only events up to and including this id
+        tab_ids: Only events for these tabs
+        chunk_size: Rows fetched per round trip
+    """
+    events = TabEvent.objects.filter(id__gt=after)
+    if upto is not None:
+        events = events.filter(id__lte=upto)
+    if tab_ids is not None:
+        events = events.filter(tab_id__in=tab_ids)
+    return (
+        events.order_by('id')
+        .values_list('id', 'tab_id', 'kind', 'data')
+        .iterator(chunk_size=chunk_size or settings.TAB_EVENT_REPLAY_CHUNK)
+    )
+
+
+def replay(tab_ids=None, use_snapshots=True, chunk_size=None):
+    """
+    Rebuild tab state from the event log
+
+    Args:
+        tab_ids: Only rebuild these tabs (default: every tab in the log)
+        use_snapshots: Start from the snapshots instead of the first event
+
+    Returns:
+        (states, count) where states maps tab ID to its state and count is
+        the number of events read
+    """
+    states = {}
+    after = 0
+    if use_snapshots:
+        snapshots = TabStateSnapshot.objects.all()
+        if tab_ids is not None:
+            snapshots = snapshots.filter(tab_id__in=tab_ids)
+        states = dict(snapshots.values_list('tab_id', 'state').iterator(chunk_size=chunk_size or 2000))
+        after = watermark()
+
+    count = 0
+    for _, tab_id, kind, data in stream(after=after, tab_ids=tab_ids, chunk_size=chunk_size):
+        state = states.get(tab_id)
+        if state is None:
+            state = states[tab_id] = initial_state()
+        apply(state, kind, data)
+        count += 1
+    return states, count
+
+
+def snapshot(batch_size=1000, chunk_size=None):
+    """
+    Fold the events since the last run into the tab state snapshots
+
+    Events newer than TAB_EVENT_SNAPSHOT_LAG_SECONDS are left for the next
+    run: ids are allocated before commit, so a recent id can still be
+    followed by an earlier one that hasn't committed yet.
+
+    Returns:
+        (number of tabs snapshotted, new watermark)
+    """
+    after = watermark()
+    cutoff = timezone.now() - timedelta(seconds=settings.TAB_EVENT_SNAPSHOT_LAG_SECONDS)
+    upto = (
+        TabEvent.objects.filter(id__gt=after, created_at__lt=cutoff)
+        .aggregate(last=Max('id'))['last']
+    )
+    if upto is None:
+        return 0, after
+
+    tab_ids = set(
+        TabEvent.objects.filter(id__gt=after, id__lte=upto).values_list('tab_id', flat=True).distinct()
+    )
+    states = dict(
+        TabStateSnapshot.objects.filter(tab_id__in=tab_ids).values_list('tab_id', 'state')
+    )
+    last_event = {}
+    for event_id, tab_id, kind, data in stream(after=after, upto=upto, chunk_size=chunk_size):
+        state = states.get(tab_id)
+        if state is None:
+            state = states[tab_id] = initial_state()
+        apply(state, kind, data)
+        last_event[tab_id] = event_id
+
+    snapshots = [
+        TabStateSnapshot(tab_id=tab_id, event_id=event_id, state=states[tab_id])
+        for tab_id, event_id in last_event.items()
+    ]
+    with sharding.atomic():
+        TabStateSnapshot.objects.bulk_create(
+            snapshots,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['tab_id'],
+            update_fields=['event_id', 'state', 'updated_at'],
+        )
+    return len(snapshots), upto
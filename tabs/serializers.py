@@ -1,6 +1,7 @@
 from rest_framework import serializers
+from epos.sharding import current_site
+from payment.serializers import PaymentSerializer
 from .models import Tab, MenuItem, TabItem
-from decimal import Decimal
 
 
 class MenuItemSerializer(serializers.ModelSerializer):
@@ -43,18 +44,31 @@ class TabSerializer(serializers.ModelSerializer):
         }
 
 
+class TabDetailSerializer(TabSerializer):
+    """A tab as GET /api/tabs/<id> returns it"""
+    payments = PaymentSerializer(many=True, required=False, help_text='Paid and closed tabs only')
+    
+    class Meta(TabSerializer.Meta):
+        fields = TabSerializer.Meta.fields + ['payments']
+
+
 class CreateTabSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tab
         fields = ['table_number', 'covers']
         extra_kwargs = {
-            'table_number': {'help_text': 'Table number (positive integer)'},
+            'table_number': {
+                'help_text': 'Table number (positive integer, the table must not already have an open tab)',
+            },
             'covers': {'help_text': 'Number of people (positive integer)'}
         }
     
     def validate_table_number(self, value):
         if value <= 0:
             raise serializers.ValidationError("table_number must be a positive integer")
+        # Table numbers are per site
+        if Tab.objects.filter(site=current_site(), table_number=value, status='open').exists():
+            raise serializers.ValidationError('Table already has an open tab')
         return value
     
     def validate_covers(self, value):
@@ -82,25 +96,43 @@ class TabTotalsSerializer(serializers.Serializer):
     total_p = serializers.IntegerField(help_text="Final total in pence")
 
 
-def update_tab_totals(tab):
-    """Update tab totals based on all tab items"""
-    tab_items = TabItem.objects.filter(tab=tab)
-    
-    # Calculate subtotal (sum of line subtotals - BEFORE VAT)
-    subtotal_p = sum((item.line_total_p - item.vat_p) for item in tab_items)
-    
-    # Calculate total VAT
-    vat_total_p = sum(item.vat_p for item in tab_items)
-    
-    # Calculate service charge (10% of subtotal)
-    service_charge_p = int(Decimal(subtotal_p) * Decimal('0.10'))
-    
-    # Calculate total
-    total_p = subtotal_p + service_charge_p + vat_total_p
-    
-    # Update the tab
-    tab.subtotal_p = subtotal_p
-    tab.service_charge_p = service_charge_p
-    tab.vat_total_p = vat_total_p
-    tab.total_p = total_p
-    tab.save()
+
+class QuoteLineSerializer(serializers.Serializer):
+    menu_item_id = serializers.IntegerField(help_text="ID of the menu item")
+    qty = serializers.IntegerField(min_value=1, help_text="Quantity (minimum 1)")
+
+
+class QuoteRequestSerializer(serializers.Serializer):
+    tab_id = serializers.IntegerField(
+        required=False,
+        help_text="Existing open tab to quote on top of (optional)"
+    )
+    lines = QuoteLineSerializer(many=True, help_text="Lines to price")
+
+
+class QuoteLineResultSerializer(serializers.Serializer):
+    menu_item_id = serializers.IntegerField()
+    menu_item_name = serializers.CharField()
+    qty = serializers.IntegerField()
+    unit_price_p = serializers.IntegerField(help_text="Price in pence")
+    vat_rate_percent = serializers.DecimalField(max_digits=5, decimal_places=2)
+    vat_p = serializers.IntegerField(help_text="VAT amount in pence")
+    line_total_p = serializers.IntegerField(help_text="Total line amount in pence (including VAT)")
+
+
+class QuoteSerializer(serializers.Serializer):
+    tab_id = serializers.IntegerField(allow_null=True)
+    lines = QuoteLineResultSerializer(many=True)
+    subtotal_p = serializers.IntegerField(help_text="Subtotal in pence, including the tab's existing lines")
+    service_charge_p = serializers.IntegerField(help_text="Service charge in pence")
+    vat_total_p = serializers.IntegerField(help_text="Total VAT in pence")
+    total_p = serializers.IntegerField(help_text="Final total in pence")
+
+
+class FloorEntrySerializer(serializers.Serializer):
+    tab_id = serializers.IntegerField()
+    table_number = serializers.IntegerField()
+    covers = serializers.IntegerField()
+    opened_at = serializers.DateTimeField()
+    age_seconds = serializers.IntegerField(help_text="Seconds since the tab was opened")
+    total_p = serializers.IntegerField(help_text="Running total in pence")
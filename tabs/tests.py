@@ -1,13 +1,47 @@
 from django.test import TestCase
 
 # Create your tests here.
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import uuid
+import zoneinfo
+from datetime import date, datetime, time, timedelta
+from io import BytesIO, StringIO
+from time import sleep
+from unittest.mock import Mock, patch
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, router, transaction
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.http import HttpResponse, QueryDict
+from django.core.exceptions import MiddlewareNotUsed
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
 from decimal import Decimal
-from .models import Tab, MenuItem, TabItem
+from .models import Tab, MenuItem, TabItem, OpenTab, TabEvent, TabSnapshot, TabStateSnapshot, TabArchive
+from . import coalescer, events, fast_serializers, menu, pricing, replay
+from .serializers import AddMenuItemSerializer, TabItemSerializer, TabSerializer
 from .views import update_tab_totals
+from drf_spectacular.drainage import GENERATOR_STATS
+from apikeys import keys
+from epos import bench, replicas, schema, sharding, throttling
+from epos.middleware import ConcurrencyLimitMiddleware
+from epos.parsers import FastJSONParser
+from epos.renderers import FastJSONRenderer
+from epos.validation import CompiledSerializer
+from epos.feed import FEED_PATH, Subscriber, feed_application, hub
 
 
 class TabCalculationTests(TestCase):
@@ -223,3 +257,1244 @@ class TabAPITests(APITestCase):
         # Check tab totals were updated
         tab.refresh_from_db()
         self.assertGreater(tab.total_p, 0)
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    """Test regression detection against a benchmark baseline"""
+
+    def test_flags_regression_beyond_threshold(self):
+        baseline = {'fast': 1.0, 'slow': 1.0}
+        results = {'fast': 1.05, 'slow': 1.5}
+
+        regressions = bench.compare(results, baseline, threshold=0.10)
+
+        self.assertEqual([r[0] for r in regressions], ['slow'])
+        self.assertAlmostEqual(regressions[0][3], 1.5)
+
+    def test_ignores_cases_missing_from_baseline(self):
+        regressions = bench.compare({'new': 5.0}, {}, threshold=0.10)
+        self.assertEqual(regressions, [])
+
+    def test_baseline_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            bench.save_baseline(path, {'case': 0.25})
+            self.assertEqual(bench.load_baseline(path), {'case': 0.25})
+
+
+class PricingTests(SimpleTestCase):
+    """Property tests: integer pricing matches the original Decimal maths"""
+
+    SAMPLES = 20000
+
+    def setUp(self):
+        self.random = random.Random(20250909)
+
+    def random_rate(self):
+        # Any rate with up to two decimal places between 0% and 100%
+        return Decimal(self.random.randint(0, 10000)) / 100
+
+    def test_line_vat_matches_decimal(self):
+        for _ in range(self.SAMPLES):
+            unit_price_p = self.random.randint(0, 100000)
+            qty = self.random.randint(1, 500)
+            rate = self.random_rate()
+
+            line = pricing.price_line(unit_price_p, qty, pricing.to_basis_points(rate))
+
+            line_subtotal_p = unit_price_p * qty
+            expected_vat = int(Decimal(line_subtotal_p) * rate / 100)
+            self.assertEqual(line.subtotal_p, line_subtotal_p)
+            self.assertEqual(line.vat_p, expected_vat, (unit_price_p, qty, rate))
+            self.assertEqual(line.line_total_p, line_subtotal_p + expected_vat)
+
+    def test_service_charge_matches_decimal(self):
+        for _ in range(self.SAMPLES):
+            subtotal_p = self.random.randint(0, 10 ** 9)
+            expected = int(Decimal(subtotal_p) * Decimal('0.10'))
+            self.assertEqual(pricing.service_charge(subtotal_p), expected, subtotal_p)
+
+    def test_batch_matches_single_lines(self):
+        lines = [
+            (self.random.randint(0, 5000), self.random.randint(1, 20),
+             pricing.to_basis_points(self.random_rate()))
+            for _ in range(1000)
+        ]
+
+        self.assertEqual(
+            pricing.price_lines(lines),
+            [pricing.price_line(*line) for line in lines]
+        )
+
+    def test_total_lines_matches_decimal_totals(self):
+        for _ in range(500):
+            lines = pricing.price_lines(
+                (self.random.randint(0, 5000), self.random.randint(1, 20),
+                 pricing.to_basis_points(self.random_rate()))
+                for _ in range(self.random.randint(0, 30))
+            )
+            totals = pricing.total_lines(lines)
+
+            subtotal_p = sum(line.subtotal_p for line in lines)
+            vat_total_p = sum(line.vat_p for line in lines)
+            service_charge_p = int(Decimal(subtotal_p) * Decimal('0.10'))
+            self.assertEqual(totals, (
+                subtotal_p, service_charge_p, vat_total_p,
+                subtotal_p + service_charge_p + vat_total_p
+            ))
+
+    def test_basis_points_conversion(self):
+        self.assertEqual(pricing.to_basis_points(Decimal('20.00')), 2000)
+        self.assertEqual(pricing.to_basis_points(Decimal('5.0')), 500)
+        self.assertEqual(pricing.to_basis_points(17.5), 1750)
+        self.assertEqual(pricing.to_basis_points(0), 0)
+        with self.assertRaises(ValueError):
+            pricing.to_basis_points(Decimal('12.345'))
+
+
+class QuoteAPITests(APITestCase):
+    """Test the side-effect-free basket quote endpoint"""
+
+    def setUp(self):
+        self.coffee = MenuItem.objects.create(
+            name="Coffee",
+            unit_price_p=350,  # £3.50
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.kids_meal = MenuItem.objects.create(
+            name="Kids Meal",
+            unit_price_p=700,  # £7.00
+            vat_rate_percent=Decimal('5.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def test_quote_without_tab(self):
+        """Test quoting a basket on its own"""
+        url = reverse('quote')
+        data = {'lines': [
+            {'menu_item_id': self.coffee.id, 'qty': 3},
+            {'menu_item_id': self.kids_meal.id, 'qty': 1},
+        ]}
+
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Coffee: 1050p + 210p VAT, Kids Meal: 700p + 35p VAT
+        self.assertEqual([line['vat_p'] for line in response.data['lines']], [210, 35])
+        self.assertEqual(response.data['subtotal_p'], 1750)
+        self.assertEqual(response.data['vat_total_p'], 245)
+        self.assertEqual(response.data['service_charge_p'], 175)
+        self.assertEqual(response.data['total_p'], 2170)
+        self.assertIsNone(response.data['tab_id'])
+
+    def test_quote_matches_committed_totals(self):
+        """Test a quote on a tab equals the totals after actually adding the lines"""
+        tab = Tab.objects.create(table_number=1, covers=2)
+        add_url = reverse('add_menu_item', kwargs={'tab_id': tab.id})
+        self.client.post(add_url, {'menu_item_id': self.coffee.id, 'qty': 1}, format='json')
+
+        quote = self.client.post(reverse('quote'), {
+            'tab_id': tab.id,
+            'lines': [{'menu_item_id': self.kids_meal.id, 'qty': 3}],
+        }, format='json')
+
+        self.assertEqual(quote.status_code, status.HTTP_200_OK)
+        self.assertEqual(TabItem.objects.filter(tab=tab).count(), 1)
+
+        self.client.post(add_url, {'menu_item_id': self.kids_meal.id, 'qty': 3}, format='json')
+        tab.refresh_from_db()
+        self.assertEqual(quote.data['subtotal_p'], tab.subtotal_p)
+        self.assertEqual(quote.data['service_charge_p'], tab.service_charge_p)
+        self.assertEqual(quote.data['vat_total_p'], tab.vat_total_p)
+        self.assertEqual(quote.data['total_p'], tab.total_p)
+
+    def test_quote_unknown_menu_item(self):
+        """Test quoting an unknown menu item is rejected"""
+        response = self.client.post(reverse('quote'), {
+            'lines': [{'menu_item_id': 9999, 'qty': 1}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['menu_item_ids'], [9999])
+
+    def test_quote_on_paid_tab(self):
+        """Test quoting on a paid tab is rejected"""
+        tab = Tab.objects.create(table_number=1, covers=2, status='paid')
+
+        response = self.client.post(reverse('quote'), {
+            'tab_id': tab.id,
+            'lines': [{'menu_item_id': self.coffee.id, 'qty': 1}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', response.data)
+
+
+class TabEventFeedTests(APITestCase):
+    """Test tab events are published and streamed to feed subscribers"""
+
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def test_item_added_event_published(self):
+        """Test adding an item publishes an item_added event to Redis"""
+        tab = Tab.objects.create(table_number=5, covers=2)
+        pubsub = events.get_redis().pubsub()
+        pubsub.subscribe(events.CHANNEL)
+        self.addCleanup(pubsub.close)
+
+        url = reverse('add_menu_item', kwargs={'tab_id': tab.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 2}, format='json')
+
+        messages = []
+        while (message := pubsub.get_message(timeout=1)) is not None:
+            if message['type'] == 'message':
+                messages.append(json.loads(message['data']))
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['event'], events.ITEM_ADDED)
+        self.assertEqual(messages[0]['tab_id'], tab.id)
+        self.assertEqual(messages[0]['table_number'], 5)
+        self.assertEqual(messages[0]['qty'], 2)
+
+    def test_subscriber_filters(self):
+        """Test subscribers only receive events for their tables and statuses"""
+        subscriber = Subscriber(tables=[5], statuses=['open'])
+
+        self.assertTrue(subscriber.matches({'table_number': 5, 'status': 'open'}))
+        self.assertFalse(subscriber.matches({'table_number': 6, 'status': 'open'}))
+        self.assertFalse(subscriber.matches({'table_number': 5, 'status': 'paid'}))
+        self.assertTrue(Subscriber().matches({'table_number': 6, 'status': 'paid'}))
+
+    def run_feed(self, headers, query_string=b'', events_to_send=()):
+        """Run the feed ASGI app, dispatch some events, then disconnect"""
+        sent = []
+
+        async def run():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': FEED_PATH,
+                'headers': headers,
+                'query_string': query_string,
+            }
+            task = asyncio.ensure_future(feed_application(scope, receive, send))
+            for _ in range(100):
+                if hub.subscribers or task.done():
+                    break
+                await asyncio.sleep(0.01)
+            for event in events_to_send:
+                hub.dispatch(event)
+            await asyncio.sleep(0.05)
+            disconnected.set()
+            await task
+            if hub._task is not None:
+                hub._task.cancel()
+
+        async_to_sync(run)()
+        return sent
+
+    def test_feed_requires_api_key(self):
+        """Test the feed rejects requests without a valid API key"""
+        sent = self.run_feed(headers=[(b'x-api-key', b'wrong')])
+        self.assertEqual(sent[0]['status'], 401)
+
+    def test_feed_streams_matching_events(self):
+        """Test the feed streams matching events as server-sent events"""
+        sent = self.run_feed(
+            headers=[(b'x-api-key', b'demo')],
+            query_string=b'table=5',
+            events_to_send=[
+                {'event': 'item_added', 'tab_id': 1, 'site': 'main', 'table_number': 6, 'status': 'open'},
+                {'event': 'tab_paid', 'tab_id': 2, 'site': 'main', 'table_number': 5, 'status': 'paid'},
+                {'event': 'tab_paid', 'tab_id': 1, 'site': 'soho', 'table_number': 5, 'status': 'paid'},
+            ]
+        )
+
+        self.assertEqual(sent[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertIn(b'event: tab_paid', body)
+        self.assertNotIn(b'item_added', body)
+        self.assertNotIn(b'soho', body)
+        self.assertFalse(hub.subscribers)
+
+
+class FloorTests(APITestCase):
+    """Test the open-tab floor summary stays in sync with the tabs"""
+
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item",
+            unit_price_p=500,  # £5.00
+            vat_rate_percent=Decimal('20.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def test_floor_follows_tab_lifecycle(self):
+        """Test tabs appear on create, update on add and leave on payment"""
+        response = self.client.post(reverse('create_tab'), {'table_number': 7, 'covers': 4}, format='json')
+        tab_id = response.data['id']
+
+        floor_data = self.client.get(reverse('floor')).data
+        self.assertEqual(len(floor_data), 1)
+        self.assertEqual(floor_data[0]['tab_id'], tab_id)
+        self.assertEqual(floor_data[0]['table_number'], 7)
+        self.assertEqual(floor_data[0]['covers'], 4)
+        self.assertEqual(floor_data[0]['total_p'], 0)
+        self.assertGreaterEqual(floor_data[0]['age_seconds'], 0)
+
+        url = reverse('add_menu_item', kwargs={'tab_id': tab_id})
+        self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 1}, format='json')
+        self.assertEqual(self.client.get(reverse('floor')).data[0]['total_p'], 650)
+
+        url = reverse('create_payment_intent', kwargs={'tab_id': tab_id})
+        client_secret = self.client.post(url, {}, format='json').data['client_secret']
+        url = reverse('take_payment', kwargs={'tab_id': tab_id})
+        self.client.post(url, {'client_secret': client_secret}, format='json')
+        self.assertEqual(self.client.get(reverse('floor')).data, [])
+
+    def test_floor_is_a_single_query(self):
+        """Test the floor is read in one query"""
+        for table_number in range(1, 6):
+            self.client.post(reverse('create_tab'), {'table_number': table_number, 'covers': 2}, format='json')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('floor'))
+        self.assertEqual(len(response.data), 5)
+
+    def test_reconcile_repairs_drift(self):
+        """Test reconciliation adds, updates and removes floor rows"""
+        missing = Tab.objects.create(table_number=1, covers=2)
+        stale = Tab.objects.create(table_number=2, covers=2, total_p=500)
+        OpenTab.objects.create(tab=stale, table_number=2, covers=2, opened_at=stale.opened_at, total_p=100)
+        paid = Tab.objects.create(table_number=3, covers=2, status='paid')
+        OpenTab.objects.create(tab=paid, table_number=3, covers=2, opened_at=paid.opened_at)
+
+        call_command('reconcile_floor', stdout=StringIO())
+
+        entries = {entry.tab_id: entry for entry in OpenTab.objects.all()}
+        self.assertEqual(set(entries), {missing.id, stale.id})
+        self.assertEqual(entries[stale.id].total_p, 500)
+
+
+class TableTabTests(APITestCase):
+    """Test looking up and guarding the open tab for a table"""
+
+    def setUp(self):
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def test_get_open_tab_for_table(self):
+        """Test the open tab is found by table number"""
+        Tab.objects.create(table_number=4, covers=2, status='paid')
+        tab = Tab.objects.create(table_number=4, covers=3)
+
+        url = reverse('table_tab', kwargs={'table_number': 4})
+        with self.assertNumQueries(2):  # The tab, then its items
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], tab.id)
+
+    def test_no_open_tab_for_table(self):
+        """Test a table without an open tab returns 404"""
+        Tab.objects.create(table_number=4, covers=2, status='paid')
+
+        response = self.client.get(reverse('table_tab', kwargs={'table_number': 4}))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_second_open_tab_for_table_rejected(self):
+        """Test a table cannot have two open tabs"""
+        url = reverse('create_tab')
+        first = self.client.post(url, {'table_number': 4, 'covers': 2}, format='json')
+        second = self.client.post(url, {'table_number': 4, 'covers': 2}, format='json')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(second.data['table_number'], ['Table already has an open tab'])
+        self.assertEqual(Tab.objects.filter(table_number=4).count(), 1)
+
+    def test_database_enforces_one_open_tab(self):
+        """Test the partial unique index rejects a second open tab"""
+        Tab.objects.create(table_number=4, covers=2)
+        Tab.objects.create(table_number=4, covers=2, status='paid')
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tab.objects.create(table_number=4, covers=2)
+
+
+@override_settings(TAB_EVENT_SNAPSHOT_LAG_SECONDS=0)
+class TabEventLogTests(APITestCase):
+    """Test the tab event log, its snapshots and replay"""
+
+    def setUp(self):
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+        self.coffee = MenuItem.objects.create(
+            name="Coffee",
+            unit_price_p=350,  # £3.50
+            vat_rate_percent=Decimal('20.0')
+        )
+
+    def open_tab(self, table_number):
+        response = self.client.post(
+            reverse('create_tab'), {'table_number': table_number, 'covers': 2}, format='json'
+        )
+        return response.data['id']
+
+    def add_coffee(self, tab_id, qty=1):
+        url = reverse('add_menu_item', kwargs={'tab_id': tab_id})
+        self.client.post(url, {'menu_item_id': self.coffee.id, 'qty': qty}, format='json')
+
+    def test_changes_are_logged(self):
+        """Test opening a tab and adding lines appends events"""
+        tab_id = self.open_tab(1)
+        self.add_coffee(tab_id, qty=2)
+
+        logged = list(TabEvent.objects.filter(tab_id=tab_id).order_by('id'))
+        self.assertEqual([event.kind for event in logged], [TabEvent.TAB_OPENED, TabEvent.LINE_ADDED])
+        self.assertEqual(logged[0].data['table_number'], 1)
+        self.assertEqual(logged[1].data['line_total_p'], 840)
+
+    def test_rejected_change_not_logged(self):
+        """Test a change that is refused writes no event"""
+        tab_id = self.open_tab(1)
+        Tab.objects.filter(id=tab_id).update(status='paid')
+
+        self.add_coffee(tab_id)
+
+        self.assertFalse(TabEvent.objects.filter(kind=TabEvent.LINE_ADDED).exists())
+
+    def test_replay_rebuilds_totals(self):
+        """Test replaying the log gives the stored tab totals"""
+        tab_id = self.open_tab(1)
+        self.add_coffee(tab_id, qty=2)
+        self.add_coffee(tab_id, qty=1)
+
+        states, count = replay.replay(use_snapshots=False)
+
+        tab = Tab.objects.get(id=tab_id)
+        self.assertEqual(count, 3)
+        self.assertEqual(states[tab_id]['lines'], 2)
+        self.assertEqual(
+            tuple(replay.totals(states[tab_id])),
+            (tab.subtotal_p, tab.service_charge_p, tab.vat_total_p, tab.total_p)
+        )
+
+    def test_snapshots_bound_replay(self):
+        """Test replay from snapshots matches a full replay and reads only newer events"""
+        first = self.open_tab(1)
+        self.add_coffee(first)
+        second = self.open_tab(2)
+
+        snapshotted, last_event_id = replay.snapshot()
+        self.assertEqual(snapshotted, 2)
+        self.assertEqual(last_event_id, TabEvent.objects.latest('id').id)
+        self.assertEqual(TabStateSnapshot.objects.get(tab_id=first).state['lines'], 1)
+
+        self.add_coffee(first)
+        self.add_coffee(second, qty=3)
+
+        full, full_count = replay.replay(use_snapshots=False)
+        bounded, bounded_count = replay.replay()
+        self.assertEqual(bounded, full)
+        self.assertEqual(full_count, 5)
+        self.assertEqual(bounded_count, 2)
+
+        # Only the tabs touched since the last run are rewritten
+        self.assertEqual(replay.snapshot()[0], 2)
+        self.assertEqual(replay.snapshot()[0], 0)
+
+    def test_replay_command_repairs_drift(self):
+        """Test the replay command puts drifted totals back"""
+        tab_id = self.open_tab(1)
+        self.add_coffee(tab_id, qty=2)
+        expected = Tab.objects.get(id=tab_id).total_p
+        Tab.objects.filter(id=tab_id).update(total_p=1)
+
+        out = StringIO()
+        call_command('replay_tab_events', stdout=out)
+        self.assertIn('1 tabs disagree with the log', out.getvalue())
+        self.assertEqual(Tab.objects.get(id=tab_id).total_p, 1)
+
+        call_command('replay_tab_events', '--repair', stdout=StringIO())
+        self.assertEqual(Tab.objects.get(id=tab_id).total_p, expected)
+        self.assertEqual(OpenTab.objects.get(tab_id=tab_id).total_p, expected)
+
+
+@override_settings(ADMIN_COUNT_LIMIT=5)
+class AdminChangelistTests(TestCase):
+    """Test the admin changelists stay bounded on large tables"""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.coffee = MenuItem.objects.create(
+            name="Coffee",
+            unit_price_p=350,  # £3.50
+            vat_rate_percent=Decimal('20.0')
+        )
+
+    def add_lines(self, count):
+        for _ in range(count):
+            tab = Tab.objects.create(table_number=1, covers=2, status='paid')
+            TabItem.objects.create(
+                tab=tab, menu_item=self.coffee, qty=1, unit_price_p=350,
+                vat_rate_percent=Decimal('20.0'), vat_p=70, line_total_p=420
+            )
+
+    def test_tabitem_changelist_queries_do_not_grow(self):
+        """Test related rows are loaded with the changelist, not once per row"""
+        url = reverse('admin:tabs_tabitem_changelist')
+        self.add_lines(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.add_lines(8)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(many), len(few))
+
+    def test_count_is_capped(self):
+        """Test the paginator stops counting at ADMIN_COUNT_LIMIT"""
+        self.add_lines(8)
+
+        response = self.client.get(reverse('admin:tabs_tab_changelist'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+    def test_search_by_id(self):
+        """Test searching matches IDs exactly and ignores text that isn't one"""
+        self.add_lines(2)
+        tab = Tab.objects.first()
+        url = reverse('admin:tabs_tab_changelist')
+
+        response = self.client.get(url, {'q': str(tab.id)})
+        self.assertEqual(list(response.context['cl'].result_list), [tab])
+
+        response = self.client.get(url, {'q': 'table five'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_search_uses_plain_equality(self):
+        """Test searches compare the columns as stored, which their indexes can serve"""
+        self.add_lines(1)
+        tab = Tab.objects.get()
+
+        for changelist in ('tabs_tab', 'tabs_tabitem', 'payment_payment'):
+            for term in (str(tab.id), 'pi_abc'):
+                with self.subTest(changelist=changelist, term=term), CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse(f'admin:{changelist}_changelist'), {'q': term})
+                self.assertEqual(response.status_code, 200)
+                sql = ' '.join(query['sql'] for query in queries).upper()
+                for operator in ('UPPER(', 'LIKE', '::TEXT', 'CAST('):
+                    self.assertNotIn(operator, sql)
+
+    def test_search_odd_numbers(self):
+        """Test non-ASCII digits and numbers too big for the columns find nothing instead of erroring"""
+        self.add_lines(1)
+
+        for changelist in ('tabs_tab', 'tabs_tabitem', 'payment_payment'):
+            for term in ('²', '٣', '9' * 30):
+                with self.subTest(changelist=changelist, term=term):
+                    response = self.client.get(reverse(f'admin:{changelist}_changelist'), {'q': term})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(list(response.context['cl'].result_list), [])
+
+
+class SchemaViewTests(APITestCase):
+    """Test the OpenAPI schema is built once and served with cache headers"""
+
+    def setUp(self):
+        schema.clear()
+        self.addCleanup(schema.clear)
+        # The baseline authenticator warnings are covered by `manage.py spectacular`
+        self.enterContext(GENERATOR_STATS.silence())
+
+    def test_schema_matches_generated(self):
+        """Test the cached schema is the same as drf-spectacular's own response"""
+        url = reverse('schema')
+        cached = self.client.get(url)
+        generated = self.client.get(url, {'lang': 'en'})  # Bypasses the cache
+
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, generated.content)
+        self.assertEqual(cached['Content-Type'], generated['Content-Type'])
+        self.assertIn('max-age=86400', cached['Cache-Control'])
+
+    def test_schema_generated_once(self):
+        """Test later requests reuse the schema and revalidate with the ETag"""
+        url = reverse('schema')
+        with patch('epos.schema.generate_schema', wraps=schema.generate_schema) as generate:
+            first = self.client.get(url)
+            second = self.client.get(url, {'format': 'json'})
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(json.loads(second.content)['info']['title'], 'EPOS API')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_cache_keyed_on_output(self):
+        """Test Accept headers that render the same schema share one cache entry"""
+        url = reverse('schema')
+        for n in range(5):
+            response = self.client.get(url, HTTP_ACCEPT=f'application/vnd.oai.openapi+json; foo={n}')
+            self.assertEqual(response.status_code, 200)
+        indented = self.client.get(url, HTTP_ACCEPT='application/vnd.oai.openapi+json; indent=2')
+
+        self.assertEqual(len(schema._rendered), 2)
+        self.assertTrue(indented.content.startswith(b'{\n  "'))
+
+    def test_prebuilt_schema_served(self):
+        """Test a schema written by build_schema is served without generating one"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'schema.json')
+            call_command('build_schema', output=path, stdout=StringIO())
+
+            with override_settings(OPENAPI_SCHEMA_FILE=path), \
+                    patch('epos.schema.generate_schema') as generate:
+                response = self.client.get(reverse('schema'), {'format': 'json'})
+
+        generate.assert_not_called()
+        self.assertIn('/api/tabs', json.loads(response.content)['paths'])
+
+
+class MiddlewareRoutingTests(APITestCase):
+    """Test API requests skip the admin's middleware and the admin keeps it"""
+
+    def setUp(self):
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def test_api_skips_site_middleware(self):
+        """Test API requests load no session and get no clickjacking header"""
+        tab = Tab.objects.create(table_number=1, covers=2)
+
+        response = self.client.get(reverse('get_tab', kwargs={'tab_id': tab.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+
+    def test_admin_keeps_site_middleware(self):
+        """Test the admin still gets sessions, CSRF and clickjacking protection"""
+        self.client.handler.enforce_csrf_checks = True
+
+        login = self.client.get('/admin/login/')
+        response = self.client.post('/admin/login/', {'username': 'admin', 'password': 'x'})
+        tab = self.client.post(reverse('create_tab'), {'table_number': 5, 'covers': 3}, format='json')
+
+        self.assertEqual(login['X-Frame-Options'], 'DENY')
+        self.assertTrue(hasattr(login.wsgi_request, 'session'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(tab.status_code, status.HTTP_201_CREATED)
+
+
+class FastSerializerTests(APITestCase):
+    """Test the fast serialisers render byte-identical JSON to the DRF serializers"""
+
+    def setUp(self):
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+        self.menu_items = [
+            MenuItem.objects.create(name="Flat White", unit_price_p=350, vat_rate_percent=Decimal('20.0')),
+            MenuItem.objects.create(name="Croissant \u00e0 l'ancienne", unit_price_p=275, vat_rate_percent=Decimal('5')),
+            MenuItem.objects.create(name="Water", unit_price_p=0, vat_rate_percent=Decimal('0.00')),
+        ]
+        self.tab = Tab.objects.create(table_number=4, covers=3)
+        for qty, menu_item in enumerate(self.menu_items * 2, start=1):
+            self.client.post(
+                reverse('add_menu_item', kwargs={'tab_id': self.tab.id}),
+                {'menu_item_id': menu_item.id, 'qty': qty},
+                format='json'
+            )
+        self.tab.refresh_from_db()
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_tab_matches_serializer(self):
+        """Test open, empty and closed tabs render the same as TabSerializer"""
+        empty = Tab.objects.create(table_number=5, covers=1)
+        closed = Tab.objects.create(table_number=6, covers=2, status='closed', closed_at=self.tab.opened_at)
+
+        for tab in (self.tab, empty, closed):
+            with self.subTest(tab=tab.id):
+                expected = self.render(TabSerializer(Tab.objects.get(id=tab.id)).data)
+                self.assertEqual(self.render(fast_serializers.get_tab(id=tab.id)), expected)
+                self.assertEqual(self.render(fast_serializers.tabs_data([tab.id])[tab.id]), expected)
+
+    def test_responses_match_serializer(self):
+        """Test the tab endpoints return the bytes TabSerializer would"""
+        expected = self.render(TabSerializer(self.tab).data)
+
+        by_id = self.client.get(reverse('get_tab', kwargs={'tab_id': self.tab.id}))
+        by_table = self.client.get(reverse('table_tab', kwargs={'table_number': 4}))
+
+        self.assertEqual(by_id.content, expected)
+        self.assertEqual(by_table.content, expected)
+
+        response = self.client.post(reverse('create_tab'), {'table_number': 9, 'covers': 2}, format='json')
+        self.assertEqual(response.content, self.render(TabSerializer(Tab.objects.get(table_number=9)).data))
+
+    def test_add_item_matches_serializer(self):
+        """Test the added line renders the same as TabItemSerializer"""
+        response = self.client.post(
+            reverse('add_menu_item', kwargs={'tab_id': self.tab.id}),
+            {'menu_item_id': self.menu_items[1].id, 'qty': 3},
+            format='json'
+        )
+
+        data = TabItemSerializer(TabItem.objects.latest('id')).data
+        data['tab_totals'] = {
+            field: getattr(Tab.objects.get(id=self.tab.id), field)
+            for field in ('subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p')
+        }
+        self.assertEqual(response.content, self.render(data))
+
+    def test_tab_query_count(self):
+        """Test a tab is serialised in two queries however many lines it has"""
+        with self.assertNumQueries(2):
+            data = fast_serializers.get_tab(id=self.tab.id)
+        self.assertEqual(len(data['items']), 6)
+
+
+class CompiledSerializerTests(APITestCase):
+    """Test compiled validation gives the same results and errors as the serializers"""
+
+    def setUp(self):
+        self.menu_item = MenuItem.objects.create(
+            name="Test Item", unit_price_p=500, vat_rate_percent=Decimal('20.0')
+        )
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def assertSameAsSerializer(self, serializer_class, compiled, bodies):
+        for body in bodies:
+            with self.subTest(body=body):
+                serializer = serializer_class(data=body)
+                valid = serializer.is_valid()
+                validated_data, errors = compiled.validate(body)
+                if valid:
+                    self.assertIsNone(errors)
+                    self.assertEqual(validated_data, serializer.validated_data)
+                else:
+                    self.assertIsNone(validated_data)
+                    self.assertEqual(JSONRenderer().render(errors), JSONRenderer().render(serializer.errors))
+
+    def test_add_menu_item_matches_serializer(self):
+        """Test add-item bodies validate as AddMenuItemSerializer does"""
+        compiled = CompiledSerializer(AddMenuItemSerializer, menu_item_id=menu.validate_menu_item_id)
+        item_id = self.menu_item.id
+        self.assertSameAsSerializer(AddMenuItemSerializer, compiled, [
+            {'menu_item_id': item_id, 'qty': 2},
+            {'menu_item_id': str(item_id), 'qty': '3.0'},
+            {'menu_item_id': item_id + 1, 'qty': 1},
+            {'menu_item_id': 'abc', 'qty': 0},
+            {'menu_item_id': None, 'qty': None},
+            {'menu_item_id': True, 'qty': 1.5},
+            {'menu_item_id': '9' * 1001, 'qty': [1]},
+            {'menu_item_id': item_id, 'qty': -1, 'extra': 'ignored'},
+            {},
+            [],
+            None,
+            'not a dict',
+            QueryDict(f'menu_item_id={item_id}&qty=2'),
+            QueryDict('qty='),
+        ])
+
+    def test_menu_ids_not_queried(self):
+        """Test adding a line checks the menu item against the in-memory set"""
+        tab = Tab.objects.create(table_number=1, covers=2)
+        url = reverse('add_menu_item', kwargs={'tab_id': tab.id})
+        menu.ids()
+
+        with patch.object(menu.MenuItem.objects, 'filter', wraps=MenuItem.objects.filter) as lookup:
+            response = self.client.post(url, {'menu_item_id': self.menu_item.id, 'qty': 2}, format='json')
+        lookup.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # A menu item added since the set was loaded is still accepted
+        new_item = MenuItem.objects.create(name="New Item", unit_price_p=100, vat_rate_percent=Decimal('0'))
+        menu.ids().discard(new_item.id)
+        self.assertTrue(menu.exists(new_item.id))
+        self.assertIn(new_item.id, menu.ids())
+
+        response = self.client.post(url, {'menu_item_id': new_item.id + 1, 'qty': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'menu_item_id': ['Menu item not found']})
+
+
+class FastJSONTests(SimpleTestCase):
+    """Test the orjson renderer and parser give the same results as DRF's"""
+
+    def test_renders_same_bytes(self):
+        """Test datetimes, decimals and escapes render the same as JSONRenderer"""
+        utc = timezone.now().replace(microsecond=123456)
+        london = utc.astimezone(zoneinfo.ZoneInfo('Europe/London'))
+        data = {
+            'utc': utc,
+            'whole_second': utc.replace(microsecond=0),
+            'london': london,
+            'naive': datetime(2025, 1, 1, 12, 30),
+            'day': date(2025, 1, 1),
+            'time': time(9, 15, 30, 500),
+            'duration': timedelta(minutes=90),
+            'vat_rate_percent': Decimal('20.00'),
+            'tiny': Decimal('0.0000001'),
+            'amounts': (1, -2, 2 ** 63 - 1, 0.5),
+            'name': "Caf\u00e9 \u2603 \u2028\u2029",
+            'error': ErrorDetail('Menu item not found', code='invalid'),
+            'lazy': gettext_lazy('This field is required.'),
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            7: None,
+        }
+        for value in (data, [data], None, {}, 'text', 2 ** 70):
+            with self.subTest(value=value):
+                self.assertEqual(FastJSONRenderer().render(value), JSONRenderer().render(value))
+
+        indented = 'application/json; indent=4'
+        self.assertEqual(FastJSONRenderer().render(data, indented), JSONRenderer().render(data, indented))
+        with self.assertRaises(ValueError):
+            FastJSONRenderer().render({'nan': Decimal('NaN')})
+        for value in ({'nan': float('nan'), 'closed_at': None}, [[float('-inf')], None]):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError) as expected:
+                    JSONRenderer().render(value)
+                with self.assertRaises(ValueError) as fast:
+                    FastJSONRenderer().render(value)
+                self.assertEqual(str(fast.exception), str(expected.exception))
+
+    def test_parses_same_data(self):
+        """Test bodies parse to the same data, and bad bodies fail with the same message"""
+        bodies = [
+            b'{"menu_item_id": 1, "qty": 2}',
+            '{"name": "Caf\u00e9", "ok": true, "none": null, "price": 3.5}'.encode(),
+            b'[1, 123456789012345678901234567890]',
+            b'"\\ud800"',
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assertEqual(
+                    FastJSONParser().parse(BytesIO(body)),
+                    JSONParser().parse(BytesIO(body))
+                )
+
+        for body in (b'{"qty": }', b'NaN', b'\xff', b''):
+            with self.subTest(body=body):
+                with self.assertRaises(ParseError) as expected:
+                    JSONParser().parse(BytesIO(body))
+                with self.assertRaises(ParseError) as fast:
+                    FastJSONParser().parse(BytesIO(body))
+                self.assertEqual(str(fast.exception), str(expected.exception))
+
+    def test_without_orjson(self):
+        """Test the renderer and parser fall back to DRF's when orjson is missing"""
+        data = {'opened_at': timezone.now(), 'vat_rate_percent': Decimal('5.00')}
+        with patch('epos.renderers.orjson', None), patch('epos.parsers.orjson', None):
+            rendered = FastJSONRenderer().render(data)
+            self.assertEqual(rendered, JSONRenderer().render(data))
+            self.assertEqual(FastJSONParser().parse(BytesIO(rendered)), json.loads(rendered))
+
+
+class SparseTabReadTests(APITestCase):
+    """Test ?fields= and ?exclude= limit what a tab read queries and returns"""
+
+    def setUp(self):
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+        menu_item = MenuItem.objects.create(name="Test Item", unit_price_p=500, vat_rate_percent=Decimal('20.0'))
+        self.tab = Tab.objects.create(table_number=1, covers=2)
+        self.url = reverse('get_tab', kwargs={'tab_id': self.tab.id})
+        for qty in (1, 2, 3):
+            self.client.post(
+                reverse('add_menu_item', kwargs={'tab_id': self.tab.id}),
+                {'menu_item_id': menu_item.id, 'qty': qty},
+                format='json'
+            )
+
+    def test_totals_only_read(self):
+        """Test a totals-only read is one single-row query"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'total_p,status'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data), ['status', 'total_p'])
+        self.assertEqual(response.data['total_p'], 3900)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"tabs_tab"', queries[0]['sql'])
+        self.assertNotIn('"covers"', queries[0]['sql'])
+
+    def test_exclude_items(self):
+        """Test excluding items returns everything else without reading the lines"""
+        full = self.client.get(self.url).data
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'exclude': 'items'})
+
+        self.assertEqual(response.data, {key: value for key, value in full.items() if key != 'items'})
+
+    def test_open_tab_read(self):
+        """Test a whole open tab is the row, then its lines"""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertNotIn('payments', response.data)
+
+    def test_paid_tab_fields(self):
+        """Test paid tabs read totals from the row and payments from the snapshot"""
+        Tab.objects.filter(id=self.tab.id).update(status='paid')
+        TabSnapshot.objects.create(tab=self.tab, data={
+            **self.client.get(self.url).data, 'status': 'paid', 'payments': [{'status': 'succeeded'}]
+        })
+
+        with self.assertNumQueries(1):
+            totals = self.client.get(self.url, {'fields': 'status,total_p'})
+        with self.assertNumQueries(2):
+            payments = self.client.get(self.url, {'fields': 'payments'})
+
+        self.assertEqual(totals.data, {'status': 'paid', 'total_p': 3900})
+        self.assertEqual(payments.data, {'payments': [{'status': 'succeeded'}]})
+
+    def test_unknown_field(self):
+        """Test asking for a field tabs don't have is rejected"""
+        response = self.client.get(self.url, {'fields': 'status,tip_p', 'exclude': 'itmes'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': 'Unknown fields: tip_p, itmes'})
+
+
+@override_settings(RATE_LIMITS={'default': None, 'get_tab': {'rate': 0.5, 'burst': 2}})
+class RateLimitTests(APITestCase):
+    """Test per-key token-bucket limits and load shedding"""
+
+    def setUp(self):
+        throttling.clear()
+        self.addCleanup(throttling.clear)
+        tab = Tab.objects.create(table_number=1, covers=2, site='soho')
+        self.url = reverse('get_tab', kwargs={'tab_id': tab.id})
+        self.api_key = keys.create('Bar till 1', site='soho')[1]
+        self.other_key = keys.create('Bar till 2', site='soho')[1]
+
+    def get(self, api_key, url=None):
+        return self.client.get(url or self.url, HTTP_X_API_KEY=api_key)
+
+    def test_limited_per_key_and_route(self):
+        """Test a key past its burst gets 429 while other keys and routes carry on"""
+        responses = [self.get(self.api_key).status_code for _ in range(3)]
+        throttled = self.get(self.api_key)
+
+        self.assertEqual(responses, [200, 200, 429])
+        self.assertEqual(throttled['Retry-After'], '2')
+        self.assertEqual(self.get(self.other_key).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(self.api_key, reverse('floor')).status_code, status.HTTP_200_OK)
+
+    def test_forwarded_for_ignored(self):
+        """Test a shared-key client can't get a fresh bucket by sending X-Forwarded-For"""
+        bucket = f'{throttling.KEY_PREFIX}:ip:192.0.2.1:get_tab'
+        throttling.get_redis().delete(bucket)
+        self.addCleanup(throttling.get_redis().delete, bucket)
+
+        responses = [
+            self.client.get(
+                self.url, HTTP_X_API_KEY='demo', HTTP_X_SITE='soho',
+                REMOTE_ADDR='192.0.2.1', HTTP_X_FORWARDED_FOR=f'10.0.0.{n}'
+            ).status_code
+            for n in range(3)
+        ]
+
+        self.assertEqual(responses, [200, 200, 429])
+
+    @override_settings(RATE_LIMITS={'get_tab': {'rate': 20, 'burst': 1}})
+    def test_bucket_refills(self):
+        """Test tokens come back at the configured rate"""
+        self.assertEqual(self.get(self.api_key).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(self.api_key).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        sleep(0.1)
+        self.assertEqual(self.get(self.api_key).status_code, status.HTTP_200_OK)
+
+    def test_in_process_fallback(self):
+        """Test requests are still limited in-process when Redis is down"""
+        with patch.object(throttling, 'get_script', side_effect=throttling.redis.ConnectionError), \
+                self.assertLogs('epos.throttling', 'WARNING'):
+            responses = [self.get(self.api_key).status_code for _ in range(3)]
+
+        self.assertEqual(responses, [200, 200, 429])
+
+    def test_concurrency_limit(self):
+        """Test requests past MAX_CONCURRENT_REQUESTS are shed with a 503"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_view(request):
+            started.set()
+            release.wait(5)
+            return HttpResponse()
+
+        with override_settings(MAX_CONCURRENT_REQUESTS=1, CONCURRENCY_WAIT_SECONDS=0):
+            middleware = ConcurrencyLimitMiddleware(slow_view)
+        request = RequestFactory().get('/api/floor')
+        worker = threading.Thread(target=middleware, args=(request,))
+        worker.start()
+        started.wait(5)
+
+        shed = middleware(request)
+        release.set()
+        worker.join()
+
+        self.assertEqual(shed.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(shed['Retry-After'], '1')
+        self.assertEqual(middleware(request).status_code, status.HTTP_200_OK)
+        with override_settings(MAX_CONCURRENT_REQUESTS=0), self.assertRaises(MiddlewareNotUsed):
+            ConcurrencyLimitMiddleware(slow_view)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    """Test replica reads, read-your-writes pinning and lag fallback"""
+
+    # Replicas are only used outside a transaction, which TestCase always opens
+
+    def setUp(self):
+        replicas.clear()
+        self.addCleanup(replicas.clear)
+        self.row, self.api_key = keys.create('Bar till 1', site='soho')
+        self.client.defaults['HTTP_X_API_KEY'] = self.api_key
+        self.client_id = f'key:{self.row.prefix}'
+
+    def test_routing(self):
+        """Test only reads inside reads_from_replica() outside a transaction use a replica"""
+        with patch.object(replicas, 'replica_lag', side_effect=[0, 10]), self.assertLogs('epos.replicas', 'WARNING'):
+            with replicas.reads_from_replica() as alias:
+                self.assertEqual(alias, 'replica_1')
+                self.assertEqual(router.db_for_read(Tab), 'replica_1')
+                self.assertEqual(router.db_for_write(Tab), 'default')
+                with transaction.atomic():
+                    self.assertEqual(router.db_for_read(Tab), 'default')
+
+        self.assertEqual(router.db_for_read(Tab), 'default')
+        self.assertFalse(router.allow_migrate('replica_1', 'tabs'))
+        self.assertTrue(router.allow_migrate('default', 'tabs'))
+
+    def test_pinned_after_write(self):
+        """Test a client reads from the primary for REPLICA_PIN_SECONDS after writing"""
+        with patch.object(replicas, 'choose_replica', return_value='default') as choose_replica:
+            self.assertEqual(self.client.get(reverse('floor')).status_code, status.HTTP_200_OK)
+            self.client.post(reverse('create_tab'), {'table_number': 5, 'covers': 3}, format='json')
+            self.assertEqual(self.client.get(reverse('floor')).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(choose_replica.call_count, 1)
+        self.assertTrue(replicas.pinned(self.client_id))
+        self.assertLessEqual(replicas.get_redis().pttl(f'{replicas.KEY_PREFIX}:{self.client_id}'), 5000)
+        self.assertFalse(replicas.pinned('key:unknown'))
+
+    def test_lagging_replicas(self):
+        """Test lagging and unreachable replicas are skipped until rechecked"""
+        with patch.object(replicas, 'replica_lag', side_effect=[10, DatabaseError]) as replica_lag, \
+                self.assertLogs('epos.replicas', 'WARNING'):
+            self.assertIsNone(replicas.choose_replica())
+            self.assertIsNone(replicas.choose_replica())
+
+        self.assertEqual(replica_lag.call_count, 2)
+        with override_settings(REPLICA_LAG_CHECK_SECONDS=0), patch.object(replicas, 'replica_lag', return_value=0):
+            replicas.clear()
+            self.assertIn(replicas.choose_replica(), {'replica_1', 'replica_2'})
+
+    def test_redis_down(self):
+        """Test reads stay on the primary when pins can't be checked"""
+        broken = Mock(**{'exists.side_effect': replicas.redis.ConnectionError})
+
+        with patch.object(replicas, 'get_redis', return_value=broken), \
+                patch.object(replicas, 'replica_lag', return_value=0), \
+                self.assertLogs('epos.replicas', 'WARNING'), \
+                replicas.reads_from_replica(self.client_id) as alias:
+            self.assertIsNone(alias)
+
+
+class SiteTests(APITestCase):
+    """Test tabs belong to a site and each site has its own tables"""
+
+    def setUp(self):
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+
+    def open_tab(self, site, table_number=5, **headers):
+        return self.client.post(
+            reverse('create_tab'), {'table_number': table_number, 'covers': 2}, format='json', HTTP_X_SITE=site, **headers
+        )
+
+    def test_tables_per_site(self):
+        """Test two sites can each have table 5 open and only see their own"""
+        soho = self.open_tab('soho')
+        shoreditch = self.open_tab('shoreditch')
+        clash = self.open_tab('soho')
+
+        self.assertEqual((soho.status_code, shoreditch.status_code), (201, 201))
+        self.assertEqual(clash.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tab.objects.get(id=soho.data['id']).site, 'soho')
+        self.assertEqual(OpenTab.objects.get(tab_id=shoreditch.data['id']).site, 'shoreditch')
+        floor = self.client.get(reverse('floor'), HTTP_X_SITE='soho')
+        self.assertEqual([entry['tab_id'] for entry in floor.data], [soho.data['id']])
+        table = self.client.get(reverse('table_tab', kwargs={'table_number': 5}), HTTP_X_SITE='shoreditch')
+        self.assertEqual(table.data['id'], shoreditch.data['id'])
+        self.assertEqual(self.client.get(reverse('floor')).data, [])
+
+    def test_other_sites_tab(self):
+        """Test a tab can't be read, added to or paid from another site"""
+        tab_id = self.open_tab('soho').data['id']
+        menu_item = MenuItem.objects.create(name="Coffee", unit_price_p=350, vat_rate_percent=Decimal('20.0'))
+        TabArchive.objects.create(
+            tab_id=tab_id + 1, site='soho', month=date(2024, 1, 1), table_number=3, status='paid',
+            opened_at=timezone.now(), total_p=0, data={}
+        )
+
+        responses = [
+            self.client.get(reverse('get_tab', kwargs={'tab_id': tab_id}), HTTP_X_SITE='shoreditch'),
+            self.client.get(reverse('get_tab', kwargs={'tab_id': tab_id + 1}), HTTP_X_SITE='shoreditch'),
+            self.client.post(
+                reverse('add_menu_item', kwargs={'tab_id': tab_id}),
+                {'menu_item_id': menu_item.id, 'qty': 1}, format='json', HTTP_X_SITE='shoreditch'
+            ),
+            self.client.post(reverse('quote'), {'tab_id': tab_id, 'lines': [{'menu_item_id': menu_item.id, 'qty': 1}]},
+                             format='json', HTTP_X_SITE='shoreditch'),
+            self.client.post(reverse('create_payment_intent', kwargs={'tab_id': tab_id}), HTTP_X_SITE='shoreditch'),
+            self.client.post(reverse('take_payment', kwargs={'tab_id': tab_id}), {'client_secret': 'secret'},
+                             format='json', HTTP_X_SITE='shoreditch'),
+        ]
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_404_NOT_FOUND] * 6)
+        self.assertFalse(TabItem.objects.filter(tab_id=tab_id).exists())
+        self.assertEqual(self.client.get(reverse('get_tab', kwargs={'tab_id': tab_id}), HTTP_X_SITE='soho').status_code, 200)
+
+    def test_key_site_wins(self):
+        """Test a till's own key decides its site whatever X-Site says"""
+        api_key = keys.create('Bar till 1', site='soho')[1]
+
+        response = self.open_tab('shoreditch', HTTP_X_API_KEY=api_key)
+
+        self.assertEqual(Tab.objects.get(id=response.data['id']).site, 'soho')
+
+    @override_settings(SHARD_DATABASES=['shard_1'], SITE_SHARDS={'soho': 'shard_1'})
+    def test_router(self):
+        """Test only the tabs and payment apps follow a site to its shard"""
+        with sharding.using_site('soho'):
+            self.assertEqual(router.db_for_write(Tab), 'shard_1')
+            self.assertEqual(router.db_for_read(TabItem), 'shard_1')
+            self.assertEqual(router.db_for_read(keys.APIKey), 'default')
+            with sharding.using_shard('default'):
+                self.assertEqual(router.db_for_read(Tab), 'default')
+        self.assertEqual(router.db_for_write(Tab), 'default')
+
+        self.assertTrue(router.allow_migrate('shard_1', 'payment'))
+        self.assertFalse(router.allow_migrate('shard_1', 'apikeys'))
+        self.assertTrue(router.allow_migrate('default', 'apikeys'))
+
+
+class CoalescerTests(APITransactionTestCase):
+    """Test adds to one tab arriving together are written as one batch"""
+
+    # The adds come from several threads, which can't see a TestCase's transaction
+
+    # Menu items are copied to any shards as soon as they are saved
+    databases = '__all__'
+
+    def setUp(self):
+        coalescer.reset_metrics()
+        self.addCleanup(coalescer.reset_metrics)
+        self.client.defaults['HTTP_X_API_KEY'] = 'demo'
+        self.coffee = MenuItem.objects.create(name="Coffee", unit_price_p=350, vat_rate_percent=Decimal('20.0'))
+        self.tab = Tab.objects.create(table_number=1, covers=2)
+
+    @override_settings(ADD_ITEM_COALESCE_MS=1)
+    def test_single_add(self):
+        """Test a lone coalesced add responds as an uncoalesced one does"""
+        other = Tab.objects.create(table_number=2, covers=2)
+        url = lambda tab: reverse('add_menu_item', kwargs={'tab_id': tab.id})
+
+        coalesced = self.client.post(url(self.tab), {'menu_item_id': self.coffee.id, 'qty': 2}, format='json')
+        with override_settings(ADD_ITEM_COALESCE_MS=0):
+            direct = self.client.post(url(other), {'menu_item_id': self.coffee.id, 'qty': 2}, format='json')
+
+        self.assertEqual(coalesced.status_code, status.HTTP_201_CREATED)
+        self.assertEqual({**coalesced.data, 'id': None}, {**direct.data, 'id': None})
+        self.tab.refresh_from_db()
+        self.assertEqual(self.tab.total_p, coalesced.data['tab_totals']['total_p'])
+        self.assertEqual(TabEvent.objects.filter(tab_id=self.tab.id, kind=TabEvent.LINE_ADDED).count(), 1)
+        self.assertEqual(coalescer.metrics()['batches'], 1)
+
+    @override_settings(ADD_ITEM_COALESCE_MS=5000, ADD_ITEM_BATCH_MAX=5)
+    def test_concurrent_adds(self):
+        """Test concurrent adds share one transaction and each gets its own running totals"""
+        lines = {qty: pricing.price_line(self.coffee.unit_price_p, qty, self.coffee.vat_rate_bp) for qty in range(1, 6)}
+        barrier = threading.Barrier(len(lines))
+        results = {}
+
+        def add(qty):
+            try:
+                barrier.wait()
+                results[qty] = coalescer.add(self.tab.id, self.coffee, qty, lines[qty])
+            finally:
+                connection.close()
+
+        started = datetime.now()
+        threads = [threading.Thread(target=add, args=(qty,)) for qty in lines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # A full batch is written without waiting out ADD_ITEM_COALESCE_MS
+        self.assertLess(datetime.now() - started, timedelta(seconds=5))
+        self.assertEqual(len(results), 5)
+        # Totals run in the order the lines were stored
+        running = []
+        for tab_item, totals in sorted(results.values(), key=lambda result: result[0].id):
+            running.append(lines[tab_item.qty])
+            self.assertEqual(totals, pricing.total_lines(running))
+        self.tab.refresh_from_db()
+        self.assertEqual(
+            (self.tab.subtotal_p, self.tab.service_charge_p, self.tab.vat_total_p, self.tab.total_p),
+            tuple(pricing.total_lines(lines.values()))
+        )
+        self.assertEqual(TabItem.objects.filter(tab=self.tab).count(), 5)
+        metrics = coalescer.metrics()
+        self.assertEqual((metrics['batches'], metrics['adds'], metrics['mean_batch_size']), (1, 5, 5))
+        self.assertEqual(metrics['batch_sizes'][8], 1)
+        self.assertEqual(sum(metrics['waits_ms'].values()), 5)
+
+    @override_settings(ADD_ITEM_COALESCE_MS=1)
+    def test_closed_tab(self):
+        """Test a tab closed before its batch is written gets nothing added"""
+        line = pricing.price_line(self.coffee.unit_price_p, 1, self.coffee.vat_rate_bp)
+        Tab.objects.filter(id=self.tab.id).update(status='paid')
+
+        with self.assertRaises(coalescer.TabNotOpen):
+            coalescer.add(self.tab.id, self.coffee, 1, line)
+
+        self.assertFalse(TabItem.objects.filter(tab=self.tab).exists())
+        self.assertEqual(coalescer.metrics()['batches'], 0)
+
+    def test_metrics_command(self):
+        """Test the command shows the batch counts and can reset them"""
+        coalescer.record([0.001, 0.003])
+        out = StringIO()
+
+        call_command('add_item_batches', reset=True, stdout=out)
+
+        self.assertIn('Mean batch size:  2.00', out.getvalue())
+        self.assertIn('Mean added wait:  2.00 ms', out.getvalue())
+        self.assertEqual(coalescer.metrics()['batches'], 0)
@@ -4,5 +4,8 @@ from . import views
 urlpatterns = [
     path('tabs', views.CreateTabView.as_view(), name='create_tab'),
     path('tabs/<int:tab_id>', views.GetTabView.as_view(), name='get_tab'),
+    path('tables/<int:table_number>/tab', views.TableTabView.as_view(), name='table_tab'),
     path('tabs/<int:tab_id>/items', views.AddMenuItemView.as_view(), name='add_menu_item'),
+    path('quote', views.QuoteView.as_view(), name='quote'),
+    path('floor', views.FloorView.as_view(), name='floor'),
 ]
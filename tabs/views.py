@@ -1,15 +1,29 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from decimal import Decimal
+from django.db import IntegrityError
+from django.utils import timezone
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
+from epos import sharding
+from epos.replicas import replica_reads
+from epos.validation import CompiledSerializer
+from payment.snapshots import build_snapshots
 
-from .models import Tab, MenuItem, TabItem
+from . import coalescer, events, fast_serializers, floor, menu, pricing
+from .models import Tab, MenuItem, TabItem, TabArchive, OpenTab, TabEvent
 from .serializers import (
-    CreateTabSerializer, TabSerializer, AddMenuItemSerializer, 
-    TabItemSerializer, TabTotalsSerializer
+    CreateTabSerializer, TabSerializer, TabDetailSerializer, AddMenuItemSerializer, 
+    TabItemSerializer, QuoteRequestSerializer, QuoteSerializer,
+    FloorEntrySerializer
+)
+
+# Adding lines is the busiest write, check menu items against the in-memory set
+add_menu_item_validator = CompiledSerializer(
+    AddMenuItemSerializer, menu_item_id=menu.validate_menu_item_id
 )
 
 class CreateTabView(APIView):
@@ -32,32 +46,160 @@ class CreateTabView(APIView):
     def post(self, request):
         serializer = CreateTabSerializer(data=request.data)
         if serializer.is_valid():
-            tab = serializer.save()
-            response_serializer = TabSerializer(tab)
-            return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+            try:
+                with sharding.atomic():
+                    tab = serializer.save()
+                    floor.add(tab)
+                    events.record(
+                        tab.id, TabEvent.TAB_OPENED,
+                        table_number=tab.table_number,
+                        covers=tab.covers,
+                        opened_at=tab.opened_at
+                    )
+            except IntegrityError:
+                # Lost a race with another till opening a tab on the same table
+                return Response({
+                    'table_number': ['Table already has an open tab']
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # A new tab has no lines yet
+            data = fast_serializers.tab_data(fast_serializers.tab_row(tab), [])
+            return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Fields a tab read can be limited to, payments are only on paid and closed tabs
+TAB_READ_FIELDS = fast_serializers.RESPONSE_FIELDS + ('payments',)
+
+
+def requested_fields(request):
+    """
+    The fields asked for with ?fields= and ?exclude=
+
+    Returns:
+        (fields, unknown) where fields is None when every field is wanted
+    """
+    fields = request.query_params.get('fields')
+    exclude = request.query_params.get('exclude')
+    if fields is None and exclude is None:
+        return None, []
+
+    fields = [name for name in fields.split(',') if name] if fields is not None else TAB_READ_FIELDS
+    exclude = [name for name in exclude.split(',') if name] if exclude is not None else []
+    unknown = [name for name in [*fields, *exclude] if name not in TAB_READ_FIELDS]
+    return set(fields) - set(exclude), unknown
+
+
 class GetTabView(APIView):
     @extend_schema(
         summary="Get tab details",
-        description="Retrieve detailed information about a specific tab including items and totals",
+        description=(
+            "Retrieve detailed information about a specific tab including items and totals. "
+            "Paid and closed tabs are served from the snapshot frozen at payment time "
+            "(or from the archive once old enough), and also include a payments list. "
+            "Use fields or exclude to read less: a read without items, e.g. "
+            "?fields=status,total_p or ?exclude=items, is a single-row query for an open tab."
+        ),
         parameters=[
             OpenApiParameter(
                 name='tab_id',
                 type=OpenApiTypes.INT,
                 location=OpenApiParameter.PATH,
                 description='Tab ID'
+            ),
+            OpenApiParameter(
+                name='fields',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                description=f"Comma-separated fields to return, from: {', '.join(TAB_READ_FIELDS)}"
+            ),
+            OpenApiParameter(
+                name='exclude',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                description='Comma-separated fields to leave out, e.g. items'
             )
         ],
         responses={
-            200: TabSerializer,
+            200: TabDetailSerializer,
+            400: OpenApiTypes.OBJECT,
         }
     )
+    @replica_reads
     def get(self, request, tab_id):
-        tab = get_object_or_404(Tab, id=tab_id)
-        serializer = TabSerializer(tab)
-        return Response(serializer.data)
+        site = sharding.current_site()
+        fields, unknown = requested_fields(request)
+        if unknown:
+            return Response({
+                'error': f"Unknown fields: {', '.join(unknown)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if fields is not None and 'items' not in fields:
+            # Without the lines, one read of the tab row has everything except
+            # the payments of a paid or closed tab
+            data = fast_serializers.get_tab(fields=fields | {'status'}, id=tab_id, site=site)
+            if data is None:
+                return self.archived(tab_id, site, fields)
+            if 'payments' not in fields or data['status'] == 'open':
+                if 'status' not in fields:
+                    del data['status']
+                return Response(data)
+        
+        # The tab row, with its frozen snapshot when it has one
+        row = (
+            Tab.objects.filter(id=tab_id, site=site)
+            .values(*fast_serializers.TAB_FIELDS, 'snapshot__data')
+            .first()
+        )
+        if row is None:
+            return self.archived(tab_id, site, fields)
+        
+        # Paid and closed tabs never change, serve their frozen snapshot in one fetch
+        if row['snapshot__data'] is not None:
+            return Response(limit_fields(row['snapshot__data'], fields))
+        
+        if row['status'] != 'open':
+            # Paid or closed before snapshots were kept, build the same document
+            document = build_snapshots([tab_id]).get(tab_id)
+            if document is None:
+                return self.archived(tab_id, site, fields)
+            return Response(limit_fields(document, fields))
+        
+        items = TabItem.objects.filter(tab_id=tab_id).order_by('id').values(*fast_serializers.ITEM_FIELDS)
+        return Response(limit_fields(fast_serializers.tab_data(row, items), fields))
+    
+    def archived(self, tab_id, site, fields):
+        # Old tabs are only kept in the archive
+        archived = TabArchive.objects.filter(tab_id=tab_id, site=site).values_list('data', flat=True).first()
+        if archived is None:
+            raise Http404
+        return Response(limit_fields(archived, fields))
+
+
+class TableTabView(APIView):
+    @extend_schema(
+        summary="Get the open tab for a table",
+        description="Retrieve the current open tab for a table number, including items and totals",
+        parameters=[
+            OpenApiParameter(
+                name='table_number',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.PATH,
+                description='Table number'
+            )
+        ],
+        responses={
+            200: TabSerializer,
+        }
+    )
+    @replica_reads
+    def get(self, request, table_number):
+        # Served by the partial unique index on (site, table_number) WHERE status = 'open'
+        data = fast_serializers.get_tab(site=sharding.current_site(), table_number=table_number, status='open')
+        if data is None:
+            raise Http404
+        return Response(data)
 
 
 class AddMenuItemView(APIView):
@@ -78,8 +220,8 @@ class AddMenuItemView(APIView):
         ]
     )
     def post(self, request, tab_id):
-        # Get the tab
-        tab = get_object_or_404(Tab, id=tab_id)
+        # Get the tab, only at the requesting site
+        tab = get_object_or_404(Tab, id=tab_id, site=sharding.current_site())
         
         # Check if tab is open
         if tab.status != 'open':
@@ -87,45 +229,179 @@ class AddMenuItemView(APIView):
                 'error': 'Cannot add items to a closed or paid tab'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = AddMenuItemSerializer(data=request.data)
-        if serializer.is_valid():
-            menu_item_id = serializer.validated_data['menu_item_id']
-            qty = serializer.validated_data['qty']
+        validated_data, errors = add_menu_item_validator.validate(request.data)
+        if errors is None:
+            menu_item_id = validated_data['menu_item_id']
+            qty = validated_data['qty']
             
             # Get the menu item
             menu_item = get_object_or_404(MenuItem, id=menu_item_id)
             
             # Calculate line totals
-            line_subtotal_p = menu_item.unit_price_p * qty
-            vat_p = int(Decimal(line_subtotal_p) * menu_item.vat_rate_percent / 100)
-            line_total_p = line_subtotal_p + vat_p
+            line = pricing.price_line(menu_item.unit_price_p, qty, menu_item.vat_rate_bp)
             
-            # Create the tab item
-            tab_item = TabItem.objects.create(
-                tab=tab,
-                menu_item=menu_item,
-                qty=qty,
-                unit_price_p=menu_item.unit_price_p,
-                vat_rate_percent=menu_item.vat_rate_percent,
-                vat_p=vat_p,
-                line_total_p=line_total_p
-            )
-            
-            # Update tab totals
-            update_tab_totals(tab)
+            if settings.ADD_ITEM_COALESCE_MS:
+                # Written with other adds to this tab arriving alongside it
+                try:
+                    tab_item, totals = coalescer.add(tab.id, menu_item, qty, line)
+                except coalescer.TabNotOpen:
+                    return Response({
+                        'error': 'Cannot add items to a closed or paid tab'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                with sharding.atomic():
+                    # Lock the tab, the reaper or a payment may have closed it since it was read
+                    tab = Tab.objects.select_for_update().get(id=tab.id)
+                    if tab.status != 'open':
+                        return Response({
+                            'error': 'Cannot add items to a closed or paid tab'
+                        }, status=status.HTTP_400_BAD_REQUEST)
+                    
+                    # Create the tab item
+                    tab_item = TabItem.objects.create(
+                        tab=tab,
+                        menu_item=menu_item,
+                        qty=qty,
+                        unit_price_p=menu_item.unit_price_p,
+                        vat_rate_percent=menu_item.vat_rate_percent,
+                        vat_p=line.vat_p,
+                        line_total_p=line.line_total_p
+                    )
+                    
+                    # Update tab totals
+                    update_tab_totals(tab)
+                    floor.update_total(tab)
+                    
+                    events.record(
+                        tab.id, TabEvent.LINE_ADDED,
+                        tab_item_id=tab_item.id,
+                        menu_item_id=menu_item.id,
+                        qty=qty,
+                        unit_price_p=tab_item.unit_price_p,
+                        vat_p=tab_item.vat_p,
+                        line_total_p=tab_item.line_total_p
+                    )
+                    events.publish(
+                        tab, events.ITEM_ADDED,
+                        tab_item_id=tab_item.id,
+                        menu_item_name=menu_item.name,
+                        qty=qty,
+                        total_p=tab.total_p
+                    )
+                totals = tab
             
             # Prepare response data
-            response_data = TabItemSerializer(tab_item).data
-            response_data['tab_totals'] = TabTotalsSerializer({
-                'subtotal_p': tab.subtotal_p,
-                'service_charge_p': tab.service_charge_p,
-                'vat_total_p': tab.vat_total_p,
-                'total_p': tab.total_p
-            }).data
+            response_data = fast_serializers.item_data(fast_serializers.item_row(tab_item, menu_item))
+            response_data['tab_totals'] = {
+                'subtotal_p': totals.subtotal_p,
+                'service_charge_p': totals.service_charge_p,
+                'vat_total_p': totals.vat_total_p,
+                'total_p': totals.total_p
+            }
             
             return Response(response_data, status=status.HTTP_201_CREATED)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class QuoteView(APIView):
+    @extend_schema(
+        summary="Quote a basket",
+        description=(
+            "Price a list of menu items without writing anything. When tab_id is given "
+            "the totals are what the tab would show after the lines were added."
+        ),
+        request=QuoteRequestSerializer,
+        responses={
+            200: QuoteSerializer,
+        },
+        examples=[
+            OpenApiExample(
+                'Quote Example',
+                summary='Quote 2 coffees on tab 1',
+                description='Price 2 units of coffee (menu item ID 1) on top of tab 1',
+                value={'tab_id': 1, 'lines': [{'menu_item_id': 1, 'qty': 2}]}
+            )
+        ]
+    )
+    def post(self, request):
+        serializer = QuoteRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = serializer.validated_data['lines']
+        tab_id = serializer.validated_data.get('tab_id')
+
+        # Start from the tab's stored totals rather than re-reading its lines
+        subtotal_p = vat_total_p = 0
+        if tab_id is not None:
+            tab = get_object_or_404(
+                Tab.objects.only('status', 'subtotal_p', 'vat_total_p'), id=tab_id, site=sharding.current_site()
+            )
+            if tab.status != 'open':
+                return Response({
+                    'error': 'Cannot quote on a closed or paid tab'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            subtotal_p, vat_total_p = tab.subtotal_p, tab.vat_total_p
+
+        # Load every menu item in one query
+        menu = MenuItem.objects.in_bulk({line['menu_item_id'] for line in lines})
+        missing = sorted({line['menu_item_id'] for line in lines} - menu.keys())
+        if missing:
+            return Response({
+                'error': 'Menu item not found',
+                'menu_item_ids': missing
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        menu_items = [menu[line['menu_item_id']] for line in lines]
+        priced = pricing.price_lines(
+            (menu_item.unit_price_p, line['qty'], menu_item.vat_rate_bp)
+            for menu_item, line in zip(menu_items, lines)
+        )
+        totals = pricing.total_lines(priced, subtotal_p, vat_total_p)
+
+        return Response(QuoteSerializer({
+            'tab_id': tab_id,
+            'lines': [
+                {
+                    'menu_item_id': menu_item.id,
+                    'menu_item_name': menu_item.name,
+                    'qty': line['qty'],
+                    'unit_price_p': menu_item.unit_price_p,
+                    'vat_rate_percent': menu_item.vat_rate_percent,
+                    'vat_p': priced_line.vat_p,
+                    'line_total_p': priced_line.line_total_p,
+                }
+                for menu_item, line, priced_line in zip(menu_items, lines, priced)
+            ],
+            **totals._asdict(),
+        }).data)
+
+
+class FloorView(APIView):
+    @extend_schema(
+        summary="Get the floor",
+        description="List every open tab with its table number, covers, age and running total",
+        responses={
+            200: FloorEntrySerializer(many=True),
+        }
+    )
+    @replica_reads
+    def get(self, request):
+        entries = list(OpenTab.objects.filter(site=sharding.current_site()).order_by('table_number', 'opened_at').values(
+            'tab_id', 'table_number', 'covers', 'opened_at', 'total_p'
+        ))
+        now = timezone.now()
+        for entry in entries:
+            entry['age_seconds'] = int((now - entry['opened_at']).total_seconds())
+        return Response(FloorEntrySerializer(entries, many=True).data)
+
+
+def limit_fields(document, fields):
+    """A stored tab document cut down to some fields"""
+    if fields is None:
+        return document
+    return {key: value for key, value in document.items() if key in fields}
 
 
 def update_tab_totals(tab):
@@ -133,21 +409,17 @@ def update_tab_totals(tab):
     # Get all items for this tab
     tab_items = TabItem.objects.filter(tab=tab)
     
-    # Calculate subtotal (sum of line totals minus VAT)
+    # Sum line subtotals (line totals minus VAT) and VAT
     subtotal_p = sum(item.line_total_p - item.vat_p for item in tab_items)
-    
-    # Calculate total VAT
     vat_total_p = sum(item.vat_p for item in tab_items)
     
-    # Calculate service charge (10% of subtotal)
-    service_charge_p = int(Decimal(subtotal_p) * Decimal('0.10'))
-    
-    # Calculate total
-    total_p = subtotal_p + service_charge_p + vat_total_p
+    # Service charge and total
+    totals = pricing.tab_totals(subtotal_p, vat_total_p)
     
     # Update the tab
-    tab.subtotal_p = subtotal_p
-    tab.service_charge_p = service_charge_p
-    tab.vat_total_p = vat_total_p
-    tab.total_p = total_p
-    tab.save()
\ No newline at end of file
+    tab.subtotal_p = totals.subtotal_p
+    tab.service_charge_p = totals.service_charge_p
+    tab.vat_total_p = totals.vat_total_p
+    tab.total_p = totals.total_p
+    # Only the totals, so a stale copy of the tab can't reopen it
+    tab.save(update_fields=['subtotal_p', 'service_charge_p', 'vat_total_p', 'total_p'])